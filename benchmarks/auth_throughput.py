@@ -0,0 +1,101 @@
+"""
+Пропускная способность аутентифицированных запросов и входа в систему.
+
+Приложение FastAPI запускается в процессе (ASGI-транспорт httpx) с временной SQLite.
+Режим authenticated: параллельные запросы GET /users/me/ с одним токеном при выключенном
+и включенном кэше токенов. Режим login: параллельные запросы POST /token, во время которых
+корутина-метроном измеряет задержку цикла событий (bcrypt выполняется в пуле потоков).
+
+Запуск из корня проекта:
+    python -m benchmarks.auth_throughput --requests 2000 --logins 50 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+DATABASE_PATH = os.path.join(tempfile.mkdtemp(), "auth.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DATABASE_PATH}"
+os.environ.setdefault("PREDICTION_CACHE_REDIS", "0")
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from core.auth import token_cache  # noqa: E402
+
+TICK = 0.001
+
+
+async def metronome(lags: list, stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + TICK
+        await asyncio.sleep(TICK)
+        lags.append((loop.time() - expected) * 1000.0)
+
+
+async def measure(requests: int, concurrency: int, call) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    durations = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            response = await call()
+            response.raise_for_status()
+            durations.append((time.perf_counter() - started) * 1000.0)
+
+    lags = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(metronome(lags, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker
+    return {
+        "requests_per_second": requests / elapsed,
+        "request_p50_ms": float(np.percentile(durations, 50)),
+        "request_p99_ms": float(np.percentile(durations, 99)),
+        "loop_lag_p99_ms": float(np.percentile(lags, 99)) if lags else None,
+    }
+
+
+async def run(args) -> list:
+    reports = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        credentials = {"username": "bench", "password": "bench-password"}
+        (await client.post("/users/register", json=credentials)).raise_for_status()
+        token = (await client.post("/token", data=credentials)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        for ttl in (0, args.cache_ttl):
+            token_cache.ttl = ttl
+            token_cache.invalidate_user(1)
+            report = await measure(args.requests, args.concurrency,
+                                   lambda: client.get("/users/me/", headers=headers))
+            reports.append({"mode": "authenticated", "cache_ttl": ttl, **report})
+
+        report = await measure(args.logins, args.concurrency, lambda: client.post("/token", data=credentials))
+        reports.append({"mode": "login", **report})
+    return reports
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--cache-ttl", type=float, default=30)
+    args = parser.parse_args()
+    for report in asyncio.run(run(args)):
+        print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main_cli()
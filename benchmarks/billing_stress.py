@@ -0,0 +1,121 @@
+"""
+Нагрузочная проверка биллинга: много параллельных списаний с одного баланса.
+
+Режим naive повторяет старую схему (прочитать баланс, проверить, уменьшить в Python и сохранить),
+режим ledger использует атомарный резерв из core.billing. Для каждого режима выводятся пропускная
+способность, количество успешных списаний и итоговый баланс; для ledger дополнительно проверяется,
+что баланс не ушел в минус и совпадает с суммой журнала после возвратов.
+
+Запуск из корня проекта:
+    python -m benchmarks.billing_stress --requests 2000 --concurrency 100
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+DATABASE_PATH = os.path.join(tempfile.mkdtemp(), "billing.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DATABASE_PATH}"
+
+from sqlalchemy import select, func  # noqa: E402
+
+from core import billing  # noqa: E402
+from core.database import SessionLocal, AsyncSessionLocal  # noqa: E402
+from models.models import User, LedgerEntry  # noqa: E402
+
+
+def create_user(username: str, balance: float) -> int:
+    with SessionLocal() as db:
+        user = User(username=username, password="-", balance=balance)
+        db.add(user)
+        db.commit()
+        return user.id
+
+
+async def naive_debit(user_id: int, cost: float, job_id: str) -> bool:
+    async with AsyncSessionLocal() as db:
+        user = (await db.execute(select(User).where(User.id == user_id))).scalars().first()
+        if cost > user.balance:
+            return False
+        await asyncio.sleep(0)  # Другие запросы успевают прочитать тот же баланс
+        user.balance -= cost
+        await db.commit()
+        return True
+
+
+async def ledger_debit(user_id: int, cost: float, job_id: str) -> bool:
+    async with AsyncSessionLocal() as db:
+        try:
+            await billing.reserve(db, user_id, cost, job_id)
+        except billing.InsufficientFunds:
+            await db.rollback()
+            return False
+        await db.commit()
+        return True
+
+
+async def run(mode: str, requests: int, concurrency: int, balance: float, cost: float) -> dict:
+    user_id = create_user(mode, balance)
+    debit = naive_debit if mode == "naive" else ledger_debit
+    semaphore = asyncio.Semaphore(concurrency)
+    succeeded = []
+
+    async def one(i: int):
+        async with semaphore:
+            job_id = f"{mode}-{i}"
+            if await debit(user_id, cost, job_id):
+                succeeded.append(job_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+
+    report = {"mode": mode, "requests_per_second": requests / elapsed, "succeeded": len(succeeded),
+              "max_affordable": int(balance // cost)}
+    failed = []
+    with SessionLocal() as db:
+        if mode == "ledger":
+            # Часть задач "падает": возвраты пишутся в журнал и пакетно применяются к балансу
+            failed = random.Random(0).sample(succeeded, len(succeeded) // 10)
+            for job_id in failed:
+                billing.refund(db, job_id)
+            db.commit()
+            billing.apply_pending(db)
+            ledger_total = db.execute(select(func.sum(LedgerEntry.amount))
+                                      .where(LedgerEntry.user_id == user_id)).scalar()
+            report["refunded"] = len(failed)
+            report["ledger_consistent"] = abs(balance + ledger_total - db.get(User, user_id).balance) < 1e-6
+        final_balance = db.get(User, user_id).balance
+    report["final_balance"] = final_balance
+    # Ожидаемый итог: начальный баланс минус стоимость успешных и не возвращенных списаний
+    report["lost_updates"] = balance - (len(succeeded) - len(failed)) * cost != final_balance
+    report["overdraft"] = len(succeeded) * cost > balance
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--balance", type=float, default=10000)
+    parser.add_argument("--cost", type=float, default=10)
+    args = parser.parse_args()
+
+    async def run_all():
+        # Оба режима в одном цикле событий: пул асинхронного движка привязан к циклу
+        return [await run(mode, args.requests, args.concurrency, args.balance, args.cost)
+                for mode in ("naive", "ledger")]
+
+    reports = asyncio.run(run_all())
+    for report in reports:
+        print(json.dumps(report))
+    ledger = reports[-1]
+    assert not ledger["overdraft"] and ledger["final_balance"] >= 0, "ledger billing overdrafted"
+    assert ledger["ledger_consistent"], "materialized balance differs from the ledger"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Проверка совпадения скомпилированного gb_model с sklearn и сравнение пропускной способности,
+а также проверка и скорость атрибуции по путям в деревьях (объяснения предсказаний).
+
+Запуск из корня проекта:
+    python -m benchmarks.compiled_trees --samples 20000
+"""
+import argparse
+import time
+
+import joblib
+import numpy as np
+
+from utils.compiled_trees import compile_gradient_boosting, verify_equivalence
+
+
+def throughput(predict, X, repeats: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeats):
+        predict(X)
+    return repeats * X.shape[0] / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="ml_models/gb_model.joblib")
+    parser.add_argument("--samples", type=int, default=20000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    model = joblib.load(args.model)
+    compiled = compile_gradient_boosting(model)
+    rng = np.random.default_rng(42)
+    X = rng.integers(0, 2, size=(args.samples, compiled.n_features))
+
+    # Бинарные входы идут через таблицу листьев, вещественные - через обход деревьев
+    assert verify_equivalence(model, compiled, X), "binary inputs: predictions differ"
+    assert verify_equivalence(model, compiled, rng.random((1000, compiled.n_features))), "real inputs: predictions differ"
+    assert np.array_equal(model.decision_function(X), compiled.decision_function(X)), "raw scores differ"
+    print("equivalence: OK")
+
+    for batch_size in (1, 64, args.samples):
+        batch = X[:batch_size]
+        repeats = max(args.repeats, 2000 // batch_size)
+        sklearn_rate = throughput(model.predict, batch, repeats)
+        compiled_rate = throughput(compiled.predict, batch, repeats)
+        print(f"batch={batch_size:>6}  sklearn={sklearn_rate:>12.0f} rows/s  compiled={compiled_rate:>12.0f} rows/s  "
+              f"speedup={compiled_rate / sklearn_rate:.1f}x")
+
+    # Сумма вкладов и базового значения должна давать логит; первый вызов строит таблицу листьев
+    started = time.perf_counter()
+    values, base_value = compiled.path_contributions(X[:1])
+    print(f"attribution table: {(time.perf_counter() - started) * 1000:.1f} ms")
+    values, base_value = compiled.path_contributions(X)
+    assert np.allclose(values.sum(axis=1) + base_value, compiled.decision_function(X)), "attribution does not add up"
+    for batch_size in (1, 64, args.samples):
+        batch = X[:batch_size]
+        rate = throughput(compiled.path_contributions, batch, max(args.repeats, 2000 // batch_size))
+        print(f"batch={batch_size:>6}  attribution={rate:>12.0f} rows/s")
+
+
+if __name__ == '__main__':
+    main()
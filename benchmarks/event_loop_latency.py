@@ -0,0 +1,129 @@
+"""
+Задержка цикла событий при работе с БД через синхронную сессию (как раньше в async-обработчиках)
+и через асинхронную сессию.
+
+Конкурентные корутины выполняют транзакцию как в /predict/ (чтение пользователя, запись Prediction,
+списание баланса, commit), параллельно фоновый поток периодически держит блокировку записи SQLite,
+имитируя медленный commit. Отдельная корутина-метроном измеряет, насколько позже запланированного
+она просыпается.
+
+Запуск из корня проекта:
+    python -m benchmarks.event_loop_latency --requests 500 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+DATABASE_PATH = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DATABASE_PATH}"
+
+from sqlalchemy import select  # noqa: E402
+
+from core.database import SessionLocal, AsyncSessionLocal  # noqa: E402
+from models.models import User, Prediction  # noqa: E402
+
+TICK = 0.001
+
+
+async def metronome(lags: list, stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + TICK
+        await asyncio.sleep(TICK)
+        lags.append((loop.time() - expected) * 1000.0)
+
+
+def slow_writer(hold_ms: float, period_ms: float, stop: threading.Event):
+    connection = sqlite3.connect(DATABASE_PATH, timeout=30, isolation_level=None)
+    while not stop.is_set():
+        connection.execute("BEGIN IMMEDIATE")
+        time.sleep(hold_ms / 1000.0)
+        connection.execute("COMMIT")
+        time.sleep(period_ms / 1000.0)
+    connection.close()
+
+
+async def sync_transaction(user_id: int):
+    # Так работали async-обработчики до перехода на асинхронную сессию: блокирующие вызовы в цикле событий
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.id == user_id).first()
+        db.add(Prediction(user_id=user.id, cost=1))
+        user.balance -= 1
+        db.commit()
+    finally:
+        db.close()
+
+
+async def async_transaction(user_id: int):
+    async with AsyncSessionLocal() as db:
+        user = (await db.execute(select(User).where(User.id == user_id))).scalars().first()
+        db.add(Prediction(user_id=user.id, cost=1))
+        user.balance -= 1
+        await db.commit()
+
+
+async def run(mode: str, requests: int, concurrency: int, user_id: int) -> dict:
+    transaction = sync_transaction if mode == "sync" else async_transaction
+    semaphore = asyncio.Semaphore(concurrency)
+    durations = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await transaction(user_id)
+            durations.append((time.perf_counter() - started) * 1000.0)
+
+    lags = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(metronome(lags, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker
+    return {
+        "mode": mode,
+        "requests_per_second": requests / elapsed,
+        "request_p50_ms": float(np.percentile(durations, 50)),
+        "request_p99_ms": float(np.percentile(durations, 99)),
+        "loop_lag_p50_ms": float(np.percentile(lags, 50)),
+        "loop_lag_p99_ms": float(np.percentile(lags, 99)),
+        "loop_lag_max_ms": float(np.max(lags)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--lock-hold-ms", type=float, default=20, help="Сколько фоновый писатель держит блокировку")
+    parser.add_argument("--lock-period-ms", type=float, default=100, help="Пауза между блокировками")
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        user = User(username="bench", password="-", balance=10 ** 9)
+        db.add(user)
+        db.commit()
+        user_id = user.id
+
+    stop = threading.Event()
+    writer = threading.Thread(target=slow_writer, args=(args.lock_hold_ms, args.lock_period_ms, stop), daemon=True)
+    writer.start()
+    try:
+        for mode in ("sync", "async"):
+            print(json.dumps(asyncio.run(run(mode, args.requests, args.concurrency, user_id))))
+    finally:
+        stop.set()
+        writer.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Сравнение разбора документов с признаками: прежний путь read_user_data + preprocess_user_input
+(список значений в порядке ключей JSON) и разбор по схеме признаков в заранее выделенный массив.
+
+Для компактных форматов (utils.encodings) выводятся размер образца и скорость декодирования.
+Заодно проверяется, что документ с переставленными ключами дает тот же вектор,
+а документ с лишним или недостающим признаком отклоняется.
+
+Запуск из корня проекта:
+    python -m benchmarks.feature_parsing --documents 10000
+"""
+import argparse
+import io
+import json
+import random
+import time
+
+import numpy as np
+
+from utils.encodings import decode_bitset, decode_frames, decode_npy, encode_bitset, encode_frames
+from utils.features import SchemaMismatch, get_feature_schema
+from utils.preprocessing import read_user_data, preprocess_user_input
+
+
+def legacy_preprocess(user_data: dict) -> list:
+    # Прежняя реализация preprocess_user_input: порядок признаков определялся порядком ключей документа
+    features = user_data.get("features")
+    if not features or len(features) != 241:
+        raise ValueError("Некорректный формат данных: ожидается 241 признак.")
+    return list(features.values())
+
+
+def rate(function, repeats: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return repeats / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=10000, help="Количество документов в пакетном режиме")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    schema = get_feature_schema()
+    rng = np.random.default_rng(args.seed)
+    documents = [{"features": dict(zip(schema.names, rng.integers(0, 2, len(schema)).tolist()))}
+                 for _ in range(args.documents)]
+    payloads = [json.dumps(document).encode() for document in documents]
+
+    # Порядок ключей не должен влиять на вход модели
+    shuffled = list(documents[0]["features"].items())
+    random.Random(args.seed).shuffle(shuffled)
+    expected = np.asarray(list(documents[0]["features"].values()), dtype=float)
+    assert np.array_equal(preprocess_user_input({"features": dict(shuffled)}), expected), "key order changes input"
+    for broken in ({**documents[0]["features"], "UNKNOWN": 1}, dict(shuffled[1:])):
+        try:
+            preprocess_user_input({"features": broken})
+            raise AssertionError("schema mismatch is not detected")
+        except SchemaMismatch:
+            pass
+    print("schema checks: OK")
+
+    single = payloads[0]
+    legacy_rate = rate(lambda: np.asarray(legacy_preprocess(read_user_data(single))), 20000)
+    schema_rate = rate(lambda: preprocess_user_input(read_user_data(single)), 20000)
+    print(f"single document: legacy={legacy_rate:>10.0f} docs/s  schema={schema_rate:>10.0f} docs/s  "
+          f"speedup={schema_rate / legacy_rate:.2f}x")
+
+    parsed = [read_user_data(payload) for payload in payloads]
+    legacy_rate = rate(lambda: np.asarray([legacy_preprocess(document) for document in parsed]),
+                       args.repeats) * args.documents
+    schema_rate = rate(lambda: schema.parse_many((document["features"] for document in parsed), len(parsed)),
+                       args.repeats) * args.documents
+    print(f"batch of {args.documents}: legacy={legacy_rate:>10.0f} docs/s  schema={schema_rate:>10.0f} docs/s  "
+          f"speedup={schema_rate / legacy_rate:.2f}x  (JSON already decoded)")
+
+    # Компактные двоичные форматы: размер одного образца и скорость декодирования пакета
+    X = schema.parse_many((document["features"] for document in documents), len(documents)).astype(np.uint8)
+    npy_buffer = io.BytesIO()
+    np.save(npy_buffer, X)
+    encoded = {
+        "json": (sum(map(len, payloads)), lambda: schema.parse_many(
+            (read_user_data(payload)["features"] for payload in payloads), len(payloads))),
+        "npy": (npy_buffer.tell(), lambda: decode_npy(npy_buffer.getbuffer(), len(schema))),
+        "frames (bytes)": (len(encode_frames(X, packed=False)),
+                           lambda data=encode_frames(X, packed=False): decode_frames(data, len(schema))),
+        "frames (bits)": (len(encode_frames(X)), lambda data=encode_frames(X): decode_frames(data, len(schema))),
+    }
+    for name, (size, decode) in encoded.items():
+        assert np.array_equal(decode(), X), f"{name}: decoded samples differ"
+        print(f"{name:>15}: {size / args.documents:>8.1f} bytes/sample  "
+              f"{rate(decode, args.repeats) * args.documents:>12.0f} samples/s")
+    single = encode_bitset(X[0])
+    print(f"{'bits (single)':>15}: {len(single):>8} bytes/sample  "
+          f"{rate(lambda: decode_bitset(single, len(schema)), 20000):>12.0f} samples/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""
+Сквозное нагрузочное тестирование цепочки register -> token -> upload_file -> predict -> get_prediction_status.
+
+Все работает в одном процессе и без внешних сервисов: API вызывается через ASGI-транспорт httpx,
+брокер Celery - in-memory (memory://), worker запускается в потоке этого же процесса,
+БД - временная SQLite. Файлы с 241 бинарным признаком генерируются по образцу
+test_input_files/test.json: у каждого признака своя частота появления, как в реальных выгрузках.
+
+Виртуальные пользователи приходят с заданной интенсивностью (поток Пуассона), каждый
+регистрируется, получает токен и выполняет несколько предсказаний, опрашивая статус до завершения.
+Количество одновременных HTTP-запросов ограничено --concurrency.
+
+Результат - JSON: пропускная способность и p50/p95/p99 задержки по каждому эндпоинту,
+время ожидания задачи в очереди (от публикации до начала выполнения в worker'е) и полное время
+от загрузки файла до готового результата. Отчеты разных коммитов можно сравнивать между собой.
+
+Запуск из корня проекта:
+    python -m benchmarks.load_test --users 20 --predictions-per-user 5 --arrival-rate 5 --output report.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+WORK_DIRECTORY = tempfile.mkdtemp(prefix="load_test_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORK_DIRECTORY, 'load.db')}"
+os.environ["UPLOAD_DIRECTORY"] = os.path.join(WORK_DIRECTORY, "uploads")
+os.environ["PREDICTION_CACHE_REDIS"] = "0"
+os.environ["JOB_EVENTS_ENABLED"] = "0"
+
+import httpx  # noqa: E402
+from celery.contrib.testing.worker import start_worker  # noqa: E402
+from celery.signals import before_task_publish, task_prerun  # noqa: E402
+
+import main  # noqa: E402
+from core.config import QUEUE_DEFAULT  # noqa: E402
+from core.queues import QUEUES  # noqa: E402
+from core.worker import app as celery_app  # noqa: E402
+
+SAMPLE_FILE = os.path.join("test_input_files", "test.json")
+FINAL_STATUSES = ("finished", "failed", "not_found")
+
+
+class Recorder:
+    """
+    Задержки по эндпоинтам и время ожидания задач в очереди.
+    """
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.end_to_end = []
+        self.queue_waits = []
+        self._published = {}
+        self._lock = threading.Lock()
+
+    def task_published(self, task_id: str):
+        with self._lock:
+            self._published[task_id] = time.perf_counter()
+
+    def task_started(self, task_id: str):
+        with self._lock:
+            published = self._published.pop(task_id, None)
+            if published is not None:
+                self.queue_waits.append((time.perf_counter() - published) * 1000.0)
+
+
+recorder = Recorder()
+
+
+@before_task_publish.connect
+def _on_publish(sender=None, headers=None, **kwargs):
+    recorder.task_published(headers["id"])
+
+
+@task_prerun.connect
+def _on_prerun(task_id=None, **kwargs):
+    recorder.task_started(task_id)
+
+
+class FeatureFileFactory:
+    """
+    Генератор файлов признаков в формате test_input_files/test.json.
+    """
+
+    def __init__(self, seed: int):
+        with open(SAMPLE_FILE) as sample:
+            self.names = list(json.load(sample)["features"])
+        self.random = np.random.default_rng(seed)
+        # Частоты признаков: большинство разрешений встречается редко, часть - почти в каждом приложении
+        self.rates = self.random.beta(0.5, 2.0, size=len(self.names))
+
+    def make(self) -> bytes:
+        flags = (self.random.random(len(self.names)) < self.rates).astype(int)
+        return json.dumps({"features": dict(zip(self.names, flags.tolist()))}).encode()
+
+
+async def call(client: httpx.AsyncClient, semaphore: asyncio.Semaphore, endpoint: str, method: str, url: str,
+               **kwargs) -> httpx.Response:
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except Exception:
+            recorder.errors[endpoint] += 1
+            raise
+        recorder.latencies[endpoint].append((time.perf_counter() - started) * 1000.0)
+    if response.status_code >= 400:
+        recorder.errors[endpoint] += 1
+    return response
+
+
+async def virtual_user(index: int, client: httpx.AsyncClient, semaphore: asyncio.Semaphore,
+                       files: FeatureFileFactory, args):
+    credentials = {"username": f"load-{index}", "password": f"password-{index}"}
+    await call(client, semaphore, "register", "POST", "/users/register", json=credentials)
+    response = await call(client, semaphore, "token", "POST", "/token", data=credentials)
+    if response.status_code != 200:
+        return
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    # Пополняем баланс заранее, чтобы нагрузка не упиралась в проверку кредитов; в отчет не входит
+    await client.put("/users/update_balance", params={"amount": args.predictions_per_user * 100}, headers=headers)
+
+    for _ in range(args.predictions_per_user):
+        started = time.perf_counter()
+        response = await call(client, semaphore, "upload_file", "POST", "/upload_file/",
+                              files={"file": ("sample.json", files.make())})
+        if response.status_code != 200:
+            continue
+        response = await call(client, semaphore, "predict", "POST", "/predict/", headers=headers,
+                              params={"file_id": response.json()["file_id"],
+                                      "model_name": random.choice(args.models)})
+        if response.status_code != 200:
+            continue
+        job = response.json()
+        status = job.get("status")
+        deadline = time.perf_counter() + args.status_timeout
+        while status not in FINAL_STATUSES and time.perf_counter() < deadline:
+            await asyncio.sleep(args.poll_interval)
+            response = await call(client, semaphore, "get_prediction_status", "GET",
+                                  f"/get_prediction_status/{job['job_id']}")
+            status = response.json().get("status") if response.status_code == 200 else None
+        if status == "finished":
+            recorder.end_to_end.append((time.perf_counter() - started) * 1000.0)
+        else:
+            recorder.errors["end_to_end"] += 1
+
+
+def summary(values: list, elapsed: float = None) -> dict:
+    if not values:
+        return {"count": 0}
+    report = {
+        "count": len(values),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(np.max(values)),
+    }
+    if elapsed:
+        report["per_second"] = len(values) / elapsed
+    return report
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> float:
+    files = FeatureFileFactory(args.seed)
+    random.seed(args.seed)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    arrivals = random.Random(args.seed)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=None) as client:
+        users = []
+        started = time.perf_counter()
+        for index in range(args.users):
+            users.append(asyncio.create_task(virtual_user(index, client, semaphore, files, args)))
+            if args.arrival_rate > 0:
+                await asyncio.sleep(arrivals.expovariate(args.arrival_rate))
+        await asyncio.gather(*users)
+        return time.perf_counter() - started
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="Количество виртуальных пользователей")
+    parser.add_argument("--predictions-per-user", type=int, default=5)
+    parser.add_argument("--arrival-rate", type=float, default=5.0,
+                        help="Интенсивность прихода пользователей в секунду, 0 - все сразу")
+    parser.add_argument("--concurrency", type=int, default=32, help="Максимум одновременных HTTP-запросов")
+    parser.add_argument("--workers", type=int, default=4, help="Потоки worker'а Celery")
+    parser.add_argument("--models", default="lr_model,gb_model", help="Модели через запятую, выбираются случайно")
+    parser.add_argument("--poll-interval", type=float, default=0.05, help="Интервал опроса статуса, секунды")
+    parser.add_argument("--status-timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Файл для JSON-отчета")
+    args = parser.parse_args()
+    args.models = args.models.split(",")
+
+    # Интервал опроса in-memory брокера по умолчанию - секунда, он исказил бы время ожидания в очереди
+    celery_app.conf.update(broker_url="memory://", result_backend="cache+memory://",
+                           broker_transport_options={"polling_interval": 0.005})
+    # Один worker обслуживает все очереди предсказаний (в рабочей конфигурации у каждой очереди свой worker)
+    with start_worker(celery_app, pool="threads", concurrency=args.workers, perform_ping_check=False,
+                      loglevel="WARNING", shutdown_timeout=30, queues=[*QUEUES, QUEUE_DEFAULT]):
+        elapsed = asyncio.run(run(args))
+
+    report = {
+        "commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "elapsed_s": elapsed,
+        "endpoints": {endpoint: {**summary(values, elapsed), "errors": recorder.errors.get(endpoint, 0)}
+                      for endpoint, values in recorder.latencies.items()},
+        "queue_wait": summary(recorder.queue_waits),
+        "end_to_end": {**summary(recorder.end_to_end, elapsed), "errors": recorder.errors.get("end_to_end", 0)},
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as report_file:
+            report_file.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,322 @@
+"""
+Архив завершенных предсказаний старше RETENTION_DAYS.
+
+Строки переносятся из таблицы predictions в файлы Parquet, разбитые по дням создания:
+    ARCHIVE_DIRECTORY/predictions/day=YYYY-MM-DD/part-<первый id>-<последний id>.parquet
+Внутри файла строки отсортированы по (user_id, created_at), поэтому по статистике групп строк
+выборка одного пользователя читает только его группы, а выборка за период - только нужные дни.
+Результат хранится типизированно: целое число - класс (predicted_class), дробное - вероятность
+(probability). В result_text попадают сообщения об ошибках, нечисловые результаты и исходная запись
+числа, если она не восстанавливается из типизированного значения (например, класс "1.0").
+
+Пакетные задачи в архив не переносятся: их построчные результаты остаются в bulk_results.
+"""
+import glob
+import os
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from sqlalchemy import select, delete
+
+from core.config import (ARCHIVE_DIRECTORY, RETENTION_DAYS, RETENTION_BATCH_SIZE, ARCHIVE_ROW_GROUP_SIZE,
+                         ARCHIVE_COMPACT_FILES)
+from core.database import SessionLocal
+from core.worker import app
+from models.models import Prediction
+
+PREDICTIONS_DIRECTORY = os.path.join(ARCHIVE_DIRECTORY, "predictions")
+PARTITION_PREFIX = "day="
+DELETE_CHUNK = 500  # Идентификаторов в одном DELETE (ограничение количества параметров SQLite)
+
+ARCHIVE_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("job_id", pa.string()),
+    ("user_id", pa.int64()),
+    ("model_name", pa.string()),
+    ("model_version", pa.string()),
+    ("status", pa.string()),
+    ("predicted_class", pa.int64()),
+    ("probability", pa.float64()),
+    ("result_text", pa.string()),
+    ("cost", pa.float64()),
+    ("samples", pa.int32()),
+    ("queue", pa.string()),
+    ("created_at", pa.timestamp("us")),
+    ("finished_at", pa.timestamp("us")),
+])
+
+ARCHIVE_COLUMNS = (
+    Prediction.id,
+    Prediction.job_id,
+    Prediction.user_id,
+    Prediction.model_name,
+    Prediction.model_version,
+    Prediction.status,
+    Prediction.result,
+    Prediction.cost,
+    Prediction.samples,
+    Prediction.queue,
+    Prediction.created_at,
+    Prediction.finished_at,
+)
+
+
+def split_result(result: Optional[str]) -> tuple:
+    """
+    Раскладывает строковый результат по типизированным колонкам.
+    :return:    Тройка (predicted_class, probability, result_text)
+    """
+    if result is None:
+        return None, None, None
+    try:
+        value = float(result)
+    except ValueError:
+        return None, None, result
+    if value.is_integer():
+        predicted_class = int(value)
+        return predicted_class, None, (None if str(predicted_class) == result else result)
+    return None, value, (None if str(value) == result else result)
+
+
+def join_result(predicted_class, probability, result_text) -> Optional[str]:
+    """
+    Строковый результат в том виде, в котором он хранился в таблице predictions.
+    """
+    if result_text is not None:
+        return result_text
+    if predicted_class is not None:
+        return str(predicted_class)
+    if probability is not None:
+        return str(probability)
+    return None
+
+
+def _to_table(rows) -> pa.Table:
+    columns = {name: [] for name in ARCHIVE_SCHEMA.names}
+    for row in rows:
+        item = row._mapping
+        predicted_class, probability, result_text = split_result(item["result"])
+        columns["predicted_class"].append(predicted_class)
+        columns["probability"].append(probability)
+        columns["result_text"].append(result_text)
+        for name in ("id", "job_id", "user_id", "model_name", "model_version", "status", "cost", "samples", "queue",
+                     "created_at", "finished_at"):
+            columns[name].append(item[name])
+    return pa.table(columns, schema=ARCHIVE_SCHEMA)
+
+
+def _partition_directory(day: str) -> str:
+    return os.path.join(PREDICTIONS_DIRECTORY, f"{PARTITION_PREFIX}{day}")
+
+
+def _write_sorted(table: pa.Table, path: str):
+    # Файл появляется под своим именем только целиком
+    table = table.sort_by([("user_id", "ascending"), ("created_at", "ascending"), ("id", "ascending")])
+    tmp_path = f"{path}.tmp"
+    pq.write_table(table, tmp_path, row_group_size=ARCHIVE_ROW_GROUP_SIZE, compression="zstd")
+    os.replace(tmp_path, path)
+
+
+def write_partitions(table: pa.Table) -> list:
+    """
+    Записывает строки в разделы по дням создания.
+    :return:    Пути записанных файлов
+    """
+    days = pc.strftime(table["created_at"], format="%Y-%m-%d")
+    paths = []
+    for day in pc.unique(days).to_pylist():
+        part = table.filter(pc.equal(days, day))
+        ids = part["id"]
+        directory = _partition_directory(day)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{pc.min(ids).as_py():012d}-{pc.max(ids).as_py():012d}.parquet")
+        _write_sorted(part, path)
+        paths.append(path)
+        compact_partition(day)
+    return paths
+
+
+def compact_partition(day: str, max_files: int = ARCHIVE_COMPACT_FILES):
+    """
+    Объединяет файлы раздела в один, если их накопилось больше max_files:
+    каждый перенос добавляет в раздел по файлу, а мелкие файлы замедляют чтение.
+    """
+    paths = sorted(glob.glob(os.path.join(_partition_directory(day), "part-*.parquet")))
+    if len(paths) <= max_files:
+        return
+    table = _deduplicate(pa.concat_tables([pq.read_table(path, schema=ARCHIVE_SCHEMA) for path in paths]))
+    ids = table["id"]
+    merged = os.path.join(_partition_directory(day),
+                          f"part-{pc.min(ids).as_py():012d}-{pc.max(ids).as_py():012d}.parquet")
+    _write_sorted(table, merged)
+    for path in paths:
+        if path != merged:
+            os.remove(path)
+
+
+def archive_older_than(db, cutoff: datetime, batch_size: int = RETENTION_BATCH_SIZE) -> int:
+    """
+    Переносит в архив одну порцию завершенных одиночных предсказаний, созданных раньше cutoff.
+    Строки удаляются из таблицы после записи файлов; если процесс прервется между этими шагами,
+    строки будут записаны повторно, а при чтении архива дубликаты по id отбрасываются.
+    :param db:  БД
+    :param cutoff:  Граница возраста
+    :param batch_size:  Максимальное количество строк
+    :return:    Количество перенесенных строк
+    """
+    rows = db.execute(
+        select(*ARCHIVE_COLUMNS)
+        .where(Prediction.created_at < cutoff, Prediction.status.is_not(None), Prediction.samples == 1)
+        .order_by(Prediction.created_at, Prediction.id)
+        .limit(batch_size)
+    ).all()
+    if not rows:
+        return 0
+    write_partitions(_to_table(rows))
+    ids = [row.id for row in rows]
+    for start in range(0, len(ids), DELETE_CHUNK):
+        db.execute(delete(Prediction).where(Prediction.id.in_(ids[start:start + DELETE_CHUNK]))
+                   .execution_options(synchronize_session=False))
+    db.commit()
+    return len(rows)
+
+
+@app.task
+def archive_predictions():
+    """
+    Периодическая задача: перенос предсказаний старше RETENTION_DAYS в архив.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=RETENTION_DAYS)
+    moved = 0
+    with SessionLocal() as db:
+        while True:
+            count = archive_older_than(db, cutoff)
+            moved += count
+            if count < RETENTION_BATCH_SIZE:
+                return moved
+
+
+def partition_days(created_from: Optional[datetime] = None, created_to: Optional[datetime] = None) -> list:
+    """
+    Дни архива, пересекающиеся с периодом, от новых к старым.
+    """
+    if not os.path.isdir(PREDICTIONS_DIRECTORY):
+        return []
+    days = [name[len(PARTITION_PREFIX):] for name in os.listdir(PREDICTIONS_DIRECTORY)
+            if name.startswith(PARTITION_PREFIX)]
+    if created_from is not None:
+        days = [day for day in days if day >= f"{created_from:%Y-%m-%d}"]
+    if created_to is not None:
+        days = [day for day in days if day <= f"{created_to:%Y-%m-%d}"]
+    return sorted(days, reverse=True)
+
+
+def horizon() -> Optional[datetime]:
+    """
+    Граница архива: все архивные строки созданы раньше этого момента (начало дня после последнего раздела).
+    None - архив пуст.
+    """
+    days = partition_days()
+    if not days:
+        return None
+    return datetime.strptime(days[0], "%Y-%m-%d") + timedelta(days=1)
+
+
+def _timestamp(value: datetime) -> pa.Scalar:
+    return pa.scalar(value, type=pa.timestamp("us"))
+
+
+def archive_filter(user_id: Optional[int] = None, created_from: Optional[datetime] = None,
+                   created_to: Optional[datetime] = None, result: Optional[str] = None,
+                   status: Optional[str] = None, model_name: Optional[str] = None,
+                   before: Optional[tuple] = None) -> Optional[ds.Expression]:
+    """
+    Условие выборки из архива с теми же фильтрами, что и у истории в таблице predictions.
+    :param before:  Ключ (created_at, id): только строки, идущие после него в порядке от новых к старым
+    """
+    conditions = []
+    if user_id is not None:
+        conditions.append(ds.field("user_id") == user_id)
+    if created_from is not None:
+        conditions.append(ds.field("created_at") >= _timestamp(created_from))
+    if created_to is not None:
+        conditions.append(ds.field("created_at") < _timestamp(created_to))
+    if status is not None:
+        conditions.append(ds.field("status") == status)
+    if model_name is not None:
+        conditions.append(ds.field("model_name") == model_name)
+    if result is not None:
+        # Одинаковые строки раскладываются одинаково, поэтому сравнивается то поле, в котором строка хранится
+        predicted_class, probability, result_text = split_result(result)
+        if result_text is not None:
+            conditions.append(ds.field("result_text") == result_text)
+        elif predicted_class is not None:
+            conditions.append((ds.field("predicted_class") == predicted_class) & ds.field("result_text").is_null())
+        else:
+            conditions.append((ds.field("probability") == probability) & ds.field("result_text").is_null())
+    if before is not None:
+        created_at, prediction_id = before
+        conditions.append((ds.field("created_at") < _timestamp(created_at))
+                          | ((ds.field("created_at") == _timestamp(created_at)) & (ds.field("id") < prediction_id)))
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def _deduplicate(table: pa.Table) -> pa.Table:
+    ids = table["id"].to_numpy()
+    _, first = np.unique(ids, return_index=True)
+    if len(first) == len(ids):
+        return table
+    return table.take(np.sort(first))
+
+
+def iter_archive(limit: Optional[int] = None, created_from: Optional[datetime] = None,
+                 created_to: Optional[datetime] = None, **filters) -> Iterator[pa.Table]:
+    """
+    Строки архива по дням, от новых к старым (created_at, id по убыванию).
+    Читаются только разделы периода, а в них - группы строк, которые могут пройти фильтр.
+    :param limit:   Максимальное количество строк; чтение останавливается, как только оно набрано
+    :param created_from:    Начало периода (включительно)
+    :param created_to:  Конец периода (не включительно)
+    :param filters: Остальные условия archive_filter
+    """
+    expression = archive_filter(created_from=created_from, created_to=created_to, **filters)
+    if filters.get("status") == "pending":
+        return
+    for day in partition_days(created_from, created_to):
+        paths = glob.glob(os.path.join(_partition_directory(day), "part-*.parquet"))
+        if not paths:
+            continue
+        table = ds.dataset(paths, schema=ARCHIVE_SCHEMA, format="parquet").to_table(filter=expression)
+        if not table.num_rows:
+            continue
+        table = _deduplicate(table).sort_by([("created_at", "descending"), ("id", "descending")])
+        if limit is not None:
+            table = table.slice(0, limit)
+            limit -= table.num_rows
+        yield table
+        if limit is not None and limit <= 0:
+            return
+
+
+def history_rows(table: pa.Table) -> list:
+    """
+    Строки архива в формате истории предсказаний (как utils.history.row_to_dict).
+    """
+    rows = []
+    for item in table.to_pylist():
+        result = join_result(item.pop("predicted_class"), item.pop("probability"), item.pop("result_text"))
+        item.pop("queue")
+        item["result"] = result
+        for field in ("created_at", "finished_at"):
+            if item[field] is not None:
+                item[field] = item[field].isoformat()
+        rows.append(item)
+    return rows
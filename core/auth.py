@@ -1,18 +1,111 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
 from fastapi import HTTPException, status, Depends
-from models.models import User
-from core.database import get_db
-from sqlalchemy.orm import Session
+from models.models import User, pwd_context
+from core.database import get_async_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from schema.schemas import TokenData
-from core.config import SECRET_KEY
+from core.config import SECRET_KEY, AUTH_CACHE_TTL, AUTH_CACHE_SIZE, PASSWORD_HASH_WORKERS
 
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Пул потоков для bcrypt: хэширование занимает десятки миллисекунд и не должно выполняться в цикле событий
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """
+    Снимок данных пользователя, который хранится в кэше токенов.
+    """
+    id: int
+    username: str
+    balance: float
+
+    @classmethod
+    def from_orm(cls, user: User) -> "CurrentUser":
+        return cls(id=user.id, username=user.username, balance=user.balance)
+
+
+class TokenCache:
+    """
+    Кэш расшифрованных токенов: токен -> снимок пользователя с коротким временем жизни.
+    Записи пользователя сбрасываются, когда этот процесс API меняет его баланс; изменения,
+    сделанные в других процессах (возвраты worker'а), становятся видны не позже чем через ttl.
+    Баланс из снимка используется только для предварительной проверки, списание атомарно в billing.reserve.
+    """
+
+    def __init__(self, ttl: float = AUTH_CACHE_TTL, max_size: int = AUTH_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = {}
+        self._tokens_by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[CurrentUser]:
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            self._discard(token)
+            return None
+        return user
+
+    def put(self, token: str, user: CurrentUser, token_expires_at: datetime):
+        if self.ttl <= 0:
+            return
+        # Запись не должна пережить сам токен
+        ttl = min(self.ttl, (token_expires_at - datetime.utcnow()).total_seconds())
+        if ttl <= 0:
+            return
+        with self._lock:
+            if len(self._entries) >= self.max_size:
+                self._entries.clear()
+                self._tokens_by_user.clear()
+            self._entries[token] = (time.monotonic() + ttl, user)
+            self._tokens_by_user.setdefault(user.id, set()).add(token)
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in self._tokens_by_user.pop(user_id, ()):
+                self._entries.pop(token, None)
+
+    def _discard(self, token: str):
+        with self._lock:
+            entry = self._entries.pop(token, None)
+            if entry is not None:
+                self._tokens_by_user.get(entry[1].id, set()).discard(token)
+
+
+token_cache = TokenCache()
+
+
+async def verify_password(user: User, plain_password: str) -> bool:
+    """
+    Проверка пароля в пуле потоков bcrypt.
+    """
+    return await asyncio.get_running_loop().run_in_executor(password_executor, user.verify_password, plain_password)
+
+
+async def hash_password(plain_password: str) -> str:
+    """
+    Хэширование пароля в пуле потоков bcrypt.
+    """
+    return await asyncio.get_running_loop().run_in_executor(password_executor, pwd_context.hash, plain_password)
+
 
 def create_access_token(data: dict):
     """
@@ -28,13 +121,17 @@ def create_access_token(data: dict):
 
 
 # Вспомогательная функция для получения пользователя по токену
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     """
     Функция для получения пользователя по токену.
     :param token:   Токен для авторизации.
     :param db:   База данных.
-    :return:    Пользователь
+    :return:    Снимок данных пользователя
     """
+    cached_user = token_cache.get(token)
+    if cached_user is not None:
+        return cached_user
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Похоже, вы не авторизованы",
@@ -48,7 +145,9 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = db.query(User).filter(User.username == token_data.username).first()
+    user = (await db.execute(select(User).where(User.username == token_data.username))).scalars().first()
     if user is None:
         raise credentials_exception
-    return user
+    current_user = CurrentUser.from_orm(user)
+    token_cache.put(token, current_user, datetime.utcfromtimestamp(payload["exp"]))
+    return current_user
@@ -0,0 +1,149 @@
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from core.config import LEDGER_APPLY_BATCH_SIZE
+from core.database import SessionLocal
+from core.worker import app
+from models.models import User, Prediction, LedgerEntry
+
+# Виды записей журнала
+RESERVE = "reserve"  # Списание при постановке задачи
+SETTLE = "settle"  # Подтверждение списания после успешного выполнения
+REFUND = "refund"  # Возврат зарезервированной суммы после ошибки
+TOPUP = "topup"  # Пополнение или ручная корректировка баланса
+
+
+class InsufficientFunds(Exception):
+    pass
+
+
+def _conditional_debit(user_id: int, amount: float):
+    # Проверка и списание одним оператором UPDATE: параллельные запросы не теряют изменения
+    # и не уводят баланс в минус, блокировка строки держится только на время оператора
+    return (update(User)
+            .where(User.id == user_id, User.balance >= amount)
+            .values(balance=User.balance - amount)
+            .execution_options(synchronize_session=False))
+
+
+async def reserve(db: AsyncSession, user_id: int, amount: float, job_id: str):
+    """
+    Атомарно резервирует стоимость задачи. Запись в журнал и списание попадают в текущую транзакцию.
+    :param db:  БД
+    :param user_id: Идентификатор пользователя
+    :param amount:  Сумма
+    :param job_id:  Идентификатор задачи
+    :raises InsufficientFunds: если кредитов недостаточно
+    """
+    result = await db.execute(_conditional_debit(user_id, amount))
+    if result.rowcount != 1:
+        raise InsufficientFunds()
+    db.add(LedgerEntry(user_id=user_id, job_id=job_id, kind=RESERVE, amount=-amount, applied=True))
+
+
+async def topup(db: AsyncSession, user_id: int, amount: float):
+    """
+    Пополнение баланса. Отрицательная сумма списывается так же атомарно, как резерв.
+    :param db:  БД
+    :param user_id: Идентификатор пользователя
+    :param amount:  Сумма
+    :raises InsufficientFunds: если списание увело бы баланс в минус
+    """
+    if amount >= 0:
+        statement = (update(User).where(User.id == user_id).values(balance=User.balance + amount)
+                     .execution_options(synchronize_session=False))
+    else:
+        statement = _conditional_debit(user_id, -amount)
+    result = await db.execute(statement)
+    if result.rowcount != 1:
+        raise InsufficientFunds()
+    db.add(LedgerEntry(user_id=user_id, kind=TOPUP, amount=amount, applied=True))
+
+
+def settle(db: Session, job_ids: list):
+    """
+    Подтверждает резервы выполненных задач. Баланс не меняется, журнал только дополняется.
+    :param db:  БД
+    :param job_ids: Идентификаторы задач
+    """
+    reserves = db.execute(
+        select(LedgerEntry.user_id, LedgerEntry.job_id)
+        .where(LedgerEntry.job_id.in_(job_ids), LedgerEntry.kind == RESERVE)
+    ).all()
+    db.add_all([LedgerEntry(user_id=user_id, job_id=job_id, kind=SETTLE, amount=0.0, applied=True)
+                for user_id, job_id in reserves])
+
+
+def refund(db: Session, job_id: str, amount: float = None):
+    """
+    Возвращает зарезервированную сумму (или ее часть). Возврат только записывается в журнал,
+    на баланс он попадает при очередном пакетном применении журнала (apply_pending).
+    :param db:  БД
+    :param job_id:  Идентификатор задачи
+    :param amount:  Сумма возврата, по умолчанию весь резерв
+    """
+    reserved = db.execute(
+        select(LedgerEntry.user_id, LedgerEntry.amount)
+        .where(LedgerEntry.job_id == job_id, LedgerEntry.kind == RESERVE)
+    ).first()
+    if reserved is None:
+        return
+    user_id, reserved_amount = reserved
+    refunded = db.execute(
+        select(func.coalesce(func.sum(LedgerEntry.amount), 0.0))
+        .where(LedgerEntry.job_id == job_id, LedgerEntry.kind == REFUND)
+    ).scalar()
+    # Суммарный возврат по задаче не может превысить резерв
+    remaining = -reserved_amount - refunded
+    amount = remaining if amount is None else min(amount, remaining)
+    if amount > 0:
+        db.add(LedgerEntry(user_id=user_id, job_id=job_id, kind=REFUND, amount=amount, applied=False))
+        # Сессии не сбрасываются автоматически: следующий возврат в той же транзакции должен видеть этот
+        db.flush()
+
+
+def task_jobs(db: Session, task_id: str) -> list:
+    """
+    Задачи пользователей, которые обслуживает задача Celery (одинаковые запросы делят одну задачу).
+    :return:    Список пар (идентификатор задачи, идентификатор пользователя)
+    """
+    return db.execute(select(Prediction.job_id, Prediction.user_id).where(Prediction.task_id == task_id)).all()
+
+
+def apply_pending(db: Session, batch_size: int = LEDGER_APPLY_BATCH_SIZE) -> int:
+    """
+    Пакетно переносит неучтенные записи журнала в материализованный баланс:
+    одно обновление на пользователя вместо обновления на каждую запись.
+    :param db:  БД
+    :param batch_size:  Максимальное количество записей журнала за один проход
+    :return:    Количество учтенных записей
+    """
+    max_id = db.execute(
+        select(func.max(LedgerEntry.id)).where(
+            LedgerEntry.id.in_(select(LedgerEntry.id).where(LedgerEntry.applied.is_(False))
+                               .order_by(LedgerEntry.id).limit(batch_size)))
+    ).scalar()
+    if max_id is None:
+        return 0
+    pending = LedgerEntry.applied.is_(False), LedgerEntry.id <= max_id
+    totals = db.execute(
+        select(LedgerEntry.user_id, func.sum(LedgerEntry.amount), func.count())
+        .where(*pending).group_by(LedgerEntry.user_id)
+    ).all()
+    for user_id, total, _ in totals:
+        db.execute(update(User).where(User.id == user_id).values(balance=User.balance + total)
+                   .execution_options(synchronize_session=False))
+    db.execute(update(LedgerEntry).where(*pending).values(applied=True)
+               .execution_options(synchronize_session=False))
+    db.commit()
+    return sum(count for _, _, count in totals)
+
+
+@app.task
+def apply_ledger():
+    """
+    Периодическая задача: перенос возвратов из журнала в материализованный баланс.
+    """
+    with SessionLocal() as db:
+        return apply_pending(db)
@@ -0,0 +1,246 @@
+"""
+Хранилище загруженных образцов по хэшу содержимого.
+
+Образец (вектор признаков в формате .npy) сохраняется под своим sha256, который и становится file_id,
+поэтому одинаковые загрузки записываются один раз. Ключи разбиты на подкаталоги по первым символам хэша:
+    <корень>/ab/cd/abcd...
+Хранилище выбирается настройкой BLOB_STORE: local - каталог UPLOAD_DIRECTORY, s3 - бакет S3-совместимого
+сервера (BLOB_S3_ENDPOINT_URL, ключи доступа - стандартные переменные окружения AWS_*).
+
+Каждому образцу соответствует строка blobs со сроком хранения, который продлевается каждой загрузкой
+такого же содержимого. Ссылки на образец - предсказания с этим file_id (по ним строятся объяснения).
+Периодическая задача collect_blobs удаляет образцы, срок которых истек и на которые нет ссылок.
+Порядок операций исключает удаление образца, который только что загрузили или на который сослались:
+    загрузка - сначала продлевает строку; если ее нет, записывает образец и только потом создает строку;
+    сборка - удаляет строку, если срок все еще истек и ссылок все еще нет, и образец - в той же транзакции.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from core import metrics
+from core.config import (BLOB_STORE, UPLOAD_DIRECTORY, BLOB_S3_BUCKET, BLOB_S3_PREFIX, BLOB_S3_ENDPOINT_URL,
+                         UPLOAD_TTL, UPLOAD_GC_BATCH_SIZE)
+from core.database import SessionLocal
+from core.worker import app
+from models.models import Blob, Prediction
+
+DIGEST_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+def digest_of(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_digest(value: str) -> bool:
+    return DIGEST_PATTERN.fullmatch(value) is not None
+
+
+def shard_key(digest: str) -> str:
+    """
+    Ключ образца: два уровня подкаталогов по первым символам хэша (до 65536 каталогов).
+    """
+    return f"{digest[:2]}/{digest[2:4]}/{digest}"
+
+
+class LocalBlobStore:
+    """
+    Образцы в локальном каталоге (или общем сетевом томе).
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, *shard_key(digest).split("/"))
+
+    def put(self, digest: str, data: bytes):
+        path = self.path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Образец появляется под своим именем только целиком. Временный файл у каждой записи свой,
+        # поэтому одновременная запись того же содержимого из разных потоков и процессов безопасна
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f"{digest}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as blob_file:
+                blob_file.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def get(self, digest: str) -> bytes:
+        with open(self.path(digest), "rb") as blob_file:
+            return blob_file.read()
+
+    def delete(self, digest: str):
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+
+class S3BlobStore:
+    """
+    Образцы в бакете S3 или S3-совместимого сервера.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str = None):
+        # boto3 нужен только этому хранилищу
+        import boto3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def key(self, digest: str) -> str:
+        return f"{self.prefix}{shard_key(digest)}"
+
+    def put(self, digest: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=self.key(digest), Body=data)
+
+    def get(self, digest: str) -> bytes:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.key(digest))["Body"].read()
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError(digest)
+
+    def delete(self, digest: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(digest))
+
+
+def create_blob_store(kind: str = BLOB_STORE):
+    if kind == "local":
+        return LocalBlobStore(UPLOAD_DIRECTORY)
+    if kind == "s3":
+        return S3BlobStore(BLOB_S3_BUCKET, BLOB_S3_PREFIX, BLOB_S3_ENDPOINT_URL)
+    raise ValueError(f"Неизвестное хранилище образцов: {kind}")
+
+
+blob_store = create_blob_store()
+
+
+def store(db: Session, data: bytes) -> str:
+    """
+    Сохраняет образец, если такого содержимого еще нет, и продлевает срок его хранения.
+    :param db:  БД
+    :param data:    Содержимое
+    :return:    Хэш содержимого (file_id)
+    """
+    digest = digest_of(data)
+    while True:
+        expires_at = datetime.utcnow() + timedelta(seconds=UPLOAD_TTL)
+        updated = db.execute(update(Blob).where(Blob.digest == digest)
+                             .values(expires_at=expires_at)
+                             .execution_options(synchronize_session=False)).rowcount
+        # Транзакция завершается до записи образца, чтобы не держать блокировку на время ввода-вывода
+        db.commit()
+        if updated:
+            metrics.observe_upload(duplicate=True)
+            return digest
+        blob_store.put(digest, data)
+        db.add(Blob(digest=digest, size=len(data), expires_at=expires_at))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Такой же образец одновременно загрузили в другом запросе: продлеваем его строку
+            db.rollback()
+            continue
+        metrics.observe_upload(duplicate=False)
+        return digest
+
+
+def load(digest: str) -> bytes:
+    """
+    Содержимое образца.
+    :raises FileNotFoundError: если образца нет
+    """
+    return blob_store.get(digest)
+
+
+def collect_garbage(db: Session, now: datetime = None, batch_size: int = UPLOAD_GC_BATCH_SIZE) -> int:
+    """
+    Удаляет одну порцию образцов, срок хранения которых истек и на которые не ссылаются предсказания.
+    :param db:  БД
+    :param now: Текущий момент
+    :param batch_size:  Максимальное количество образцов
+    :return:    Количество удаленных образцов
+    """
+    now = now or datetime.utcnow()
+    unreferenced = ~select(Prediction.id).where(Prediction.file_id == Blob.digest).exists()
+    digests = db.scalars(select(Blob.digest).where(Blob.expires_at < now, unreferenced).limit(batch_size)).all()
+    db.commit()
+    removed = 0
+    for digest in digests:
+        # Условия повторяются: между выборкой и удалением образец могли загрузить снова или сослаться на него
+        deleted = db.execute(delete(Blob).where(Blob.digest == digest, Blob.expires_at < now, unreferenced)
+                             .execution_options(synchronize_session=False)).rowcount
+        if deleted:
+            blob_store.delete(digest)
+            removed += 1
+        db.commit()
+    return removed
+
+
+def _legacy_id(name: str):
+    try:
+        return str(uuid.UUID(name[:-len(".npy")] if name.endswith(".npy") else name))
+    except ValueError:
+        return None
+
+
+def collect_legacy(db: Session, now: datetime = None, batch_size: int = UPLOAD_GC_BATCH_SIZE) -> int:
+    """
+    Удаляет просроченные файлы старого формата в корне UPLOAD_DIRECTORY: <uuid>.npy и исходные файлы <uuid>
+    без расширения. Файлы, на которые ссылаются предсказания, остаются.
+    :param db:  БД
+    :param now: Текущий момент
+    :param batch_size:  Максимальное количество проверяемых файлов
+    :return:    Количество удаленных файлов
+    """
+    if not os.path.isdir(UPLOAD_DIRECTORY):
+        return 0
+    cutoff = ((now or datetime.utcnow()) - timedelta(seconds=UPLOAD_TTL)).timestamp()
+    candidates = {}
+    with os.scandir(UPLOAD_DIRECTORY) as entries:
+        for entry in entries:
+            if len(candidates) >= batch_size:
+                break
+            file_id = _legacy_id(entry.name)
+            if file_id is not None and entry.is_file() and entry.stat().st_mtime < cutoff:
+                candidates[entry.path] = file_id
+    referenced = set(db.scalars(select(Prediction.file_id).where(Prediction.file_id.in_(set(candidates.values())))))
+    removed = 0
+    for path, file_id in candidates.items():
+        if file_id not in referenced:
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+@app.task
+def collect_blobs():
+    """
+    Периодическая задача: удаление образцов, которые не загружались дольше UPLOAD_TTL.
+    """
+    with SessionLocal() as db:
+        return collect_garbage(db) + collect_legacy(db)
+
+
+def stats(db: Session) -> dict:
+    """
+    Количество и объем образцов, ссылки на них и образцы, которые будут удалены при следующей сборке.
+    Доля повторных загрузок - в метрике upload_blobs_total.
+    """
+    blobs, size = db.execute(select(func.count(), func.coalesce(func.sum(Blob.size), 0))).one()
+    references = db.scalar(select(func.count()).select_from(Prediction)
+                           .where(Prediction.file_id.in_(select(Blob.digest))))
+    collectable = db.scalar(select(func.count()).select_from(Blob).where(
+        Blob.expires_at < datetime.utcnow(), ~select(Prediction.id).where(Prediction.file_id == Blob.digest).exists()))
+    return {"store": BLOB_STORE, "blobs": blobs, "bytes": size, "references": references, "collectable": collectable}
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import redis
+
+from core.metrics import count_cache_event
+from core.config import (REDIS_URL, PREDICTION_CACHE_ENABLED, PREDICTION_CACHE_REDIS, PREDICTION_CACHE_LOCAL_SIZE,
+                         PREDICTION_CACHE_REDIS_SIZE, PREDICTION_CACHE_TTL, PREDICTION_CACHE_INFLIGHT_TTL)
+
+KEY_PREFIX = "prediction_cache"
+
+
+class LRUCache:
+    """
+    Потокобезопасный LRU-кэш в памяти процесса.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return None
+            return self._data[key]
+
+    def put(self, key, value) -> int:
+        """
+        :return:    Количество вытесненных записей
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            evicted = 0
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def __len__(self):
+        return len(self._data)
+
+
+class PredictionCache:
+    """
+    Двухуровневый кэш результатов предсказаний: LRU в процессе и общий кэш в Redis.
+
+    Ключ строится по названию модели, ее версии и хэшу обработанного вектора признаков,
+    поэтому одинаковые образцы от разных пользователей попадают в одну запись.
+    Кроме результатов в Redis хранятся метки выполняемых задач (single-flight): пока задача
+    для ключа не завершилась, повторные запросы получают ее идентификатор вместо новой задачи.
+    """
+
+    def __init__(self, local_size: int = PREDICTION_CACHE_LOCAL_SIZE, use_redis: bool = PREDICTION_CACHE_REDIS,
+                 redis_size: int = PREDICTION_CACHE_REDIS_SIZE, ttl: int = PREDICTION_CACHE_TTL,
+                 inflight_ttl: int = PREDICTION_CACHE_INFLIGHT_TTL):
+        self.local = LRUCache(local_size)
+        self.redis = redis.Redis.from_url(REDIS_URL) if use_redis else None
+        self.redis_size = redis_size
+        self.ttl = ttl
+        self.inflight_ttl = inflight_ttl
+        self._counters = {"local_hits": 0, "redis_hits": 0, "misses": 0, "local_evictions": 0,
+                          "redis_evictions": 0, "coalesced": 0, "redis_errors": 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model_name: str, model_version: str, features) -> str:
+        """
+        Ключ кэша для образца.
+        :param model_name:  Название модели
+        :param model_version:   Версия модели
+        :param features:    Обработанный вектор признаков
+        """
+        digest = hashlib.sha256(np.asarray(features, dtype=np.float64).tobytes()).hexdigest()
+        return f"{KEY_PREFIX}:{model_name}:{model_version}:{digest}"
+
+    def get(self, key: str):
+        """
+        Результат из кэша или None.
+        """
+        value = self.local.get(key)
+        if value is not None:
+            self._count("local_hits")
+            return value
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(key)
+            except redis.RedisError:
+                self._count("redis_errors")
+                raw = None
+            if raw is not None:
+                value = json.loads(raw)
+                self._count("local_evictions", self.local.put(key, value))
+                self._count("redis_hits")
+                return value
+        self._count("misses")
+        return None
+
+    def put(self, key: str, value):
+        """
+        Сохраняет результат в оба уровня. При превышении размера из Redis вытесняются самые старые записи.
+        """
+        self._count("local_evictions", self.local.put(key, value))
+        if self.redis is None:
+            return
+        index = f"{KEY_PREFIX}:index"
+        try:
+            pipe = self.redis.pipeline()
+            pipe.set(key, json.dumps(value), ex=self.ttl)
+            pipe.zadd(index, {key: time.time()})
+            # Записи старше TTL уже удалены самим Redis, убираем их из индекса
+            pipe.zremrangebyscore(index, 0, time.time() - self.ttl)
+            pipe.zcard(index)
+            size = pipe.execute()[-1]
+            if size > self.redis_size:
+                evicted = [member for member, _ in self.redis.zpopmin(index, size - self.redis_size)]
+                if evicted:
+                    self.redis.delete(*evicted)
+                self._count("redis_evictions", len(evicted))
+        except redis.RedisError:
+            self._count("redis_errors")
+
+    def claim(self, key: str, job_id: str):
+        """
+        Пытается занять ключ под новую задачу.
+        :param key: Ключ кэша
+        :param job_id:  Идентификатор задачи, которая будет поставлена
+        :return:    None, если ключ занят этим вызовом, иначе идентификатор уже выполняющейся задачи
+        """
+        if self.redis is None:
+            return None
+        inflight = f"{key}:inflight"
+        try:
+            if self.redis.set(inflight, job_id, nx=True, ex=self.inflight_ttl):
+                return None
+            existing = self.redis.get(inflight)
+        except redis.RedisError:
+            self._count("redis_errors")
+            return None
+        if existing is None:
+            return None
+        self._count("coalesced")
+        return existing.decode()
+
+    def release(self, key: str):
+        """
+        Снимает метку выполняющейся задачи.
+        """
+        if self.redis is None:
+            return
+        try:
+            self.redis.delete(f"{key}:inflight")
+        except redis.RedisError:
+            self._count("redis_errors")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+        stats["local_size"] = len(self.local)
+        if self.redis is not None:
+            try:
+                stats["redis_size"] = self.redis.zcard(f"{KEY_PREFIX}:index")
+            except redis.RedisError:
+                stats["redis_size"] = None
+        return stats
+
+    def _count(self, counter: str, value: int = 1):
+        if value:
+            with self._lock:
+                self._counters[counter] += value
+            count_cache_event(counter, value)
+
+
+prediction_cache = PredictionCache() if PREDICTION_CACHE_ENABLED else None
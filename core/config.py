@@ -5,9 +5,129 @@ load_dotenv()  # Загружаем переменные окружения из
 
 DATABASE_URL = os.getenv('DATABASE_URL', "sqlite:///./mydatabase.db")
 SECRET_KEY = os.getenv('SECRET_KEY', 'defaultsecretkey')
-REDIS_URL = 'redis://localhost:6379'
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379')
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
-MODEL_COSTS = {
-    "lr_model": 10,
-    "gb_model": 20,
-}
+
+# Реестр моделей: артефакты и их метаданные (стоимость, версия) лежат в MODEL_DIRECTORY
+MODEL_DIRECTORY = os.getenv('MODEL_DIRECTORY', "ml_models")
+MODEL_REGISTRY_POLL_SECONDS = float(os.getenv('MODEL_REGISTRY_POLL_SECONDS', 10))  # Период проверки новых артефактов
+FEATURE_SCHEMA_PATH = os.getenv('FEATURE_SCHEMA_PATH', os.path.join(MODEL_DIRECTORY, 'feature_schema.json'))  # Названия признаков в порядке обучения
+
+# Микробатчинг предсказаний в worker'е Celery
+PREDICTION_BATCHING = os.getenv('PREDICTION_BATCHING', '1') == '1'
+PREDICTION_BATCH_MAX_SIZE = int(os.getenv('PREDICTION_BATCH_MAX_SIZE', 64))  # Максимальный размер батча
+PREDICTION_BATCH_MAX_WAIT_MS = float(os.getenv('PREDICTION_BATCH_MAX_WAIT_MS', 5))  # Окно ожидания батча, мс
+
+# Пакетные (bulk) предсказания
+BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', 1000))  # Количество образцов в одной задаче
+
+# Объяснения предсказаний
+EXPLAIN_TOP_K = int(os.getenv('EXPLAIN_TOP_K', 10))  # Признаков с наибольшим вкладом в ответе по умолчанию
+EXPLAIN_MAX_SAMPLES = int(os.getenv('EXPLAIN_MAX_SAMPLES', 100000))  # Максимум образцов в пакетном объяснении
+
+# Синхронные предсказания в процессе API для дешевых моделей
+INLINE_PREDICTION_ENABLED = os.getenv('INLINE_PREDICTION_ENABLED', '1') == '1'
+INLINE_PREDICTION_WORKERS = int(os.getenv('INLINE_PREDICTION_WORKERS', 2))  # Потоки пула предсказаний в API
+INLINE_PREDICTION_MAX_PENDING = int(os.getenv('INLINE_PREDICTION_MAX_PENDING', 32))  # Сверх этого - через очередь
+INLINE_LATENCY_BUDGET_MS = float(os.getenv('INLINE_LATENCY_BUDGET_MS', 0))  # Бюджет моделей без inline_budget_ms, 0 - только через очередь
+INLINE_LATENCY_WINDOW = int(os.getenv('INLINE_LATENCY_WINDOW', 200))  # Количество последних замеров для p95
+INLINE_RECHECK_SECONDS = float(os.getenv('INLINE_RECHECK_SECONDS', 60))  # Повторный замер модели, не уложившейся в бюджет
+
+# Очереди задач: одиночные предсказания делятся по стоимости модели, пакетные идут в отдельную очередь
+QUEUE_DEFAULT = 'celery'  # Служебные задачи (журнал биллинга, результаты опоздавших запросов, архив, сборка образцов)
+QUEUE_FAST = os.getenv('QUEUE_FAST', 'predict_fast')  # Одиночные предсказания дешевых моделей
+QUEUE_SLOW = os.getenv('QUEUE_SLOW', 'predict_slow')  # Одиночные предсказания дорогих моделей
+QUEUE_BULK = os.getenv('QUEUE_BULK', 'predict_bulk')  # Порции пакетных предсказаний
+ROUTING_CHEAP_COST = float(os.getenv('ROUTING_CHEAP_COST', 10))  # Модели не дороже этого идут в QUEUE_FAST
+# Настройки worker'а каждой очереди: "мин,макс" конкурентности, множитель prefetch, SLO (ожидание + выполнение), мс
+# При микробатчинге батч не больше текущей конкурентности worker'а: полный батч набирается, когда
+# автомасштабирование дошло до PREDICTION_BATCH_MAX_SIZE
+QUEUE_FAST_CONCURRENCY = os.getenv('QUEUE_FAST_CONCURRENCY', '4,64')
+QUEUE_FAST_PREFETCH = int(os.getenv('QUEUE_FAST_PREFETCH', 1))
+QUEUE_FAST_SLO_MS = float(os.getenv('QUEUE_FAST_SLO_MS', 100))
+QUEUE_SLOW_CONCURRENCY = os.getenv('QUEUE_SLOW_CONCURRENCY', '2,32')
+QUEUE_SLOW_PREFETCH = int(os.getenv('QUEUE_SLOW_PREFETCH', 1))
+QUEUE_SLOW_SLO_MS = float(os.getenv('QUEUE_SLOW_SLO_MS', 500))
+QUEUE_BULK_CONCURRENCY = os.getenv('QUEUE_BULK_CONCURRENCY', '1,8')
+QUEUE_BULK_PREFETCH = int(os.getenv('QUEUE_BULK_PREFETCH', 1))
+QUEUE_BULK_SLO_MS = float(os.getenv('QUEUE_BULK_SLO_MS', 60000))
+QUEUE_DEFAULT_CONCURRENCY = os.getenv('QUEUE_DEFAULT_CONCURRENCY', '1,4')  # Worker служебных задач
+QUEUE_AUTOSCALE_KEEPALIVE = float(os.getenv('QUEUE_AUTOSCALE_KEEPALIVE', 30))  # Минимум секунд между ростом и сокращением
+
+# Кэш результатов предсказаний
+PREDICTION_CACHE_ENABLED = os.getenv('PREDICTION_CACHE_ENABLED', '1') == '1'
+PREDICTION_CACHE_REDIS = os.getenv('PREDICTION_CACHE_REDIS', '1') == '1'  # Второй уровень кэша в Redis
+PREDICTION_CACHE_LOCAL_SIZE = int(os.getenv('PREDICTION_CACHE_LOCAL_SIZE', 10000))  # Размер LRU в процессе
+PREDICTION_CACHE_REDIS_SIZE = int(os.getenv('PREDICTION_CACHE_REDIS_SIZE', 1000000))  # Максимум записей в Redis
+PREDICTION_CACHE_TTL = int(os.getenv('PREDICTION_CACHE_TTL', 24 * 3600))  # Время жизни записи в Redis, секунды
+PREDICTION_CACHE_INFLIGHT_TTL = int(os.getenv('PREDICTION_CACHE_INFLIGHT_TTL', 300))  # Время жизни метки выполняемой задачи
+
+# Загрузка файлов
+# Образцы хранятся по хэшу содержимого (core/blobstore.py): local - в UPLOAD_DIRECTORY, s3 - в бакете BLOB_S3_BUCKET
+BLOB_STORE = os.getenv('BLOB_STORE', 'local')  # local / s3
+UPLOAD_DIRECTORY = os.getenv('UPLOAD_DIRECTORY', "./uploaded_files")  # Корень локального хранилища
+BLOB_S3_BUCKET = os.getenv('BLOB_S3_BUCKET', 'uploads')
+BLOB_S3_PREFIX = os.getenv('BLOB_S3_PREFIX', 'samples/')  # Префикс ключей в бакете
+BLOB_S3_ENDPOINT_URL = os.getenv('BLOB_S3_ENDPOINT_URL')  # S3-совместимый сервер (MinIO и т.п.); None - AWS S3
+UPLOAD_TTL = float(os.getenv('UPLOAD_TTL', 7 * 24 * 3600))  # Время хранения образца после последней загрузки, секунды
+UPLOAD_GC_INTERVAL = float(os.getenv('UPLOAD_GC_INTERVAL', 3600))  # Период удаления просроченных образцов, секунды
+UPLOAD_GC_BATCH_SIZE = int(os.getenv('UPLOAD_GC_BATCH_SIZE', 10000))  # Максимум образцов за один запуск
+MAX_UPLOAD_SIZE = int(os.getenv('MAX_UPLOAD_SIZE', 1024 * 1024))  # Максимальный размер файла с одним образцом, байты
+UPLOAD_CHUNK_SIZE = 64 * 1024  # Размер порции при чтении загружаемого файла, байты
+UPLOAD_FORM_OVERHEAD = 16 * 1024  # Запас на служебные части multipart-формы сверх MAX_UPLOAD_SIZE, байты
+
+# Пул соединений с БД
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))  # Ожидание свободного соединения, секунды
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))  # Пересоздание соединений серверной БД, секунды
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))  # Ожидание блокировки SQLite, мс
+
+# Биллинг
+LEDGER_APPLY_INTERVAL = float(os.getenv('LEDGER_APPLY_INTERVAL', 5))  # Период пакетного зачисления возвратов, секунды
+LEDGER_APPLY_BATCH_SIZE = int(os.getenv('LEDGER_APPLY_BATCH_SIZE', 10000))  # Максимум записей журнала за один проход
+
+# Аутентификация
+AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', 30))  # Время жизни кэша токен -> пользователь, секунды (0 - выключен)
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', 100000))  # Максимальное количество токенов в кэше
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 4))  # Потоки для bcrypt
+
+# Уведомления о завершении задач
+JOB_EVENTS_ENABLED = os.getenv('JOB_EVENTS_ENABLED', '1') == '1'  # Публикация событий задач в Redis pub/sub
+JOB_EVENTS_HEARTBEAT = float(os.getenv('JOB_EVENTS_HEARTBEAT', 15))  # Интервал пустых сообщений в потоке, секунды
+
+# Запись результатов worker'ом
+RESULT_WRITER_BATCH_SIZE = int(os.getenv('RESULT_WRITER_BATCH_SIZE', 200))  # Максимум результатов в одной транзакции
+RESULT_WRITER_MAX_WAIT_MS = float(os.getenv('RESULT_WRITER_MAX_WAIT_MS', 20))  # Ожидание заполнения пакета, мс
+RESULT_SWEEP_INTERVAL = float(os.getenv('RESULT_SWEEP_INTERVAL', 5))  # Период досрочной записи результатов присоединившимся запросам, секунды
+RESULT_SWEEP_WINDOW = float(os.getenv('RESULT_SWEEP_WINDOW', 3600))  # Возраст запросов, которые проверяются, секунды
+
+# История предсказаний
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', 100))  # Размер страницы по умолчанию
+HISTORY_MAX_PAGE_SIZE = int(os.getenv('HISTORY_MAX_PAGE_SIZE', 1000))  # Максимальный размер страницы
+HISTORY_EXPORT_CHUNK = int(os.getenv('HISTORY_EXPORT_CHUNK', 1000))  # Строк за одно чтение при выгрузке
+
+# Архив старых предсказаний (Parquet, по дням)
+ARCHIVE_DIRECTORY = os.getenv('ARCHIVE_DIRECTORY', './archive')  # Каталог архива
+RETENTION_DAYS = float(os.getenv('RETENTION_DAYS', 30))  # Возраст, после которого предсказания уходят в архив, дни
+RETENTION_INTERVAL = float(os.getenv('RETENTION_INTERVAL', 3600))  # Период запуска переноса в архив, секунды
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', 50000))  # Максимум строк за один перенос
+ARCHIVE_ROW_GROUP_SIZE = int(os.getenv('ARCHIVE_ROW_GROUP_SIZE', 16384))  # Строк в группе строк Parquet
+ARCHIVE_COMPACT_FILES = int(os.getenv('ARCHIVE_COMPACT_FILES', 8))  # Файлов в разделе, после которого они объединяются
+
+# Метрики
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'  # Сбор метрик Prometheus
+METRICS_WORKER_PORT = int(os.getenv('METRICS_WORKER_PORT', 9100))  # Базовый порт /metrics worker'ов Celery
+METRICS_WORKER_REPLICAS = int(os.getenv('METRICS_WORKER_REPLICAS', 4))  # Worker'ов одной очереди на хосте с /metrics
+METRICS_DB_TIMING = os.getenv('METRICS_DB_TIMING', '1') == '1'  # Время выполнения SQL-операторов
+METRICS_QUEUES = os.getenv('METRICS_QUEUES', ','.join([QUEUE_FAST, QUEUE_SLOW, QUEUE_BULK, QUEUE_DEFAULT])).split(',')  # Очереди брокера, глубина которых отдается в /metrics
+
+# Профилирование (выключено по умолчанию; при выключенном профилировании хуки не устанавливаются)
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '0') == '1'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0.01))  # Доля профилируемых запросов и задач
+PROFILING_INTERVAL_MS = float(os.getenv('PROFILING_INTERVAL_MS', 5))  # Интервал снятия стека, мс
+PROFILING_HEADER = os.getenv('PROFILING_HEADER', 'X-Profile')  # Заголовок, при котором запрос профилируется всегда
+PROFILING_MODELS = [name for name in os.getenv('PROFILING_MODELS', '').split(',') if name]  # Модели, задачи которых профилируются всегда
+PROFILE_DIRECTORY = os.getenv('PROFILE_DIRECTORY', './profiles')  # Каталог сохраненных профилей
+PROFILE_MAX_STORED = int(os.getenv('PROFILE_MAX_STORED', 500))  # Сколько последних профилей хранить
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')  # Токен административных эндпоинтов (заголовок X-Admin-Token), пустой - выключены
@@ -1,10 +1,68 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
-from core.config import DATABASE_URL
+from core.config import (DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+                         SQLITE_BUSY_TIMEOUT_MS, METRICS_ENABLED, METRICS_DB_TIMING)
+from core.metrics import instrument_engine
 
-engine = create_engine(DATABASE_URL)
+# Асинхронные драйверы для синхронных URL из DATABASE_URL
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+
+def async_database_url(url: str) -> str:
+    """
+    URL для асинхронного движка: подставляет асинхронный драйвер, если в URL указан синхронный.
+    :param url: URL базы данных из настроек
+    """
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if parsed.drivername in (backend, f"{backend}+pysqlite", f"{backend}+psycopg2", f"{backend}+pymysql"):
+        parsed = parsed.set(drivername=ASYNC_DRIVERS.get(backend, parsed.drivername))
+    return parsed.render_as_string(hide_password=False)
+
+
+def _engine_options(url: str) -> dict:
+    if make_url(url).get_backend_name() == "sqlite":
+        # Соединения SQLite используются из разных потоков пула
+        return {"connect_args": {"check_same_thread": False}, "pool_size": DB_POOL_SIZE,
+                "max_overflow": DB_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT}
+    return {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE, "pool_pre_ping": True}
+
+
+def _configure_sqlite(engine):
+    """
+    WAL позволяет читать параллельно с записью, busy_timeout - ждать блокировку вместо ошибки
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragma(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
+_configure_sqlite(engine)
+
+# Асинхронный движок для API: запросы к БД не блокируют цикл событий
+async_engine = create_async_engine(async_database_url(DATABASE_URL), **_engine_options(DATABASE_URL))
+_configure_sqlite(async_engine.sync_engine)
+
+if METRICS_ENABLED and METRICS_DB_TIMING:
+    instrument_engine(engine)
+    instrument_engine(async_engine.sync_engine)
 
 # Создание таблиц, если они еще не были созданы
 Base = declarative_base()
@@ -12,6 +70,7 @@ Base.metadata.create_all(bind=engine)
 
 # Создание сессии
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 
 def get_db():
@@ -24,3 +83,13 @@ def get_db():
         raise
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+            await db.commit()
+        except:
+            await db.rollback()
+            raise
@@ -0,0 +1,127 @@
+import json
+import logging
+import threading
+
+import redis
+import redis.asyncio as aioredis
+
+from core.config import REDIS_URL, JOB_EVENTS_ENABLED, JOB_EVENTS_HEARTBEAT
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "job_events"
+
+# Статусы, после которых задача больше не меняется
+FINAL_STATUSES = ("finished", "failed")
+
+
+def channel(user_id: int) -> str:
+    """
+    Канал Redis, в который публикуются события задач пользователя.
+    """
+    return f"{CHANNEL_PREFIX}:{user_id}"
+
+
+def to_python(value):
+    """
+    Результаты моделей приходят как скаляры numpy: значение встроенного типа Python для JSON и БД.
+    """
+    return value.item() if hasattr(value, "item") else value
+
+
+def job_event(job_id: str, status: str, result=None, **extra) -> dict:
+    """
+    Сообщение о смене статуса задачи.
+    :param job_id:  Идентификатор задачи пользователя
+    :param status:  Новый статус (finished, failed, progress)
+    :param result:  Результат или текст ошибки
+    """
+    event = {"job_id": job_id, "status": status, **extra}
+    if result is not None:
+        event["result"] = to_python(result)
+    return event
+
+
+class JobEventPublisher:
+    """
+    Публикация событий задач из worker'а (синхронный клиент Redis).
+    Ошибки Redis не должны ронять задачу: клиент, пропустивший событие, получит статус при переподключении.
+    """
+
+    def __init__(self, url: str = REDIS_URL):
+        self.url = url
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> redis.Redis:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    def publish(self, events: list):
+        """
+        :param events:  Список пар (идентификатор пользователя, событие)
+        """
+        if not events:
+            return
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for user_id, event in events:
+                pipe.publish(channel(user_id), json.dumps(event))
+            pipe.execute()
+        except redis.RedisError as exc:
+            logger.warning("Job events are not published: %s", exc)
+
+
+publisher = JobEventPublisher() if JOB_EVENTS_ENABLED else None
+
+
+def publish(events: list):
+    """
+    Публикует события, если уведомления включены.
+    :param events:  Список пар (идентификатор пользователя, событие)
+    """
+    if publisher is not None:
+        publisher.publish(events)
+
+
+class JobSubscription:
+    """
+    Подписка API на события задач одного пользователя (асинхронный клиент Redis).
+    """
+
+    def __init__(self, user_id: int, heartbeat: float = JOB_EVENTS_HEARTBEAT):
+        self.user_id = user_id
+        self.heartbeat = heartbeat
+        self._client = None
+        self._pubsub = None
+
+    async def open(self):
+        """
+        Подключается к Redis и подписывается на канал пользователя.
+        :raises redis.RedisError: если Redis недоступен
+        """
+        self._client = aioredis.Redis.from_url(REDIS_URL)
+        self._pubsub = self._client.pubsub()
+        try:
+            await self._pubsub.subscribe(channel(self.user_id))
+        except Exception:
+            await self.close()
+            raise
+
+    async def next_event(self):
+        """
+        Следующее событие или None, если за heartbeat секунд событий не было:
+        обработчик отправляет клиенту пустое сообщение и так замечает разрыв соединения.
+        """
+        message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=self.heartbeat)
+        return json.loads(message["data"]) if message is not None else None
+
+    async def close(self):
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        if self._client is not None:
+            await self._client.aclose()
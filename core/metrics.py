@@ -0,0 +1,247 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import redis
+from celery.signals import before_task_publish, task_prerun, task_postrun, worker_init
+from prometheus_client import (Counter, Histogram, CollectorRegistry, REGISTRY, generate_latest,
+                               CONTENT_TYPE_LATEST, start_http_server, multiprocess)
+from prometheus_client.core import GaugeMetricFamily
+
+from core.config import REDIS_URL, METRICS_ENABLED, METRICS_WORKER_PORT, METRICS_WORKER_REPLICAS, METRICS_QUEUES
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин: от долей миллисекунды (разбор файла, lookup кэша) до десятков секунд (очередь)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+# Заголовок сообщения Celery с временем публикации задачи
+PUBLISHED_AT_HEADER = "published_at"
+
+STAGE_SECONDS = Histogram("prediction_stage_seconds", "Время этапа обработки предсказания",
+                          ["stage", "model"], buckets=LATENCY_BUCKETS)
+HTTP_REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Время обработки HTTP-запроса",
+                                 ["method", "route", "status"], buckets=LATENCY_BUCKETS)
+QUEUE_WAIT_SECONDS = Histogram("celery_queue_wait_seconds", "Время от постановки задачи до начала выполнения",
+                               ["task"], buckets=LATENCY_BUCKETS)
+TASK_SECONDS = Histogram("celery_task_runtime_seconds", "Время выполнения задачи Celery",
+                         ["task", "model", "state"], buckets=LATENCY_BUCKETS)
+BATCH_SIZE = Histogram("prediction_batch_size", "Размер батча одного вызова модели",
+                       ["model", "source"], buckets=SIZE_BUCKETS)
+RESULT_FLUSH_SIZE = Histogram("result_writer_batch_size", "Количество результатов в одной транзакции записи",
+                              buckets=SIZE_BUCKETS)
+CACHE_EVENTS = Counter("prediction_cache_events_total", "События кэша предсказаний", ["event"])
+QUEUE_LATENCY_SECONDS = Histogram("celery_queue_latency_seconds", "Время от постановки задачи до ее завершения",
+                                  ["queue"], buckets=LATENCY_BUCKETS)
+QUEUE_SLO_EVENTS = Counter("celery_queue_slo_total", "Задачи, уложившиеся и не уложившиеся в SLO очереди",
+                           ["queue", "outcome"])
+CASCADE_SAMPLES = Counter("cascade_samples_total", "Образцы каскадных моделей по последней выполненной ступени",
+                          ["model", "stage"])
+UPLOAD_BLOBS = Counter("upload_blobs_total", "Загрузки образцов: новое содержимое или повтор уже сохраненного",
+                       ["outcome"])
+DB_STATEMENT_SECONDS = Histogram("db_statement_seconds", "Время выполнения SQL-оператора",
+                                 ["operation"], buckets=LATENCY_BUCKETS)
+
+
+def stage(name: str, model: str = ""):
+    """
+    Контекстный менеджер, который измеряет время этапа.
+    :param name:    Название этапа
+    :param model:   Название модели, если этап к ней относится
+    """
+    if not METRICS_ENABLED:
+        return nullcontext()
+    return _timed(STAGE_SECONDS.labels(name, model))
+
+
+@contextmanager
+def _timed(histogram):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - started)
+
+
+def observe_stage(name: str, model: str, seconds: float):
+    if METRICS_ENABLED:
+        STAGE_SECONDS.labels(name, model).observe(seconds)
+
+
+def observe_result_flush(size: int):
+    if METRICS_ENABLED:
+        RESULT_FLUSH_SIZE.observe(size)
+
+
+def count_cache_event(event: str, value: int = 1):
+    if METRICS_ENABLED:
+        CACHE_EVENTS.labels(event).inc(value)
+
+
+def observe_batch(model: str, source: str, size: int):
+    if METRICS_ENABLED:
+        BATCH_SIZE.labels(model, source).observe(size)
+
+
+def observe_queue_latency(queue: str, seconds: float, slo_seconds: float):
+    if METRICS_ENABLED:
+        QUEUE_LATENCY_SECONDS.labels(queue).observe(seconds)
+        QUEUE_SLO_EVENTS.labels(queue, "met" if seconds <= slo_seconds else "missed").inc()
+
+
+def observe_cascade(model: str, samples: int, escalated: int):
+    if METRICS_ENABLED:
+        CASCADE_SAMPLES.labels(model, "first").inc(samples - escalated)
+        CASCADE_SAMPLES.labels(model, "second").inc(escalated)
+
+
+def observe_upload(duplicate: bool):
+    if METRICS_ENABLED:
+        UPLOAD_BLOBS.labels("duplicate" if duplicate else "new").inc()
+
+
+def instrument_engine(engine):
+    """
+    Время выполнения SQL-операторов движка SQLAlchemy по виду оператора (SELECT, INSERT, ...).
+    """
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["metrics_started"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement else ""
+        DB_STATEMENT_SECONDS.labels(operation).observe(time.perf_counter() - started)
+
+
+class QueueDepthCollector:
+    """
+    Глубина очередей брокера (длина списков Redis), читается в момент запроса /metrics.
+    """
+
+    def __init__(self, queues: list, url: str = REDIS_URL):
+        self.queues = queues
+        self.redis = redis.Redis.from_url(url, socket_timeout=0.5)
+
+    def collect(self):
+        gauge = GaugeMetricFamily("celery_queue_depth", "Количество задач в очереди брокера", labels=["queue"])
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for queue in self.queues:
+                pipe.llen(queue)
+            for queue, depth in zip(self.queues, pipe.execute()):
+                gauge.add_metric([queue], depth)
+        except redis.RedisError:
+            pass
+        yield gauge
+
+
+def registry() -> CollectorRegistry:
+    """
+    Реестр для выдачи метрик. В режиме нескольких процессов (PROMETHEUS_MULTIPROC_DIR)
+    метрики собираются из файлов всех процессов.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        collected = CollectorRegistry()
+        multiprocess.MultiProcessCollector(collected)
+        return collected
+    return REGISTRY
+
+
+def render() -> tuple:
+    """
+    :return:    Текст метрик в формате Prometheus и его Content-Type
+    """
+    return generate_latest(registry()), CONTENT_TYPE_LATEST
+
+
+_queue_depth_registered = False
+
+
+def register_queue_depth(queues: list = METRICS_QUEUES):
+    global _queue_depth_registered
+    if METRICS_ENABLED and not _queue_depth_registered:
+        REGISTRY.register(QueueDepthCollector(queues))
+        _queue_depth_registered = True
+
+
+# Метрики задач Celery: время публикации передается в заголовке сообщения,
+# время ожидания и выполнения считаются в процессе worker'а
+_task_started = {}
+_task_lock = threading.Lock()
+
+
+@before_task_publish.connect
+def _on_task_publish(headers=None, **kwargs):
+    if METRICS_ENABLED and headers is not None:
+        headers[PUBLISHED_AT_HEADER] = time.time()
+
+
+@task_prerun.connect
+def _on_task_prerun(task_id=None, task=None, **kwargs):
+    if not METRICS_ENABLED:
+        return
+    published_at = getattr(task.request, PUBLISHED_AT_HEADER, None)
+    if published_at is not None:
+        QUEUE_WAIT_SECONDS.labels(task.name).observe(max(0.0, time.time() - published_at))
+    with _task_lock:
+        _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def _on_task_postrun(task_id=None, task=None, args=None, state=None, **kwargs):
+    if not METRICS_ENABLED:
+        return
+    with _task_lock:
+        started = _task_started.pop(task_id, None)
+    if started is not None:
+        # Первым аргументом задач предсказания передается название модели
+        model = args[0] if args and isinstance(args[0], str) else ""
+        TASK_SECONDS.labels(task.name, model, state or "").observe(time.perf_counter() - started)
+
+
+def worker_metrics_ports(queues) -> list:
+    """
+    Порты /metrics worker'а. Worker'ы разных очередей на одном хосте не должны занимать один порт,
+    поэтому у каждой очереди свое смещение от METRICS_WORKER_PORT (порядок core.queues.WORKER_QUEUES),
+    а следующие worker'ы той же очереди получают порты с шагом в количество очередей:
+    при 9100 и четырех очередях predict_fast - 9100, 9104, ..., predict_slow - 9101, 9105, ...
+    :param queues:  Очереди, которые обслуживает worker
+    :return:    Порты в порядке попыток
+    """
+    from core.queues import WORKER_QUEUES
+    names = list(WORKER_QUEUES)
+    offset = min((names.index(queue) for queue in queues if queue in names), default=0)
+    return [METRICS_WORKER_PORT + offset + replica * len(names) for replica in range(METRICS_WORKER_REPLICAS)]
+
+
+def serve_worker_metrics(queues):
+    """
+    Запускает /metrics worker'а на первом свободном из его портов.
+    :param queues:  Очереди, которые обслуживает worker
+    :return:    Порт или None, если все порты заняты
+    """
+    for port in worker_metrics_ports(queues):
+        try:
+            start_http_server(port, registry=registry())
+            return port
+        except OSError as exc:
+            logger.debug("Worker metrics port %s is busy: %s", port, exc)
+    logger.warning("Worker metrics are not served: ports %s are busy", worker_metrics_ports(queues))
+    return None
+
+
+@worker_init.connect
+def _serve_worker_metrics(sender=None, **kwargs):
+    if METRICS_ENABLED:
+        # К моменту worker_init очереди из --queues уже выбраны
+        queues = sender.app.amqp.queues
+        port = serve_worker_metrics(list(queues.consume_from or queues))
+        if port is not None:
+            logger.info("Worker metrics are served on port %s", port)
@@ -0,0 +1,89 @@
+"""
+Миграции схемы БД, созданной предыдущими версиями приложения.
+
+Base.metadata.create_all создает только отсутствующие таблицы и не меняет существующие, поэтому
+новые колонки и индексы существующих таблиц добавляются здесь. Каждый шаг проверяет текущую схему
+и ничего не делает, если уже выполнен, поэтому migrate безопасно вызывать при каждом запуске
+(API и worker'ы вызывают его при импорте models.models).
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+
+
+def _columns(connection, table: str) -> set:
+    return {column["name"] for column in inspect(connection).get_columns(table)}
+
+
+def add_column(table: str, column: str, ddl: str, backfill=None):
+    """
+    Шаг миграции: новая колонка существующей таблицы.
+    :param table:   Таблица
+    :param column:  Колонка
+    :param ddl: Тип и ограничения колонки в синтаксисе ALTER TABLE ... ADD COLUMN
+    :param backfill:    SQL (или кортеж операторов), заполняющий колонку в уже существующих строках
+    """
+    def step(connection, metadata):
+        if column in _columns(connection, table):
+            return
+        try:
+            with connection.begin_nested():
+                connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+        except DBAPIError:
+            # Колонку одновременно добавил другой процесс
+            if column not in _columns(connection, table):
+                raise
+            return
+        for statement in ((backfill,) if isinstance(backfill, str) else backfill or ()):
+            connection.execute(text(statement))
+    return step
+
+
+def create_index(table: str, name: str):
+    """
+    Шаг миграции: индекс, объявленный в модели таблицы.
+    """
+    def step(connection, metadata):
+        index = next(index for index in metadata.tables[table].indexes if index.name == name)
+        index.create(connection, checkfirst=True)
+    return step
+
+
+MIGRATIONS = [
+    # Количество образцов задачи (пакетные предсказания)
+    add_column("predictions", "samples", "INTEGER DEFAULT 1"),
+    # Задача Celery, результат которой получает запрос; раньше идентификатором задачи был job_id
+    add_column("predictions", "task_id", "VARCHAR", backfill="UPDATE predictions SET task_id = job_id"),
+    create_index("predictions", "ix_predictions_task_id"),
+    # Модель и ее версия из реестра
+    add_column("predictions", "model_name", "VARCHAR"),
+    add_column("predictions", "model_version", "VARCHAR"),
+    # Результат записывается worker'ом. Раньше он хранился только в бэкенде Celery: строки с результатом
+    # завершены, без результата - остаются ожидающими (задача еще в очереди или ее результат в бэкенде).
+    # Стоимость таких задач списывалась с баланса напрямую, поэтому для них записывается резерв: результат
+    # от worker'а или utils.results.resolve_legacy_predictions подтверждает его или возвращает
+    add_column("predictions", "status", "VARCHAR",
+               backfill=("UPDATE predictions SET status = 'finished' WHERE result IS NOT NULL",
+                         "INSERT INTO ledger_entries (user_id, job_id, kind, amount, applied) "
+                         "SELECT user_id, job_id, 'reserve', -cost, TRUE FROM predictions "
+                         "WHERE status IS NULL AND user_id IS NOT NULL")),
+    add_column("predictions", "finished_at", "TIMESTAMP"),
+    # Постраничная история пользователя и выборки за период
+    create_index("predictions", "ix_predictions_user_created"),
+    create_index("predictions", "ix_predictions_created"),
+    # Очередь Celery, в которую поставлена задача
+    add_column("predictions", "queue", "VARCHAR"),
+    # Образец, на котором сделано предсказание
+    add_column("predictions", "file_id", "VARCHAR"),
+    create_index("predictions", "ix_predictions_file_id"),
+]
+
+
+def migrate(engine, metadata):
+    """
+    Приводит существующие таблицы к схеме моделей.
+    :param engine:  Синхронный движок SQLAlchemy
+    :param metadata:    Метаданные моделей (Base.metadata)
+    """
+    with engine.begin() as connection:
+        for step in MIGRATIONS:
+            step(connection, metadata)
@@ -0,0 +1,210 @@
+import glob
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from starlette.concurrency import run_in_threadpool
+
+from core.config import (PROFILING_SAMPLE_RATE, PROFILING_INTERVAL_MS, PROFILING_HEADER, PROFILING_MODELS,
+                         PROFILE_DIRECTORY, PROFILE_MAX_STORED)
+
+# Ограничение глубины стека: хвост из фреймов asyncio/uvicorn неинтересен и раздувает профиль
+MAX_STACK_DEPTH = 128
+
+# Профили задач записываются в отдельном потоке, а не в потоке задачи
+_task_profile_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile-writer")
+
+
+class SamplingProfiler:
+    """
+    Статистический профилировщик одного потока: отдельный поток раз в interval снимает стек
+    целевого потока через sys._current_frames() и считает одинаковые стеки.
+
+    Для запросов FastAPI целевой поток - цикл событий, поэтому в профиль попадают и другие
+    корутины, выполнявшиеся в это время; для задач Celery на пуле потоков - поток задачи.
+    """
+
+    def __init__(self, thread_id: int, interval_ms: float = PROFILING_INTERVAL_MS):
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000.0
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.stacks[_collapse(frame)] += 1
+            self.samples += 1
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    # Формат collapsed stacks (flamegraph.pl, speedscope): от корня к листу через ';'
+    return ";".join(reversed(names))
+
+
+def should_profile(forced: bool = False) -> bool:
+    return forced or random.random() < PROFILING_SAMPLE_RATE
+
+
+def save_profile(stacks: Counter, metadata: dict) -> str:
+    """
+    Сохраняет профиль: метаданные в <id>.json, стеки в <id>.folded.
+    :param stacks:  Количество снимков по свернутым стекам
+    :param metadata:    Описание запроса или задачи
+    :return:    Идентификатор профиля
+    """
+    os.makedirs(PROFILE_DIRECTORY, exist_ok=True)
+    profile_id = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+    with open(os.path.join(PROFILE_DIRECTORY, f"{profile_id}.folded"), "w") as folded:
+        folded.writelines(f"{stack} {count}\n" for stack, count in stacks.most_common())
+    metadata = {"id": profile_id, "samples": sum(stacks.values()), **metadata}
+    tmp_path = os.path.join(PROFILE_DIRECTORY, f"{profile_id}.json.tmp")
+    with open(tmp_path, "w") as meta:
+        json.dump(metadata, meta)
+    # Профиль появляется в списке только целиком
+    os.replace(tmp_path, os.path.join(PROFILE_DIRECTORY, f"{profile_id}.json"))
+    _trim()
+    return profile_id
+
+
+def _trim():
+    paths = sorted(glob.glob(os.path.join(PROFILE_DIRECTORY, "*.json")))
+    for path in paths[:max(0, len(paths) - PROFILE_MAX_STORED)]:
+        for stale in (path, f"{path[:-len('.json')]}.folded"):
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles(limit: int = 100) -> list:
+    """
+    Метаданные сохраненных профилей, от новых к старым.
+    """
+    profiles = []
+    for path in sorted(glob.glob(os.path.join(PROFILE_DIRECTORY, "*.json")), reverse=True)[:limit]:
+        try:
+            with open(path) as meta:
+                profiles.append(json.load(meta))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def profile_path(profile_id: str) -> str:
+    """
+    Путь к файлу свернутых стеков.
+    :raises FileNotFoundError: если профиля нет
+    """
+    path = os.path.join(PROFILE_DIRECTORY, f"{os.path.basename(profile_id)}.folded")
+    if not os.path.exists(path):
+        raise FileNotFoundError(profile_id)
+    return path
+
+
+async def profile_request(request, call_next):
+    """
+    Middleware FastAPI: профилирует долю запросов и все запросы с заголовком PROFILING_HEADER.
+    Профилирование заканчивается после отправки тела ответа, поэтому потоковые ответы (выгрузка истории)
+    профилируются целиком, а не только до заголовков. Профиль записывается на диск в пуле потоков.
+    """
+    if not should_profile(PROFILING_HEADER in request.headers):
+        return await call_next(request)
+    profiler = SamplingProfiler(threading.get_ident())
+    started_at = datetime.utcnow()
+    started = time.perf_counter()
+    profiler.start()
+
+    async def finish(status):
+        stacks = profiler.stop()
+        route = request.scope.get("route")
+        await run_in_threadpool(save_profile, stacks, {
+            "kind": "request",
+            "method": request.method,
+            "path": request.url.path,
+            "route": route.path if route else None,
+            "status": status,
+            "started_at": started_at.isoformat(),
+            "duration_ms": (time.perf_counter() - started) * 1000.0,
+        })
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        await finish(None)
+        raise
+
+    async def profiled_body(body_iterator):
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            await finish(response.status_code)
+
+    response.body_iterator = profiled_body(response.body_iterator)
+    return response
+
+
+_task_profilers = {}
+_task_lock = threading.Lock()
+
+
+def _on_task_prerun(task_id=None, task=None, args=None, **kwargs):
+    model = args[0] if args and isinstance(args[0], str) else None
+    if not should_profile(model in PROFILING_MODELS):
+        return
+    profiler = SamplingProfiler(threading.get_ident())
+    with _task_lock:
+        _task_profilers[task_id] = (profiler, datetime.utcnow(), time.perf_counter(), model)
+    profiler.start()
+
+
+def _on_task_postrun(task_id=None, task=None, state=None, **kwargs):
+    with _task_lock:
+        entry = _task_profilers.pop(task_id, None)
+    if entry is None:
+        return
+    profiler, started_at, started, model = entry
+    _task_profile_writer.submit(save_profile, profiler.stop(), {
+        "kind": "task",
+        "task": task.name,
+        "task_id": task_id,
+        "model": model,
+        "state": state,
+        "started_at": started_at.isoformat(),
+        "duration_ms": (time.perf_counter() - started) * 1000.0,
+    })
+
+
+def install_celery_hooks():
+    """
+    Подключает профилирование задач к сигналам Celery. Вызывается, только если профилирование включено.
+    """
+    from celery.signals import task_prerun, task_postrun
+    task_prerun.connect(_on_task_prerun, weak=False)
+    task_postrun.connect(_on_task_postrun, weak=False)
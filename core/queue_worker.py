@@ -0,0 +1,15 @@
+"""
+Запуск worker'а Celery для одной очереди с ее настройками (конкурентность, prefetch, автомасштабирование):
+    python -m core.queue_worker predict_fast [дополнительные параметры celery worker]
+Служебные и периодические задачи (QUEUE_DEFAULT):
+    python -m core.queue_worker celery
+"""
+import sys
+
+from core.queues import WORKER_QUEUES, worker_argv
+from core.worker import app
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in WORKER_QUEUES:
+        sys.exit(f"usage: python -m core.queue_worker {{{','.join(WORKER_QUEUES)}}} [celery worker options]")
+    app.worker_main(worker_argv(sys.argv[1]) + sys.argv[2:])
@@ -0,0 +1,294 @@
+"""
+Очереди задач предсказаний и worker'ы для них.
+
+Одиночные предсказания дешевых моделей (стоимость не больше ROUTING_CHEAP_COST) идут в QUEUE_FAST,
+дорогих - в QUEUE_SLOW, порции пакетных задач - в QUEUE_BULK; служебные задачи остаются в QUEUE_DEFAULT.
+Модель может явно указать очередь полем "queue" в метаданных. Каждую очередь обслуживает свой worker
+со своими настройками, поэтому медленные модели и пакетные задачи не задерживают интерактивные запросы.
+Периодические задачи celery beat (журнал биллинга, архив, сборка образцов) идут в QUEUE_DEFAULT,
+и для нее тоже нужен worker: без него возвраты не зачисляются, а архив и хранилище образцов не чистятся.
+
+Запуск worker'а очереди:
+    python -m core.queue_worker predict_fast
+    python -m core.queue_worker celery
+"""
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+import redis
+from celery.concurrency.base import apply_target
+from celery.concurrency.thread import ApplyResult, TaskPool as ThreadTaskPool
+from celery.signals import task_prerun, task_postrun
+from celery.worker import state
+from celery.worker.autoscale import Autoscaler
+
+from core import metrics
+from core.config import (REDIS_URL, QUEUE_DEFAULT, QUEUE_FAST, QUEUE_SLOW, QUEUE_BULK, QUEUE_DEFAULT_CONCURRENCY,
+                         ROUTING_CHEAP_COST, QUEUE_FAST_CONCURRENCY, QUEUE_FAST_PREFETCH, QUEUE_FAST_SLO_MS,
+                         QUEUE_SLOW_CONCURRENCY, QUEUE_SLOW_PREFETCH, QUEUE_SLOW_SLO_MS, QUEUE_BULK_CONCURRENCY,
+                         QUEUE_BULK_PREFETCH, QUEUE_BULK_SLO_MS, QUEUE_AUTOSCALE_KEEPALIVE)
+from core.metrics import PUBLISHED_AT_HEADER
+
+SINGLE_TASK = "utils.prediction.perform_async_prediction"
+BULK_TASK = "utils.prediction.perform_bulk_prediction"
+
+
+@dataclass(frozen=True)
+class QueueSettings:
+    """
+    Настройки worker'а одной очереди.
+    """
+    name: str
+    min_concurrency: int
+    max_concurrency: int
+    prefetch_multiplier: int
+    slo_ms: float  # Целевое время от постановки задачи до ее завершения
+
+    @classmethod
+    def from_config(cls, name: str, concurrency: str, prefetch_multiplier: int, slo_ms: float) -> "QueueSettings":
+        low, _, high = concurrency.partition(",")
+        return cls(name, int(low), int(high or low), prefetch_multiplier, slo_ms)
+
+
+QUEUES = {
+    settings.name: settings for settings in (
+        QueueSettings.from_config(QUEUE_FAST, QUEUE_FAST_CONCURRENCY, QUEUE_FAST_PREFETCH, QUEUE_FAST_SLO_MS),
+        QueueSettings.from_config(QUEUE_SLOW, QUEUE_SLOW_CONCURRENCY, QUEUE_SLOW_PREFETCH, QUEUE_SLOW_SLO_MS),
+        QueueSettings.from_config(QUEUE_BULK, QUEUE_BULK_CONCURRENCY, QUEUE_BULK_PREFETCH, QUEUE_BULK_SLO_MS),
+    )
+}
+
+# Очереди, для которых запускаются worker'ы: служебная очередь без SLO в отчет о задержках не входит
+WORKER_QUEUES = {**QUEUES, QUEUE_DEFAULT: QueueSettings.from_config(QUEUE_DEFAULT, QUEUE_DEFAULT_CONCURRENCY, 1, 0.0)}
+
+
+def queue_for_model(model_name: str) -> str:
+    """
+    Очередь одиночных предсказаний модели.
+    :param model_name:  Название модели
+    """
+    from utils.registry import model_registry
+    entry = model_registry.get(model_name)
+    if entry is None:
+        return QUEUE_SLOW
+    if entry.metadata.get("queue") in QUEUES:
+        return entry.metadata["queue"]
+    return QUEUE_FAST if entry.cost <= ROUTING_CHEAP_COST else QUEUE_SLOW
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    """
+    Маршрутизатор Celery (task_routes): очередь по типу задачи и стоимости модели.
+    Очередь, явно заданная при постановке задачи, не переопределяется.
+    """
+    if name == BULK_TASK:
+        return {"queue": QUEUE_BULK}
+    if name == SINGLE_TASK and args:
+        return {"queue": queue_for_model(args[0])}
+    return {"queue": QUEUE_DEFAULT}
+
+
+class RuntimeTracker:
+    """
+    Скользящее среднее времени выполнения задач по очередям в процессе worker'а.
+    """
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self._runtime = {}
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def started(self, task_id: str):
+        with self._lock:
+            self._started[task_id] = time.perf_counter()
+
+    def finished(self, task_id: str, queue: str):
+        with self._lock:
+            started = self._started.pop(task_id, None)
+            if started is None:
+                return
+            seconds = time.perf_counter() - started
+            previous = self._runtime.get(queue)
+            self._runtime[queue] = seconds if previous is None else previous + self.alpha * (seconds - previous)
+
+    def runtime(self, queue: str):
+        """
+        Среднее время выполнения задачи очереди в секундах или None, если задач еще не было.
+        """
+        return self._runtime.get(queue)
+
+
+runtime_tracker = RuntimeTracker()
+
+
+def _task_queue(task) -> str:
+    return (getattr(task.request, "delivery_info", None) or {}).get("routing_key") or QUEUE_DEFAULT
+
+
+@task_prerun.connect
+def _on_task_prerun(task_id=None, **kwargs):
+    runtime_tracker.started(task_id)
+
+
+@task_postrun.connect
+def _on_task_postrun(task_id=None, task=None, **kwargs):
+    queue = _task_queue(task)
+    runtime_tracker.finished(task_id, queue)
+    published_at = getattr(task.request, PUBLISHED_AT_HEADER, None)
+    settings = QUEUES.get(queue)
+    if published_at is not None and settings is not None:
+        metrics.observe_queue_latency(queue, max(0.0, time.time() - published_at), settings.slo_ms / 1000.0)
+
+
+class ScalableThreadPool(ThreadTaskPool):
+    """
+    Пул потоков Celery, размер которого может менять автомасштабирование.
+
+    Стандартный пул потоков создает ровно столько потоков, с какой конкурентностью запущен (при --autoscale -
+    минимум), и не умеет расти. Этот пул создает потоки на максимум, а одновременно выполняет не больше
+    limit задач: остальные ждут свободного места в своих потоках. grow/shrink меняют только limit,
+    поэтому сокращение не прерывает выполняющиеся задачи.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_concurrency = self.limit
+        self._slots = threading.Condition()
+        self._active = 0
+
+    def set_max_concurrency(self, max_concurrency: int):
+        """
+        Максимальная конкурентность (верхняя граница --autoscale). Вызывается до запуска пула.
+        """
+        self.executor.shutdown(wait=False)
+        self.max_concurrency = max(max_concurrency, self.limit)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+
+    def on_apply(self, target, args=None, kwargs=None, callback=None, accept_callback=None, **_):
+        return ApplyResult(self.executor.submit(self._run_limited, target, args, kwargs, callback, accept_callback))
+
+    def _run_limited(self, *args):
+        with self._slots:
+            self._slots.wait_for(lambda: self._active < self.limit)
+            self._active += 1
+        try:
+            # Задача считается принятой (accept_callback) только после того, как получила место
+            return apply_target(*args)
+        finally:
+            with self._slots:
+                self._active -= 1
+                self._slots.notify()
+
+    def grow(self, n: int = 1):
+        with self._slots:
+            self.limit = min(self.limit + n, self.max_concurrency)
+            self._slots.notify_all()
+
+    def shrink(self, n: int = 1):
+        with self._slots:
+            self.limit = max(self.limit - n, 1)
+
+    @property
+    def active(self) -> int:
+        """
+        Количество выполняющихся сейчас задач.
+        """
+        return self._active
+
+    def _get_info(self) -> dict:
+        info = super()._get_info()
+        info.update({"max-concurrency": self.max_concurrency, "limit": self.limit, "active": self._active})
+        return info
+
+
+class QueueAutoscaler(Autoscaler):
+    """
+    Конкурентность worker'а по глубине его очередей и времени выполнения задач.
+
+    Чтобы очередь глубиной D разобралась за SLO при среднем времени задачи r, нужно
+    ceil(D * r / SLO) исполнителей; кроме того, не меньше, чем задач уже выполняется.
+    Результат ограничивается min/max из --autoscale. Сокращение - не раньше keepalive после роста.
+
+    Размер меняют prefork-пул (grow/shrink появляются у него после запуска) и ScalableThreadPool;
+    у стандартного пула потоков размер не меняется, и автомасштабирование ничего не делает.
+    """
+
+    def __init__(self, pool, max_concurrency, min_concurrency=0, worker=None, keepalive=QUEUE_AUTOSCALE_KEEPALIVE,
+                 mutex=None):
+        super().__init__(pool, max_concurrency, min_concurrency, worker=worker, keepalive=keepalive, mutex=mutex)
+        self.redis = redis.Redis.from_url(REDIS_URL, socket_timeout=0.5)
+        # Celery создает пул с минимальной конкурентностью; пул потоков заранее создает потоки на максимум
+        if isinstance(pool, ScalableThreadPool):
+            pool.set_max_concurrency(max_concurrency)
+        # Позволяет сократить конкурентность, если после запуска очередь так и не появилась
+        self._last_scale_up = time.monotonic()
+
+    @property
+    def queues(self) -> list:
+        consume_from = self.worker.app.amqp.queues.consume_from if self.worker is not None else None
+        return list(consume_from) if consume_from else [QUEUE_DEFAULT]
+
+    @property
+    def qty(self) -> int:
+        reserved = len(state.reserved_requests)
+        queues = self.queues
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for queue in queues:
+                pipe.llen(queue)
+            depth = sum(pipe.execute())
+        except redis.RedisError:
+            return reserved
+        runtimes = [runtime for runtime in map(runtime_tracker.runtime, queues) if runtime is not None]
+        slo = min((QUEUES[queue].slo_ms for queue in queues if queue in QUEUES), default=None)
+        if not runtimes or not slo:
+            # Время выполнения еще неизвестно: ориентируемся только на наличие очереди
+            return reserved + (1 if depth else 0)
+        return max(reserved, math.ceil((depth + reserved) * max(runtimes) / (slo / 1000.0)))
+
+    def _maybe_scale(self, req=None):
+        # Проверяется при каждом вызове: prefork-пул получает grow/shrink только при запуске
+        if hasattr(self.pool, "grow"):
+            return super()._maybe_scale(req)
+
+
+def worker_argv(queue: str) -> list:
+    """
+    Аргументы celery worker для очереди с ее настройками.
+    """
+    settings = WORKER_QUEUES[queue]
+    argv = ["worker", "--queues", settings.name, "--hostname", f"{settings.name}@%h",
+            "--concurrency", str(settings.max_concurrency),
+            "--autoscale", f"{settings.max_concurrency},{settings.min_concurrency}",
+            "--prefetch-multiplier", str(settings.prefetch_multiplier)]
+    return argv
+
+
+def slo_report(rows) -> dict:
+    """
+    Отчет о соблюдении SLO по очередям.
+    :param rows:    Пары (очередь, время от постановки задачи до результата в секундах)
+    :return:    По каждой очереди: количество задач, p50/p95/p99, SLO и доля задач, уложившихся в него
+    """
+    latencies = {}
+    for queue, seconds in rows:
+        latencies.setdefault(queue, []).append(seconds * 1000.0)
+    report = {}
+    for name, settings in QUEUES.items():
+        values = latencies.get(name, [])
+        item = {"slo_ms": settings.slo_ms, "count": len(values)}
+        if values:
+            item.update({
+                "p50_ms": float(np.percentile(values, 50)),
+                "p95_ms": float(np.percentile(values, 95)),
+                "p99_ms": float(np.percentile(values, 99)),
+                "within_slo": sum(value <= settings.slo_ms for value in values) / len(values),
+            })
+        report[name] = item
+    return report
+
@@ -11,18 +11,68 @@
 
 from celery import Celery
 
+from core.config import (REDIS_URL, PREDICTION_BATCHING, PREDICTION_BATCH_MAX_SIZE, LEDGER_APPLY_INTERVAL,
+                         PROFILING_ENABLED, QUEUE_DEFAULT, RETENTION_INTERVAL, UPLOAD_GC_INTERVAL,
+                         RESULT_SWEEP_INTERVAL)
+# Подключают обработчики сигналов Celery для метрик очереди и задач и для автомасштабирования
+import core.metrics  # noqa: F401
+import core.queues  # noqa: F401
+
 # Создание экземпляра приложения Celery и установка брокера
 app = Celery('worker',
-             broker='redis://localhost:6379',  # здесь можно указать конкретную базу данных внутри Redis, если нужно
-             backend='redis://localhost:6379',  # то же самое для бэкенда
-             include=['utils.prediction'])  # здесь должен быть путь до файла, который содержит задачи Celery
+             broker=REDIS_URL,  # здесь можно указать конкретную базу данных внутри Redis, если нужно
+             backend=REDIS_URL,  # то же самое для бэкенда
+             # здесь должны быть пути до файлов, которые содержат задачи Celery
+             include=['utils.prediction', 'utils.results', 'core.billing', 'core.archive', 'core.blobstore'])
 
 app.conf.update(
     timezone='Europe/Moscow',
     result_expires=3600,  # Время жизни результата задачи в секундах
     worker_prefetch_multiplier=1,  # Количество дополнительных задач внутреннего запаса, которые worker подгружает одновременно
     task_track_started=True,
+    # Одиночные предсказания делятся по стоимости модели, пакетные идут в отдельную очередь (core/queues.py)
+    task_default_queue=QUEUE_DEFAULT,
+    task_routes=('core.queues.route_task',),
+    worker_autoscaler='core.queues:QueueAutoscaler',
+    beat_schedule={
+        # Пакетное применение журнала биллинга к балансам (запускается через celery beat)
+        'apply-ledger': {
+            'task': 'core.billing.apply_ledger',
+            'schedule': LEDGER_APPLY_INTERVAL,
+        },
+        # Результаты для запросов, присоединившихся к задаче уже после записи ее результата
+        'finish-joined-predictions': {
+            'task': 'utils.results.finish_joined_predictions',
+            'schedule': RESULT_SWEEP_INTERVAL,
+        },
+        # Перенос старых предсказаний из таблицы в архив Parquet
+        'archive-predictions': {
+            'task': 'core.archive.archive_predictions',
+            'schedule': RETENTION_INTERVAL,
+        },
+        # Удаление загруженных образцов, срок хранения которых истек
+        'collect-blobs': {
+            'task': 'core.blobstore.collect_blobs',
+            'schedule': UPLOAD_GC_INTERVAL,
+        },
+    },
 )
 
+if PROFILING_ENABLED:
+    # Профилирование части задач; при выключенном профилировании обработчики не подключаются вовсе
+    from core import profiling
+    profiling.install_celery_hooks()
+
+if PREDICTION_BATCHING:
+    # Батчер собирает строки из одновременно выполняющихся задач одного процесса, поэтому worker работает
+    # на пуле потоков, и батч не больше числа одновременно выполняющихся задач. worker_concurrency действует
+    # при запуске celery worker без параметров; core.queue_worker задает конкурентность очереди через
+    # --autoscale (QUEUE_*_CONCURRENCY), и при росте очереди пул доходит до ее максимума
+    app.conf.update(
+        # Пул потоков, размер которого меняет автомасштабирование (core.queues.QueueAutoscaler)
+        worker_pool='core.queues:ScalableThreadPool',
+        worker_concurrency=PREDICTION_BATCH_MAX_SIZE,
+    )
+
 if __name__ == '__main__':
     app.start()
\ No newline at end of file
@@ -1,71 +1,170 @@
+import json
+import math
+import secrets
+import shutil
+import tempfile
+import time
 import uuid
-import os
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+import numpy as np
 
 from schema.schemas import User as UserSchema, UserCreate, Token
 from core.worker import app as celery_app
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Query, WebSocket, WebSocketDisconnect, Response, Request, Header
+from fastapi.responses import StreamingResponse, FileResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from core.auth import create_access_token, get_current_user
-from core.database import get_db
-from sqlalchemy.orm import Session
-from models.models import User as UserModel, Prediction
-from utils.prediction import perform_async_prediction, perform_prediction
-from utils.preprocessing import read_user_data, preprocess_user_input
+from core.auth import create_access_token, get_current_user, token_cache, verify_password, hash_password, CurrentUser
+from core.database import get_async_db, AsyncSessionLocal
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from models.models import User as UserModel, Prediction, BulkResult
+from utils.prediction import perform_async_prediction, perform_prediction, perform_bulk_prediction
+from utils.results import result_text, task_item, write_task_results
+from utils.registry import model_registry
+from utils.preprocessing import BULK_FORMATS, count_samples, file_format, iter_sample_chunks
+from utils.uploads import ingest_upload, load_features, UploadTooLarge, UploadSizeLimit
+from utils.inline import inline_predictor
+from utils.explain import explain, ExplanationNotSupported
+from utils.features import get_feature_schema
+from utils.history import history_query, encode_cursor, cursor_key, row_to_dict, InvalidCursor
 
-from core.config import MODEL_COSTS
+from core.config import QUEUE_BULK, METRICS_ENABLED, PROFILING_ENABLED, ADMIN_TOKEN, BULK_CHUNK_SIZE, HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE, HISTORY_EXPORT_CHUNK, EXPLAIN_TOP_K, EXPLAIN_MAX_SAMPLES
+from core.cache import prediction_cache
+from core import archive, billing, blobstore, events, metrics, profiling, queues
 
-UPLOAD_DIRECTORY = "./uploaded_files"
+app = FastAPI()
+metrics.register_queue_depth()
+# Файл с одним образцом ограничен по размеру еще до разбора формы
+app.add_middleware(UploadSizeLimit, paths=("/upload_file/", "/upload_and_predict/"))
 
-if not os.path.exists(UPLOAD_DIRECTORY):
-    os.makedirs(UPLOAD_DIRECTORY)
 
-app = FastAPI()
+@app.middleware("http")
+async def measure_request(request: Request, call_next):
+    """
+    Время обработки запросов по шаблону маршрута (а не по URL, чтобы идентификаторы не раздували метки)
+    """
+    if not METRICS_ENABLED:
+        return await call_next(request)
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.HTTP_REQUEST_SECONDS.labels(request.method, route.path if route else "unmatched",
+                                        response.status_code).observe(time.perf_counter() - started)
+    return response
+
+
+if PROFILING_ENABLED:
+    # Middleware добавляется только при включенном профилировании, иначе запросы его не проходят
+    app.middleware("http")(profiling.profile_request)
+
 
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN or not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Доступ запрещен.")
 
-def authenticate_user(db: Session, username: str, password: str):
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+def get_profiles(limit: int = 100):
+    """
+    Сохраненные профили запросов и задач, от новых к старым
+    :param limit:   Максимальное количество профилей
+    """
+    return profiling.list_profiles(limit)
+
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+def download_profile(profile_id: str):
+    """
+    Профиль в формате collapsed stacks (вход для flamegraph.pl, speedscope)
+    :param profile_id:  Идентификатор профиля
+    """
+    try:
+        path = profiling.profile_path(profile_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Профиль не найден.")
+    return FileResponse(path, media_type="text/plain", filename=f"{profile_id}.folded")
+
+
+@app.get("/admin/predictions", dependencies=[Depends(require_admin)])
+async def scan_predictions(created_from: datetime, created_to: datetime, user_id: Optional[int] = None,
+                           model_name: Optional[str] = None, status: Optional[str] = None,
+                           result: Optional[str] = None):
+    """
+    Выгрузка предсказаний за период из таблицы и архива в формате NDJSON, от новых к старым.
+    Таблица читается по индексу created_at, из архива - только разделы дней периода
+    :param created_from:    Начало периода
+    :param created_to:  Конец периода
+    :param user_id:  Только предсказания этого пользователя
+    :param model_name:  Только предсказания этой модели
+    :param status:  Фильтр по статусу (finished, failed, pending)
+    :param result:  Фильтр по результату
+    """
+    filters = {"created_from": created_from, "created_to": created_to, "result": result, "status": status,
+               "model_name": model_name}
+    lines = history_lines(history_query(user_id, **filters), user_id=user_id, **filters)
+    return StreamingResponse(ndjson_chunks(lines), media_type="application/x-ndjson")
+
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Метрики API в текстовом формате Prometheus
+    """
+    content, content_type = metrics.render()
+    return Response(content=content, media_type=content_type)
+
+
+async def authenticate_user(db: AsyncSession, username: str, password: str):
     """
     Проверяет, существует ли пользователь с таким логином и паролем
     :param db:       БД
     :param username:    Логин пользователя
     :param password:    Пароль пользователя
     """
-    user = db.query(UserModel).filter(UserModel.username == username).first()
+    user = (await db.execute(select(UserModel).where(UserModel.username == username))).scalars().first()
     if not user:
         return False
-    if not user.verify_password(password):
+    # Завершаем читающую транзакцию до проверки пароля: bcrypt выполняется долго,
+    # и снимок БД не должен удерживаться все это время
+    await db.commit()
+    if not await verify_password(user, password):
         return False
     return user
 
 
 @app.post("/users/register", response_model=UserSchema)
-def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
+async def register_user(user_data: UserCreate, db: AsyncSession = Depends(get_async_db)):
     """
     Создание нового пользователя
     :param user_data:    Данные нового пользователя
     :param db:           БД
     """
-    existing_user = db.query(UserModel).filter(UserModel.username == user_data.username).first()
+    existing_user = (await db.execute(
+        select(UserModel).where(UserModel.username == user_data.username))).scalars().first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Пользователь с таким логином уже существует")
     user = UserModel(username=user_data.username)
-    user.hash_password(user_data.password)
+    user.password = await hash_password(user_data.password)
     user.balance = 500
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     return user
 
 
 @app.post("/token", response_model=Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(),
+                                 db: AsyncSession = Depends(get_async_db)):
     """
         Получение токена для авторизации
     :param form_data:    Форма авторизации
     :param db:          БД
     :return:       Токен
     """
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -75,13 +174,13 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
     # Обновляем дату последнего входа пользователя
     user.last_login_at = datetime.utcnow()
     db.add(user)
-    db.commit()
+    await db.commit()
     access_token = create_access_token(data={"sub": user.username})
     return {"access_token": access_token, "token_type": "bearer", "user_id": user.id}
 
 
 @app.get("/users/me/", response_model=UserSchema)
-def get_current_user_info(current_user: UserModel = Depends(get_current_user)):
+async def get_current_user_info(current_user: CurrentUser = Depends(get_current_user)):
     """
     Получение информации о текущем пользователе
     :param current_user:    Текущий пользователь
@@ -90,8 +189,8 @@ def get_current_user_info(current_user: UserModel = Depends(get_current_user)):
 
 
 @app.put("/users/update_balance", response_model=UserSchema)
-def update_user_balance(amount: float, current_user: UserModel = Depends(get_current_user),
-                        db: Session = Depends(get_db)):
+async def update_user_balance(amount: float, current_user: CurrentUser = Depends(get_current_user),
+                              db: AsyncSession = Depends(get_async_db)):
     """
     Обновление баланса пользователя
     :param amount:    Баланс пользователя
@@ -99,19 +198,242 @@ def update_user_balance(amount: float, current_user: UserModel = Depends(get_cur
     :param db:             БД
     :return:       Текущий пользователь
     """
-    current_user.balance += amount
-    db.commit()
-    db.refresh(current_user)
-    return current_user
+    try:
+        await billing.topup(db, current_user.id, amount)
+    except billing.InsufficientFunds:
+        raise HTTPException(status_code=400, detail="Недостаточно кредитов.")
+    await db.commit()
+    token_cache.invalidate_user(current_user.id)
+    return await db.get(UserModel, current_user.id)
 
 @app.get("/users/{user_id}/predictions")
-def get_user_predictions(user_id: int, db: Session = Depends(get_db)):
-    predictions = db.query(Prediction).filter(Prediction.user_id == user_id).all()
-    return predictions
+async def get_user_predictions(user_id: int, response: Response, limit: int = HISTORY_PAGE_SIZE,
+                               cursor: Optional[str] = None, created_from: Optional[datetime] = None,
+                               created_to: Optional[datetime] = None, result: Optional[str] = None,
+                               status: Optional[str] = None, current_user: CurrentUser = Depends(get_current_user),
+                               db: AsyncSession = Depends(get_async_db)):
+    """
+    Страница истории предсказаний пользователя, от новых к старым.
+    Курсор следующей страницы возвращается в заголовке X-Next-Cursor (нет заголовка - страница последняя).
+    Смотреть можно только свою историю
+    :param user_id:  Идентификатор пользователя
+    :param limit:   Размер страницы
+    :param cursor:  Курсор из предыдущей страницы
+    :param created_from:    Начало периода
+    :param created_to:  Конец периода
+    :param result:  Фильтр по результату
+    :param status:  Фильтр по статусу (finished, failed, pending)
+    :param current_user:    Текущий пользователь
+    :param db:             БД
+    """
+    if user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Доступ запрещен.")
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    query = history_or_400(user_id, cursor, created_from, created_to, result, status)
+    # Лишняя строка показывает, есть ли следующая страница
+    live = (await db.execute(query.limit(limit + 1))).all()
+    rows = [row_to_dict(row) for row in live]
+    horizon = archive.horizon()
+    if horizon is not None and (len(live) <= limit or live[-1].created_at < horizon):
+        # Страница доходит до периода архива: сливаем строки таблицы и архива с того же ключа
+        archived = await run_in_threadpool(
+            lambda: [row for table in archive.iter_archive(limit + 1, user_id=user_id, before=cursor_key(cursor),
+                                                             created_from=created_from, created_to=created_to,
+                                                             result=result, status=status)
+                     for row in archive.history_rows(table)])
+        seen = {row["id"] for row in rows}
+        rows.extend(row for row in archived if row["id"] not in seen)
+        rows.sort(key=lambda row: (datetime.fromisoformat(row["created_at"]), row["id"]), reverse=True)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(datetime.fromisoformat(rows[-1]["created_at"]),
+                                                          rows[-1]["id"])
+    return rows
+
+
+@app.get("/users/{user_id}/predictions/export")
+async def export_user_predictions(user_id: int, format: str = "ndjson", cursor: Optional[str] = None,
+                                  created_from: Optional[datetime] = None, created_to: Optional[datetime] = None,
+                                  result: Optional[str] = None, status: Optional[str] = None,
+                                  current_user: CurrentUser = Depends(get_current_user)):
+    """
+    Потоковая выгрузка всей истории (с теми же фильтрами) в формате NDJSON или JSON-массива.
+    Строки читаются из БД порциями и сразу отправляются клиенту, вся выборка в памяти не собирается.
+    Выгрузить можно только свою историю
+    :param user_id:  Идентификатор пользователя
+    :param format:  ndjson или json
+    :param current_user:    Текущий пользователь
+    """
+    if user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Доступ запрещен.")
+    if format not in ("ndjson", "json"):
+        raise HTTPException(status_code=400, detail="Поддерживаются форматы ndjson и json.")
+    query = history_or_400(user_id, cursor, created_from, created_to, result, status)
+    lines = history_lines(query, user_id=user_id, before=cursor_key(cursor), created_from=created_from,
+                          created_to=created_to, result=result, status=status)
+
+    async def json_array():
+        separator = "["
+        async for chunk in lines:
+            yield separator + ",".join(chunk)
+            separator = ","
+        yield "[]" if separator == "[" else "]"
+
+    if format == "ndjson":
+        return StreamingResponse(ndjson_chunks(lines), media_type="application/x-ndjson")
+    return StreamingResponse(json_array(), media_type="application/json")
+
+
+async def history_lines(query, **archive_filters):
+    """
+    Строки истории в JSON порциями: сначала из таблицы, затем из архива (каждая часть от новых к старым).
+    Вся выборка в памяти не собирается
+    :param query:   Запрос к таблице predictions
+    :param archive_filters: Те же условия для архива (core.archive.archive_filter)
+    """
+    # Собственная сессия: сессия из зависимости закрывается до отправки потокового ответа
+    async with AsyncSessionLocal() as db:
+        stream = await db.stream(query.execution_options(yield_per=HISTORY_EXPORT_CHUNK))
+        async for partition in stream.partitions():
+            yield [json.dumps(row_to_dict(row)) for row in partition]
+    # Архив читается по одному дню, чтение файлов не блокирует цикл событий
+    tables = archive.iter_archive(**archive_filters)
+    while (table := await run_in_threadpool(next, tables, None)) is not None:
+        yield [json.dumps(row) for row in archive.history_rows(table)]
+
+
+async def ndjson_chunks(lines):
+    async for chunk in lines:
+        yield "".join(f"{line}\n" for line in chunk)
+
+
+def history_or_400(user_id: int, cursor, created_from, created_to, result, status):
+    try:
+        return history_query(user_id, cursor, created_from, created_to, result, status)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Некорректный курсор.")
+
+def get_model_for_user(model_name: str, current_user: CurrentUser, samples: int = 1):
+    """
+    Проверяет наличие модели и баланс пользователя.
+    Проверка баланса предварительная, окончательно стоимость резервируется атомарно в billing.reserve
+    :param model_name:    Название модели
+    :param current_user:    Текущий пользователь
+    :param samples:     Количество образцов
+    :return:       Запись модели из реестра
+    """
+    model = model_registry.get(model_name)
+    if model is None:
+        raise HTTPException(status_code=404, detail="Модель не найдена.")
+    if model.cost * samples > current_user.balance:
+        raise HTTPException(status_code=400, detail="Недостаточно кредитов.")
+    return model
+
+
+async def reserve_or_reject(db: AsyncSession, user_id: int, amount: float, job_id: str):
+    """
+    Резервирует стоимость задачи или отвечает ошибкой 400
+    """
+    try:
+        await billing.reserve(db, user_id, amount, job_id)
+    except billing.InsufficientFunds:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Недостаточно кредитов.")
+    finally:
+        # Баланс изменился (или снимок оказался устаревшим): следующий запрос перечитает пользователя
+        token_cache.invalidate_user(user_id)
+
+
+async def submit_prediction(model, processed_data: list, current_user: CurrentUser, db: AsyncSession,
+                            inline: bool = False, file_id: str = None):
+    """
+    Ставит задачу предсказания (или берет результат из кэша), записывает Prediction и списывает стоимость
+    :param model:    Запись модели из реестра
+    :param processed_data:    Вектор признаков
+    :param current_user:    Текущий пользователь
+    :param db:             БД
+    :param inline:    Выполнить предсказание в процессе API, если модель укладывается в свой бюджет задержки
+    :param file_id:    Идентификатор загруженного образца, по нему предсказание можно объяснить
+    :return:       Идентификатор задачи и результат, если он уже известен
+    """
+    job_id = str(uuid.uuid4())
+    task_id = job_id
+    cached_result = None
+    cache_key = None
+    # Стоимость каскада известна только после выполнения, поэтому он всегда идет через очередь
+    if prediction_cache is not None and model.fixed_cost:
+        with metrics.stage("cache_lookup", model.name):
+            cache_key = prediction_cache.key(model.name, model.version, processed_data)
+            cached_result = prediction_cache.get(cache_key)
+    if cached_result is None and inline and model.fixed_cost and inline_predictor is not None:
+        # Дешевая модель считается сразу, дальше результат оформляется так же, как попадание в кэш
+        with metrics.stage("inline_predict", model.name):
+            cached_result = await inline_predictor.predict(model, processed_data)
+        if cached_result is not None and cache_key:
+            prediction_cache.put(cache_key, cached_result)
+    if cached_result is not None:
+        # Из кэша и inline-предсказателя приходит число; хранится и отдается результат так же, как его пишет worker
+        cached_result = result_text(cached_result)
+    if cached_result is None and cache_key:
+        # Если такой же образец уже считается, присоединяемся к его задаче
+        task_id = prediction_cache.claim(cache_key, job_id) or job_id
+
+    owns_task = cached_result is None and task_id == job_id
+    try:
+        with metrics.stage("reserve", model.name):
+            await reserve_or_reject(db, current_user.id, model.cost, job_id)
+    except HTTPException:
+        if owns_task and cache_key:
+            prediction_cache.release(cache_key)
+        raise
+    prediction = Prediction(
+        job_id=job_id,
+        task_id=None if cached_result is not None else task_id,
+        user_id=current_user.id,
+        model_name=model.name,
+        model_version=model.version,
+        result=cached_result,
+        status="finished" if cached_result is not None else None,
+        finished_at=datetime.utcnow() if cached_result is not None else None,
+        queue=None if cached_result is not None else queues.queue_for_model(model.name),
+        file_id=file_id,
+        cost=model.cost
+    )
+    db.add(prediction)
+    if cached_result is not None:
+        await db.flush()
+        await db.run_sync(lambda session: billing.settle(session, [job_id]))
+    # Резерв и запись о предсказании фиксируются до постановки задачи, чтобы транзакция была короткой
+    with metrics.stage("db_commit", model.name):
+        await db.commit()
+
+    if owns_task:
+        try:
+            # Выполнение асинхронного предсказания
+            with metrics.stage("enqueue", model.name):
+                perform_async_prediction.apply_async((model.name, processed_data, current_user.id),
+                                                     {"cache_key": cache_key}, task_id=task_id)
+        except Exception:
+            # Задача не поставлена: завершаем с ошибкой и возвращаем оплату этому запросу и всем, кто уже
+            # присоединился к задаче; присоединившиеся позже завершит finish_joined_predictions
+            error = "Очередь задач недоступна."
+            published = await db.run_sync(lambda session: write_task_results(session, [task_item(task_id, error=error)]))
+            await db.commit()
+            if cache_key:
+                prediction_cache.release(cache_key)
+            await run_in_threadpool(events.publish, published)
+            raise HTTPException(status_code=503, detail=error)
+
+    if cached_result is not None:
+        await run_in_threadpool(events.publish,
+                                [(current_user.id, events.job_event(job_id, "finished", cached_result))])
+        return {"job_id": job_id, "status": "finished", "result": cached_result}
+    return {"job_id": job_id}
+
 
 @app.post("/predict/")
-async def predict(file_id: str, model_name: str, current_user: UserModel = Depends(get_current_user),
-                  db: Session = Depends(get_db), ):
+async def predict(file_id: str, model_name: str, current_user: CurrentUser = Depends(get_current_user),
+                  db: AsyncSession = Depends(get_async_db), ):
     """
     Выполнение асинхронного предсказания
     :param file_id:    Идентификатор файла
@@ -121,86 +443,515 @@ async def predict(file_id: str, model_name: str, current_user: UserModel = Depen
     :return:       Идентификатор задачи
     """
     # Проверка баланса пользователя и наличия модели
-    if MODEL_COSTS[model_name] > current_user.balance:
-        raise HTTPException(status_code=400, detail="Недостаточно кредитов.")
-    # Достаем содержимое файла
+    model = get_model_for_user(model_name, current_user)
+    # Достаем вектор признаков, подготовленный при загрузке файла
+    try:
+        processed_data = (await run_in_threadpool(load_features, file_id)).tolist()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Файл не найден.")
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Ошибка разбора файла: {exc}")
+
+    return await submit_prediction(model, processed_data, current_user, db, file_id=file_id)
+
 
-    file_path = f"{UPLOAD_DIRECTORY}/{file_id}"
+@app.post("/predict_sync/")
+async def predict_sync(file_id: str, model_name: str, current_user: CurrentUser = Depends(get_current_user),
+                       db: AsyncSession = Depends(get_async_db)):
+    """
+    Синхронное предсказание: модели, укладывающиеся в свой бюджет задержки, выполняются в процессе API
+    и результат возвращается в ответе; остальные модели ставятся в очередь, как в /predict/
+    :param file_id:    Идентификатор файла
+    :param model_name:    Название модели
+    :param current_user:    Текущий пользователь
+    :param db:             БД
+    :return:       Идентификатор задачи и результат (status "finished") либо только идентификатор задачи
+    """
+    model = get_model_for_user(model_name, current_user)
     try:
-        with open(file_path, "r") as file:
-            file_content = file.read()
+        processed_data = (await run_in_threadpool(load_features, file_id)).tolist()
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Файл не найден.")
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Ошибка разбора файла: {exc}")
 
-    user_data = read_user_data(file_content)
-    processed_data = preprocess_user_input(user_data)
+    return await submit_prediction(model, processed_data, current_user, db, inline=True, file_id=file_id)
 
-    # Выполнение асинхронного предсказания
-    prediction = perform_async_prediction.apply_async((model_name, processed_data, current_user.id))
-    print('perform_async_prediction: ', prediction.result)
-    job_id = prediction.id
-    prediction = Prediction(
-        job_id=job_id,
-        user_id=current_user.id,
-        result=prediction.result,
-        cost=MODEL_COSTS[model_name]
-    )
-    db.add(prediction)
-    # Списание стоимости предсказания с баланса пользователя
-    current_user.balance -= MODEL_COSTS[model_name]
-    db.commit()
-    db.refresh(current_user)
 
-    return {"job_id": job_id}
+@app.get("/predict_sync/stats")
+async def get_inline_stats():
+    """
+    Задержки моделей при синхронном выполнении и загрузка пула
+    """
+    return inline_predictor.stats() if inline_predictor is not None else {"enabled": False}
+
+
+@app.post("/upload_and_predict/")
+async def upload_and_predict(model_name: str, file: UploadFile = File(...),
+                             current_user: CurrentUser = Depends(get_current_user),
+                             db: AsyncSession = Depends(get_async_db)):
+    """
+    Загрузка файла и постановка задачи предсказания одним запросом
+    :param model_name:    Название модели
+    :param file:    Файл с одним образцом: JSON, упакованные биты (.bits) или массив (.npy)
+    :param current_user:    Текущий пользователь
+    :param db:             БД
+    :return:       Идентификаторы файла и задачи
+    """
+    model = get_model_for_user(model_name, current_user)
+    file_id, features = await ingest_file(file)
+    processed_data = features.tolist()
+    return {"file_id": file_id, **(await submit_prediction(model, processed_data, current_user, db, file_id=file_id))}
+
+
+def explanation_or_400(model, X, top_k: int) -> list:
+    try:
+        return explain(model, X, top_k)
+    except ExplanationNotSupported as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+def registered_model_or_404(model_name: str):
+    model = model_registry.get(model_name)
+    if model is None:
+        raise HTTPException(status_code=404, detail="Модель не найдена.")
+    return model
+
+
+@app.post("/explain/")
+async def explain_sample(file_id: str, model_name: str, top_k: int = Query(EXPLAIN_TOP_K, ge=1),
+                         current_user: CurrentUser = Depends(get_current_user)):
+    """
+    Объяснение предсказания модели для загруженного образца: признаки с наибольшим вкладом в логит
+    :param file_id:    Идентификатор файла
+    :param model_name:    Название модели
+    :param top_k:    Количество признаков в ответе
+    :param current_user:    Текущий пользователь
+    :return:       Базовое значение, итоговый логит и top_k признаков с их значениями и вкладами
+    """
+    model = registered_model_or_404(model_name)
+    try:
+        features = await run_in_threadpool(load_features, file_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Файл не найден.")
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Ошибка разбора файла: {exc}")
+    explanation = await run_in_threadpool(explanation_or_400, model, features.reshape(1, -1), top_k)
+    return {"model_name": model.name, "model_version": model.version, **explanation[0]}
+
+
+@app.get("/predictions/{job_id}/explain")
+async def explain_prediction(job_id: str, top_k: int = Query(EXPLAIN_TOP_K, ge=1),
+                             current_user: CurrentUser = Depends(get_current_user),
+                             db: AsyncSession = Depends(get_async_db)):
+    """
+    Объяснение сохраненного одиночного предсказания пользователя по образцу, на котором оно было сделано.
+    Объяснение строится текущей версией модели; версия, сделавшая предсказание, возвращается отдельно
+    :param job_id: Идентификатор задачи
+    :param top_k:    Количество признаков в ответе
+    :param current_user:    Текущий пользователь
+    :param db: База данных
+    """
+    prediction = (await db.execute(select(Prediction.model_name, Prediction.model_version, Prediction.file_id,
+                                          Prediction.result)
+                                   .where(Prediction.job_id == job_id, Prediction.user_id == current_user.id))).first()
+    if prediction is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена.")
+    if prediction.file_id is None:
+        raise HTTPException(status_code=404, detail="Образец этого предсказания не сохранен.")
+    model = registered_model_or_404(prediction.model_name)
+    try:
+        features = await run_in_threadpool(load_features, prediction.file_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Образец этого предсказания не сохранен.")
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Ошибка разбора файла: {exc}")
+    explanation = await run_in_threadpool(explanation_or_400, model, features.reshape(1, -1), top_k)
+    return {"job_id": job_id, "result": prediction.result, "model_name": model.name,
+            "model_version": model.version, "prediction_model_version": prediction.model_version, **explanation[0]}
+
+
+@app.post("/explain_bulk/")
+async def explain_bulk(model_name: str, top_k: int = Query(EXPLAIN_TOP_K, ge=1), file: UploadFile = File(...),
+                       current_user: CurrentUser = Depends(get_current_user)):
+    """
+    Объяснения для файла с образцами (форматы как в /predict_bulk/) в виде NDJSON, по строке на образец.
+    Файл разбирается и объясняется порциями по BULK_CHUNK_SIZE образцов
+    :param model_name:  Название модели
+    :param top_k:    Количество признаков для каждого образца
+    :param file:    Файл с образцами (.jsonl, .csv, .npy или .frames)
+    :param current_user:    Текущий пользователь
+    """
+    model = registered_model_or_404(model_name)
+    bulk_format = file_format(file.filename, BULK_FORMATS)
+    if bulk_format is None:
+        raise HTTPException(status_code=400, detail="Поддерживаются только файлы .jsonl, .csv, .npy и .frames.")
+    try:
+        samples = await run_in_threadpool(count_samples, file.file, bulk_format)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Ошибка разбора файла: {exc}")
+    if samples > EXPLAIN_MAX_SAMPLES:
+        raise HTTPException(status_code=400, detail=f"Файл содержит больше {EXPLAIN_MAX_SAMPLES} образцов.")
+    # Проверяем, что модель объяснима, до начала потокового ответа
+    explanation_or_400(model, np.zeros((1, len(get_feature_schema()))), 1)
+    # Загруженный файл закрывается при выходе из обработчика, раньше, чем будет отправлен ответ
+    source = tempfile.TemporaryFile()
+    await run_in_threadpool(shutil.copyfileobj, file.file, source)
+
+    def explain_chunk(chunks, first_row: int):
+        chunk = next(chunks, None)
+        if chunk is None:
+            return None, 0
+        items = explain(model, chunk, top_k)
+        return "".join(f"{json.dumps({'row': row, **item})}\n"
+                       for row, item in enumerate(items, start=first_row)), len(items)
+
+    async def lines():
+        chunks = iter_sample_chunks(source, bulk_format, BULK_CHUNK_SIZE)
+        rows = 0
+        try:
+            while True:
+                text, count = await run_in_threadpool(explain_chunk, chunks, rows)
+                if text is None:
+                    break
+                rows += count
+                yield text
+        except (ValueError, KeyError) as exc:
+            # Ответ уже начат: ошибка разбора передается последней строкой
+            yield json.dumps({"error": f"Ошибка разбора файла: {exc}"}) + "\n"
+        finally:
+            source.close()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/models/")
+async def list_models():
+    """
+    Доступные модели с версиями и стоимостью использования
+    """
+    return [entry.describe() for entry in model_registry.entries().values()]
+
+
+@app.get("/queues/slo")
+async def get_queue_slo(minutes: int = Query(15, ge=1, le=24 * 60), db: AsyncSession = Depends(get_async_db)):
+    """
+    Соблюдение SLO очередей за последние minutes минут: время от постановки задачи до результата
+    :param minutes:    Длина окна отчета, минуты
+    :param db:             БД
+    :return:       По каждой очереди: количество задач, p50/p95/p99, SLO, доля уложившихся и незавершенные задачи
+    """
+    since = datetime.utcnow() - timedelta(minutes=minutes)
+    rows = (await db.execute(select(Prediction.queue, Prediction.created_at, Prediction.finished_at)
+                             .where(Prediction.created_at >= since, Prediction.queue.is_not(None)))).all()
+    report = queues.slo_report((queue, (finished_at - created_at).total_seconds())
+                               for queue, created_at, finished_at in rows if finished_at is not None)
+    for queue, _, finished_at in rows:
+        if finished_at is None and queue in report:
+            report[queue]["pending"] = report[queue].get("pending", 0) + 1
+    return {"window_minutes": minutes, "queues": report}
+
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """
+    Счетчики кэша результатов предсказаний в процессе API
+    """
+    if prediction_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **prediction_cache.stats()}
+
+
+@app.get("/admin/uploads", dependencies=[Depends(require_admin)])
+async def get_upload_stats(db: AsyncSession = Depends(get_async_db)):
+    """
+    Хранилище загруженных образцов: количество и объем образцов, ссылки предсказаний на них, образцы к удалению
+    """
+    return await db.run_sync(blobstore.stats)
 
 
 @app.get("/get_prediction_status/{job_id}")
-def get_prediction_status(job_id: str, db: Session = Depends(get_db)):
+async def get_prediction_status(job_id: str, db: AsyncSession = Depends(get_async_db)):
+    """
+    Получение статуса выполнения задачи.
+    Результаты записывает worker, поэтому статус читается только из БД
+    """
+    prediction = (await db.execute(select(Prediction).where(Prediction.job_id == job_id))).scalars().first()
+    return job_status(prediction)
+
+
+def job_status(prediction) -> dict:
+    """
+    Текущий статус задачи по записи о предсказании
+    :param prediction:  Запись о предсказании или None
+    """
+    if prediction is None:
+        return {"status": "not_found"}
+    if prediction.status == "failed":
+        return {"status": "failed", "result": prediction.result}
+    if prediction.status == "finished" or prediction.result is not None:
+        if prediction.samples > 1:
+            return {"status": "finished", "samples": prediction.samples}
+        return {"status": "finished", "result": prediction.result}
+    return {"status": "PENDING"}
+
+
+async def job_snapshot(db: AsyncSession, user_id: int, job_ids: list) -> list:
+    """
+    Текущие статусы задач пользователя, на которые оформлена подписка.
+    Чужие и несуществующие задачи получают статус not_found.
+    """
+    predictions = (await db.execute(
+        select(Prediction).where(Prediction.user_id == user_id, Prediction.job_id.in_(job_ids)))).scalars().all()
+    predictions = {prediction.job_id: prediction for prediction in predictions}
+    snapshot = []
+    for job_id in job_ids:
+        if job_id not in predictions:
+            snapshot.append(events.job_event(job_id, "not_found"))
+        else:
+            snapshot.append({"job_id": job_id, **job_status(predictions[job_id])})
+    return snapshot
+
+
+async def open_job_subscription(user_id: int) -> events.JobSubscription:
+    subscription = events.JobSubscription(user_id)
+    try:
+        await subscription.open()
+    except Exception:
+        raise HTTPException(status_code=503, detail="Сервис уведомлений недоступен.")
+    return subscription
+
+
+async def job_event_stream(subscription: events.JobSubscription, job_ids: list, snapshot: list):
+    """
+    События задач пользователя: сначала текущие статусы, затем изменения из Redis pub/sub.
+    Если заданы job_ids, поток завершается, когда все эти задачи завершены; None означает пустое сообщение.
+    """
+    pending = set(job_ids) if job_ids else None
+    try:
+        for event in snapshot:
+            yield event
+            if event["status"] in events.FINAL_STATUSES or event["status"] == "not_found":
+                pending.discard(event["job_id"])
+        while pending is None or pending:
+            event = await subscription.next_event()
+            if event is not None and pending is not None:
+                if event["job_id"] not in pending:
+                    continue
+                if event["status"] in events.FINAL_STATUSES:
+                    pending.discard(event["job_id"])
+            yield event
+    finally:
+        await subscription.close()
+
+
+@app.get("/events/jobs")
+async def stream_job_events(job_id: List[str] = Query(None), current_user: CurrentUser = Depends(get_current_user),
+                            db: AsyncSession = Depends(get_async_db)):
+    """
+    Поток Server-Sent Events о завершении задач вместо опроса статуса.
+    :param job_id:  Идентификаторы задач (можно указать несколько); без них - все задачи пользователя
+    :param current_user:    Текущий пользователь
+    :param db:             БД
+    """
+    subscription = await open_job_subscription(current_user.id)
+    # Подписка оформлена до чтения статусов, поэтому завершение между ними не теряется
+    snapshot = await job_snapshot(db, current_user.id, job_id) if job_id else []
+
+    async def sse():
+        async for event in job_event_stream(subscription, job_id, snapshot):
+            yield f"data: {json.dumps(event)}\n\n" if event is not None else ": keep-alive\n\n"
+
+    return StreamingResponse(sse(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.websocket("/ws/jobs")
+async def job_events_websocket(websocket: WebSocket, token: str, job_id: List[str] = Query(None)):
     """
-    Получение статуса выполнения задачи в Celery
-    .Описание.
+    То же, что /events/jobs, через WebSocket. Токен передается параметром запроса,
+    так как браузер не позволяет задать заголовки WebSocket.
+    :param websocket:   Соединение
+    :param token:   Токен для авторизации
+    :param job_id:  Идентификаторы задач; без них - все задачи пользователя
     """
-    task = celery_app.AsyncResult(job_id)
-    if task.state == 'SUCCESS':
-        return {"status": "finished", "result": task.result}
-    elif task.state == 'FAILURE':
-        return {"status": "failed", "result": str(task.result)}  # Возможно, добавить обработку ошибок
-    else:
-        return {"status": task.state}
+    # Сессия БД нужна только на время авторизации и чтения статусов, а не на все время соединения
+    async with AsyncSessionLocal() as db:
+        try:
+            current_user = await get_current_user(token, db)
+        except HTTPException:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        try:
+            subscription = await open_job_subscription(current_user.id)
+        except HTTPException:
+            await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+            return
+        snapshot = await job_snapshot(db, current_user.id, job_id) if job_id else []
+    await websocket.accept()
+    try:
+        async for event in job_event_stream(subscription, job_id, snapshot):
+            await websocket.send_json(event if event is not None else {"status": "keep-alive"})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
 
 
 @app.get("/predictions/{job_id}")
-def get_prediction_result(job_id: str, db: Session = Depends(get_db)):
+async def get_prediction_result(job_id: str, db: AsyncSession = Depends(get_async_db)):
     """
     Получение результата предсказания по идентификатору задачи.
     :param job_id: Идентификатор задачи
     :param db: База данных
     """
-    task_result = celery_app.AsyncResult(job_id)
-    if task_result.ready():
-        prediction = db.query(Prediction).filter(Prediction.job_id == job_id).first()
-        if prediction:
-            prediction.result = task_result.result
-            db.commit()
-            db.refresh(prediction)
-            return prediction
-        else:
-            return "Результат не найден."
-    else:
+    prediction = (await db.execute(select(Prediction).where(Prediction.job_id == job_id))).scalars().first()
+    if prediction is None:
+        return "Результат не найден."
+    if prediction.status is None and prediction.result is None:
         # Задача еще не завершена
         return "Задача еще обрабатывается."
+    return prediction
+
+
+async def ingest_file(file: UploadFile) -> tuple:
+    """
+    Сохраняет загруженный файл в виде готового вектора признаков
+    :param file:    Файл
+    :return:       Идентификатор файла и вектор признаков
+    """
+    try:
+        return await ingest_upload(file)
+    except UploadTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Ошибка разбора файла: {exc}")
 
 
 @app.post("/upload_file/")
 async def upload_file(file: UploadFile = File(...)):
     """
     Загрузка файла
-    :param file:    Файл
+    :param file:    Файл с одним образцом: JSON, упакованные биты (.bits) или массив (.npy)
     :return:       Идентификатор файла
     """
-    file_id = str(uuid.uuid4())
-    file_path = f"{UPLOAD_DIRECTORY}/{file_id}"
-    with open(file_path, "wb") as file_object:
-        file_object.write(await file.read())
-    print('upload_model: ', file_id)
+    file_id, _ = await ingest_file(file)
     return {"file_id": file_id}
+
+
+def dispatch_bulk_chunks(file, bulk_format: str, model, user_id: int, job_id: str, samples: int) -> int:
+    """
+    Потоково разбирает файл и ставит по задаче Celery на каждую порцию
+    :return:       Количество поставленных порций
+    """
+    tasks = []
+    chunks = math.ceil(samples / BULK_CHUNK_SIZE)
+    first_row = 0
+    try:
+        for chunk in iter_sample_chunks(file, bulk_format, BULK_CHUNK_SIZE):
+            tasks.append(perform_bulk_prediction.apply_async(
+                (model.name, chunk.tolist(), user_id),
+                {"job_id": job_id, "chunk_cost": model.cost * len(chunk), "chunks": chunks, "first_row": first_row}))
+            first_row += len(chunk)
+    except (ValueError, KeyError):
+        # Файл оказался некорректным - отменяем уже поставленные порции
+        for task in tasks:
+            task.revoke()
+        raise
+    return len(tasks)
+
+
+@app.post("/predict_bulk/")
+async def predict_bulk(model_name: str, file: UploadFile = File(...),
+                       current_user: CurrentUser = Depends(get_current_user),
+                       db: AsyncSession = Depends(get_async_db)):
+    """
+    Пакетное предсказание для файла JSONL или CSV с одним образцом на строку либо двоичного пакета (.npy, .frames).
+    Файл разбирается потоково порциями, на каждую порцию ставится одна задача Celery.
+    :param model_name:  Название модели
+    :param file:    Файл с образцами (.jsonl, .csv, .npy или .frames)
+    :param current_user:    Текущий пользователь
+    :param db:             БД
+    :return:       Идентификатор пакетной задачи и количество образцов
+    """
+    model = get_model_for_user(model_name, current_user)
+    bulk_format = file_format(file.filename, BULK_FORMATS)
+    if bulk_format is None:
+        raise HTTPException(status_code=400, detail="Поддерживаются только файлы .jsonl, .csv, .npy и .frames.")
+
+    # Подсчет и разбор файла выполняются в пуле потоков, чтобы не блокировать цикл событий
+    try:
+        samples = await run_in_threadpool(count_samples, file.file, bulk_format)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Ошибка разбора файла: {exc}")
+    if samples == 0:
+        raise HTTPException(status_code=400, detail="Файл не содержит образцов.")
+    cost = model.cost * samples
+    job_id = str(uuid.uuid4())
+    await reserve_or_reject(db, current_user.id, cost, job_id)
+    prediction = Prediction(
+        job_id=job_id,
+        user_id=current_user.id,
+        model_name=model_name,
+        model_version=model.version,
+        cost=cost,
+        samples=samples,
+        queue=QUEUE_BULK,
+    )
+    db.add(prediction)
+    await db.commit()
+
+    try:
+        chunks = await run_in_threadpool(dispatch_bulk_chunks, file.file, bulk_format, model, current_user.id,
+                                         job_id, samples)
+    except (ValueError, KeyError) as exc:
+        await db.run_sync(lambda session: billing.refund(session, job_id))
+        await db.commit()
+        raise HTTPException(status_code=400, detail=f"Ошибка разбора файла: {exc}")
+
+    return {"job_id": job_id, "samples": samples, "chunks": chunks, "cost": cost}
+
+
+@app.get("/bulk_predictions/{job_id}")
+async def get_bulk_prediction_result(job_id: str, offset: int = 0, limit: int = BULK_CHUNK_SIZE,
+                                     db: AsyncSession = Depends(get_async_db)):
+    """
+    Статус пакетной задачи и построчные результаты.
+    :param job_id:  Идентификатор пакетной задачи
+    :param offset:  Номер первой строки в выдаче
+    :param limit:   Максимальное количество строк в выдаче
+    :param db:             БД
+    """
+    prediction = (await db.execute(select(Prediction).where(Prediction.job_id == job_id))).scalars().first()
+    if prediction is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена.")
+    if prediction.status is None:
+        completed = (await db.execute(
+            select(func.count(), func.max(BulkResult.chunks)).where(BulkResult.job_id == job_id))).first()
+        return {"status": "processing", "completed_chunks": completed[0],
+                "chunks": completed[1] or math.ceil(prediction.samples / BULK_CHUNK_SIZE)}
+    if prediction.status == "failed":
+        return {"status": "failed"}
+
+    # Читаем только порции, которые пересекаются с запрошенным диапазоном строк
+    start = (await db.execute(select(func.max(BulkResult.first_row))
+                              .where(BulkResult.job_id == job_id, BulkResult.first_row <= offset))).scalar()
+    chunks = (await db.execute(
+        select(BulkResult.first_row, BulkResult.results)
+        .where(BulkResult.job_id == job_id, BulkResult.first_row >= (start or 0),
+               BulkResult.first_row < offset + limit)
+        .order_by(BulkResult.first_row))).all()
+    rows = []
+    for first_row, results in chunks:
+        results = json.loads(results)
+        rows.extend({"row": row, "result": result}
+                    for row, result in enumerate(results, start=first_row) if offset <= row < offset + limit)
+    return {"status": "finished", "samples": prediction.samples, "results": rows}
+
+
+@app.get("/batching/stats")
+def get_batching_stats():
+    """
+    Статистика микробатчинга по всем worker'ам: размеры батчей и время ожидания по моделям
+    """
+    replies = celery_app.control.broadcast('batching_stats', reply=True, timeout=1.0)
+    return {worker: stats for reply in replies for worker, stats in reply.items()}
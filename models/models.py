@@ -1,8 +1,10 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Boolean, Text, Index
 from sqlalchemy.sql import func
+from datetime import datetime
 from passlib.context import CryptContext
 from sqlalchemy.orm import relationship
 from core.database import Base, engine
+from core.migrations import migrate
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -26,13 +28,71 @@ class User(Base):
 
 class Prediction(Base):
     __tablename__ = 'predictions'
+    # История пользователя читается по user_id в порядке created_at (постраничная выдача по ключу)
+    # Перенос в архив и выборки за период без пользователя идут по created_at
+    __table_args__ = (Index('ix_predictions_user_created', 'user_id', 'created_at'),
+                      Index('ix_predictions_created', 'created_at'))
     id = Column(Integer, primary_key=True, autoincrement=True)
     job_id = Column(String, unique=True, nullable=True)  # Добавляем новое поле для job_id, которое будет уникально
+    task_id = Column(String, index=True, nullable=True)  # Задача Celery; одинаковые запросы могут делить одну задачу
     user_id = Column(Integer, ForeignKey('users.id'))
+    model_name = Column(String, nullable=True)
+    model_version = Column(String, nullable=True)  # Версия модели из реестра на момент постановки задачи
     result = Column(String, nullable=True)
+    status = Column(String, nullable=True)  # finished / failed, пока задача выполняется - NULL
     cost = Column(Float, default=10.0)
-    created_at = Column(DateTime, server_default=func.now())  # Добавляем новое поле для даты создания
+    samples = Column(Integer, default=1)  # Количество образцов, для пакетных задач больше одного
+    # Время задается приложением с микросекундами: по нему строится курсор постраничной выдачи,
+    # и значение из курсора должно совпадать с сохраненным
+    created_at = Column(DateTime, default=datetime.utcnow, server_default=func.now())
+    finished_at = Column(DateTime, nullable=True)  # Время записи результата worker'ом
+    queue = Column(String, nullable=True)  # Очередь Celery; NULL - результат получен без очереди (кэш, синхронно)
+    # Загруженный образец одиночного предсказания (для объяснения); пока на образец ссылаются, он не удаляется
+    file_id = Column(String, index=True, nullable=True)
     user = relationship("User", back_populates="predictions")
 
+
+class LedgerEntry(Base):
+    """
+    Запись журнала движения кредитов. Журнал только дополняется, User.balance - его материализованная сумма.
+    """
+    __tablename__ = 'ledger_entries'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.id'), index=True, nullable=False)
+    job_id = Column(String, index=True, nullable=True)  # Задача, к которой относится запись
+    kind = Column(String, nullable=False)  # reserve / settle / refund / topup
+    amount = Column(Float, nullable=False)  # Изменение баланса: списания отрицательные, зачисления положительные
+    applied = Column(Boolean, default=False, index=True)  # Учтена ли запись в User.balance
+    created_at = Column(DateTime, server_default=func.now())
+
+class BulkResult(Base):
+    """
+    Результаты одной порции пакетной задачи, записываются worker'ом.
+    """
+    __tablename__ = 'bulk_results'
+    __table_args__ = (Index('ix_bulk_results_job_first_row', 'job_id', 'first_row'),)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String, nullable=False)
+    first_row = Column(Integer, nullable=False)  # Номер первой строки порции в исходном файле
+    chunks = Column(Integer, nullable=False)  # Общее количество порций пакетной задачи
+    status = Column(String, nullable=False)  # finished / failed
+    results = Column(Text, nullable=True)  # JSON-список предсказаний или текст ошибки
+    created_at = Column(DateTime, server_default=func.now())
+
+
+class Blob(Base):
+    """
+    Образец в хранилище по хэшу содержимого (core/blobstore.py). Одинаковые загрузки сохраняются один раз,
+    ссылки на образец - предсказания с этим file_id.
+    """
+    __tablename__ = 'blobs'
+    digest = Column(String, primary_key=True)  # sha256 содержимого, он же file_id
+    size = Column(Integer, nullable=False)  # Размер в байтах
+    created_at = Column(DateTime, server_default=func.now())
+    expires_at = Column(DateTime, index=True, nullable=False)  # Последняя загрузка + UPLOAD_TTL
+
+
 # Base.metadata.drop_all(engine)
 Base.metadata.create_all(engine)
+# create_all не меняет существующие таблицы: новые колонки и индексы добавляют миграции
+migrate(engine, Base.metadata)
@@ -0,0 +1,50 @@
+import os
+import tempfile
+
+# Настройки читаются при импорте core.config: тесты работают с отдельной БД и без Redis
+_directory = tempfile.mkdtemp(prefix="tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_directory}/test.db")
+os.environ.setdefault("UPLOAD_DIRECTORY", os.path.join(_directory, "uploads"))
+os.environ.setdefault("PREDICTION_CACHE_REDIS", "0")
+os.environ.setdefault("JOB_EVENTS_ENABLED", "0")
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    from core.database import SessionLocal
+    from models.models import Base
+    with SessionLocal() as session:
+        yield session
+        session.rollback()
+        for table in reversed(Base.metadata.sorted_tables):
+            session.execute(table.delete())
+        session.commit()
+
+
+@pytest.fixture
+def user(db):
+    from models.models import User
+    user = User(username="user", password="-", balance=100.0)
+    db.add(user)
+    db.commit()
+    return user
+
+
+@pytest.fixture
+def client(user):
+    # Приложение целиком, без Redis и брокера: постановку задач тесты подменяют сами
+    from fastapi.testclient import TestClient
+    from core.auth import create_access_token, token_cache
+    from core.cache import prediction_cache
+    from core.database import async_engine
+    from main import app
+    token_cache.invalidate_user(user.id)
+    if prediction_cache is not None:
+        prediction_cache.local = type(prediction_cache.local)(prediction_cache.local.max_size)
+    with TestClient(app) as client:
+        client.headers["Authorization"] = f"Bearer {create_access_token({'sub': user.username})}"
+        yield client
+        # Соединения асинхронного движка привязаны к циклу событий клиента
+        client.portal.call(async_engine.dispose)
@@ -0,0 +1,67 @@
+import asyncio
+
+from sqlalchemy import func, select
+
+from core import billing
+from core.database import AsyncSessionLocal, async_engine
+from models.models import LedgerEntry, User
+
+
+async def debit(user_id: int, cost: float, job_id: str) -> bool:
+    async with AsyncSessionLocal() as db:
+        try:
+            await billing.reserve(db, user_id, cost, job_id)
+        except billing.InsufficientFunds:
+            await db.rollback()
+            return False
+        await db.commit()
+        return True
+
+
+def reserve_concurrently(user_id: int, requests: int, cost: float) -> list:
+    async def run():
+        try:
+            succeeded = await asyncio.gather(*(debit(user_id, cost, f"job-{i}") for i in range(requests)))
+        finally:
+            # Пул асинхронного движка привязан к циклу событий, который закрывает asyncio.run
+            await async_engine.dispose()
+        return [f"job-{i}" for i, ok in enumerate(succeeded) if ok]
+    return asyncio.run(run())
+
+
+def ledger_total(db, user_id: int) -> float:
+    return db.scalar(select(func.coalesce(func.sum(LedgerEntry.amount), 0.0)).where(LedgerEntry.user_id == user_id))
+
+
+def test_concurrent_reserves_do_not_overdraft(db, user):
+    succeeded = reserve_concurrently(user.id, 50, 7.0)
+
+    db.expire_all()
+    balance = db.get(User, user.id).balance
+    assert len(succeeded) == 14
+    assert balance == 100.0 - 14 * 7.0 >= 0
+    assert db.scalar(select(func.count()).select_from(LedgerEntry)) == 14
+    assert 100.0 + ledger_total(db, user.id) == balance
+
+
+def test_refunds_applied_from_ledger_keep_balance_consistent(db, user):
+    succeeded = reserve_concurrently(user.id, 10, 10.0)
+    assert len(succeeded) == 10
+
+    # Полный возврат, частичный возврат и повторный возврат сверх резерва (ограничивается остатком 6)
+    billing.refund(db, succeeded[0])
+    billing.refund(db, succeeded[1], 4.0)
+    billing.refund(db, succeeded[1], 100.0)
+    billing.refund(db, succeeded[2], 3.0)
+    billing.refund(db, "unknown")
+    db.commit()
+    db.expire_all()
+    # Возвраты до применения журнала на баланс не влияют
+    assert db.get(User, user.id).balance == 0.0
+
+    assert billing.apply_ledger() == 4
+    assert billing.apply_ledger() == 0
+    db.expire_all()
+    assert db.get(User, user.id).balance == 23.0
+    assert 100.0 + ledger_total(db, user.id) == 23.0
+    assert not db.scalar(select(func.count()).select_from(LedgerEntry).where(LedgerEntry.applied.is_(False)))
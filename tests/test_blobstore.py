@@ -0,0 +1,71 @@
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from core import blobstore
+from core.config import UPLOAD_DIRECTORY
+from models.models import Blob, Prediction
+
+LATER = datetime.utcnow() + timedelta(days=365)
+
+
+def test_concurrent_uploads_of_same_content(db):
+    data = os.urandom(4096)
+    errors = []
+
+    def upload():
+        from core.database import SessionLocal
+        try:
+            with SessionLocal() as session:
+                blobstore.store(session, data)
+        except Exception as exc:  # noqa: BLE001
+            errors.append(exc)
+
+    threads = [threading.Thread(target=upload) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    digest = blobstore.digest_of(data)
+    assert errors == []
+    assert db.query(Blob).filter_by(digest=digest).count() == 1
+    assert blobstore.load(digest) == data
+    directory = os.path.dirname(blobstore.blob_store.path(digest))
+    assert not [name for name in os.listdir(directory) if name.endswith(".tmp")]
+
+
+def test_expired_samples_referenced_by_predictions_are_kept(db, user):
+    kept, collected = os.urandom(64), os.urandom(64)
+    kept_digest, collected_digest = blobstore.store(db, kept), blobstore.store(db, collected)
+    db.add(Prediction(job_id="job", user_id=user.id, file_id=kept_digest, status="finished"))
+    db.commit()
+
+    assert blobstore.collect_garbage(db) == 0
+    assert blobstore.collect_garbage(db, now=LATER) == 1
+    assert blobstore.load(kept_digest) == kept
+    assert db.get(Blob, collected_digest) is None
+    try:
+        blobstore.load(collected_digest)
+    except FileNotFoundError:
+        pass
+    else:
+        raise AssertionError("образец не удален")
+
+
+def test_legacy_files_are_collected_unless_referenced(db, user):
+    os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
+    referenced, npy, raw = (str(uuid.uuid4()) for _ in range(3))
+    np.save(os.path.join(UPLOAD_DIRECTORY, f"{referenced}.npy"), np.zeros(3, np.uint8))
+    np.save(os.path.join(UPLOAD_DIRECTORY, f"{npy}.npy"), np.zeros(3, np.uint8))
+    with open(os.path.join(UPLOAD_DIRECTORY, raw), "w") as raw_file:
+        raw_file.write('{"features": {}}')
+    db.add(Prediction(job_id="job", user_id=user.id, file_id=referenced, status="finished"))
+    db.commit()
+
+    assert blobstore.collect_legacy(db) == 0
+    assert blobstore.collect_legacy(db, now=LATER) == 2
+    assert os.listdir(UPLOAD_DIRECTORY).count(f"{referenced}.npy") == 1
+    assert not {f"{npy}.npy", raw} & set(os.listdir(UPLOAD_DIRECTORY))
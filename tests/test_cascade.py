@@ -0,0 +1,92 @@
+import io
+
+import numpy as np
+import pytest
+
+from core import billing
+from models.models import LedgerEntry, Prediction, User
+from utils.cascade import CascadeEntry, CascadeModel
+from utils.prediction import perform_async_prediction
+from utils.registry import model_registry
+
+
+class Threshold:
+    """
+    Первая модель каскада: вероятность положительного класса задана первым признаком.
+    """
+    classes_ = np.array([0, 1])
+
+    def predict_proba(self, X):
+        return np.column_stack([1.0 - X[:, 0], X[:, 0]])
+
+
+class Recorder:
+    """
+    Вторая модель каскада: запоминает, какие образцы ей переданы.
+    """
+
+    def __init__(self):
+        self.seen = []
+
+    def predict(self, X):
+        self.seen.append(X.copy())
+        return np.full(len(X), 7)
+
+
+def test_only_uncertain_samples_reach_second_model():
+    second = Recorder()
+    X = np.array([[0.05], [0.5], [0.95], [0.3]])
+    predictions, escalated = CascadeModel(Threshold(), second, 0.2, 0.8).run(X)
+    assert escalated.tolist() == [False, True, False, True]
+    assert predictions.tolist() == [0, 7, 1, 7]
+    assert len(second.seen) == 1 and np.array_equal(second.seen[0], X[[1, 3]])
+
+
+@pytest.fixture
+def cascade(monkeypatch):
+    # Каскад из моделей реестра; полоса [0, 1] передает второй модели все образцы, [2, 3] - ни одного
+    get = model_registry.get
+
+    def register(band) -> CascadeEntry:
+        entry = CascadeEntry("cascade", {"cascade": {"first": "lr_model", "second": "gb_model", "band": band}},
+                             get("lr_model"), get("gb_model"))
+        monkeypatch.setattr(model_registry, "get", lambda name: entry if name == "cascade" else get(name))
+        return entry
+    return register
+
+
+@pytest.fixture
+def enqueued(monkeypatch):
+    calls = []
+    monkeypatch.setattr(perform_async_prediction, "apply_async",
+                        lambda args, kwargs, task_id: calls.append((args, kwargs, task_id)))
+    return calls
+
+
+def run_cascade(client, enqueued) -> str:
+    buffer = io.BytesIO()
+    np.save(buffer, np.random.default_rng(0).integers(0, 2, size=241).astype(np.uint8))
+    file_id = client.post("/upload_file/", files={"file": ("sample.npy", buffer.getvalue())}).json()["file_id"]
+    response = client.post("/predict/", params={"file_id": file_id, "model_name": "cascade"})
+    assert response.status_code == 200, response.text
+    [(args, kwargs, task_id)] = enqueued
+    assert perform_async_prediction.apply(args=args, kwargs=kwargs, task_id=task_id).successful()
+    return response.json()["job_id"]
+
+
+@pytest.mark.parametrize("band, escalated", [([0.0, 1.0], True), ([2.0, 3.0], False)])
+def test_cascade_charges_for_models_it_ran(client, db, user, cascade, enqueued, band, escalated):
+    entry = cascade(band)
+    job_id = run_cascade(client, enqueued)
+    charged = entry.cost if escalated else entry.first.cost
+
+    db.expire_all()
+    prediction = db.query(Prediction).filter_by(job_id=job_id).one()
+    assert prediction.status == "finished" and prediction.cost == charged
+    ledger = {kind: amount for kind, amount in db.query(LedgerEntry.kind, LedgerEntry.amount)}
+    # Резервируется стоимость обеих моделей, неиспользованная вторая возвращается
+    assert ledger[billing.RESERVE] == -entry.cost
+    assert ledger.get(billing.REFUND, 0.0) == (0.0 if escalated else entry.second.cost)
+    billing.apply_pending(db)
+    db.expire_all()
+    assert db.get(User, user.id).balance == 100.0 - charged
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+
+from utils.compiled_trees import MAX_TREE_FEATURES, compile_model
+
+
+def dataset(seed: int, n_samples: int = 400, n_features: int = 40) -> tuple:
+    rng = np.random.default_rng(seed)
+    X = rng.integers(0, 2, size=(n_samples, n_features))
+    y = (X[:, :8].sum(axis=1) + rng.integers(0, 3, size=n_samples) > 5).astype(int)
+    return X, y
+
+
+@pytest.mark.parametrize("max_depth", [1, 3, 6, 10])
+def test_compiled_gradient_boosting_matches_sklearn(max_depth):
+    X, y = dataset(max_depth)
+    model = GradientBoostingClassifier(n_estimators=20, max_depth=max_depth, random_state=0).fit(X, y)
+    compiled = compile_model(model)
+    assert compiled is not None
+    # Деревья глубины 3 зависят не больше чем от 7 признаков, глубокие - от большего числа, чем допускает таблица
+    if max_depth <= 3:
+        assert compiled.leaf_table is not None
+    if compiled.leaf_table is not None:
+        assert compiled.leaf_table.shape[1] <= 1 << MAX_TREE_FEATURES
+
+    rng = np.random.default_rng(1)
+    for probe in (rng.integers(0, 2, size=(500, X.shape[1])), rng.random((500, X.shape[1])), X[:1]):
+        assert np.array_equal(model.predict_proba(probe), compiled.predict_proba(probe))
+        assert np.array_equal(model.predict(probe), compiled.predict(probe))
+
+
+def test_deep_trees_are_walked_instead_of_tabulated():
+    X, y = dataset(0, n_samples=2000, n_features=60)
+    model = GradientBoostingClassifier(n_estimators=5, max_depth=12, random_state=0).fit(X, y)
+    compiled = compile_model(model)
+    assert compiled.leaf_table is None and compiled.code_weights is None
+    assert np.array_equal(model.predict_proba(X), compiled.predict_proba(X))
+
+
+@pytest.mark.parametrize("max_depth", [3, None])
+def test_random_forest_is_not_compiled(max_depth):
+    # Реестр использует такую модель sklearn без изменений
+    X, y = dataset(2)
+    model = RandomForestClassifier(n_estimators=10, max_depth=max_depth, random_state=0).fit(X, y)
+    assert compile_model(model) is None
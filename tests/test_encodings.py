@@ -0,0 +1,69 @@
+import io
+import json
+
+import numpy as np
+import pytest
+
+from utils.encodings import encode_bitset, encode_frames
+from utils.features import SchemaMismatch, get_feature_schema
+from utils.preprocessing import count_samples, decode_sample, iter_sample_chunks
+
+N_FEATURES = len(get_feature_schema())
+
+
+def binary_rows(n_samples: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 2, size=(n_samples, N_FEATURES)).astype(np.uint8)
+
+
+def npy_bytes(array) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+
+def test_sample_formats_decode_to_same_vector():
+    row = binary_rows(1)[0]
+    document = {"features": dict(zip(get_feature_schema().names, row.tolist()))}
+    for payload, file_format in ((json.dumps(document).encode(), "json"), (encode_bitset(row), "bits"),
+                                 (npy_bytes(row), "npy"), (npy_bytes(row.reshape(1, -1)), "npy"),
+                                 (npy_bytes(row.astype(np.float32)), "npy")):
+        assert np.array_equal(decode_sample(payload, file_format), row), file_format
+
+
+@pytest.mark.parametrize("payload, file_format", [
+    (b"\xff" * 3, "bits"),
+    (npy_bytes(np.zeros(N_FEATURES - 1)), "npy"),
+    (npy_bytes(np.zeros((2, N_FEATURES))), "npy"),
+    (npy_bytes(np.full(N_FEATURES, np.nan)), "npy"),
+    (npy_bytes(np.array(["x"] * N_FEATURES)), "npy"),
+    (npy_bytes(np.zeros(N_FEATURES))[:-8], "npy"),
+    (json.dumps({"features": {"unknown": 1}}).encode(), "json"),
+])
+def test_invalid_samples_are_rejected(payload, file_format):
+    with pytest.raises(SchemaMismatch):
+        decode_sample(payload, file_format)
+
+
+@pytest.mark.parametrize("packed", [True, False])
+def test_frames_are_read_in_chunks(packed):
+    X = binary_rows(10, seed=1)
+    file = io.BytesIO(encode_frames(X, packed=packed))
+    assert count_samples(file, "frames") == 10
+    chunks = list(iter_sample_chunks(file, "frames", 4))
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    assert np.array_equal(np.concatenate(chunks), X)
+
+
+def test_npy_batch_is_read_in_chunks():
+    X = binary_rows(7, seed=2).astype(np.float64)
+    file = io.BytesIO(npy_bytes(X))
+    assert count_samples(file, "npy") == 7
+    assert np.array_equal(np.concatenate(list(iter_sample_chunks(file, "npy", 3))), X)
+
+
+def test_truncated_frames_are_rejected():
+    payload = encode_frames(binary_rows(3))
+    with pytest.raises(SchemaMismatch):
+        count_samples(io.BytesIO(payload[:-1]), "frames")
+    with pytest.raises(SchemaMismatch):
+        list(iter_sample_chunks(io.BytesIO(payload[:-1]), "frames", 2))
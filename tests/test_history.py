@@ -0,0 +1,58 @@
+import json
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from core import archive
+from models.models import Prediction, User
+
+
+def test_history_is_only_shown_to_its_owner(client, db, user):
+    other = User(username="other", password="-", balance=100.0)
+    db.add(other)
+    db.commit()
+    for path in (f"/users/{other.id}/predictions", f"/users/{other.id}/predictions/export"):
+        response = client.get(path)
+        assert response.status_code == 403 and response.json()["detail"] == "Доступ запрещен."
+    assert client.get(f"/users/{user.id}/predictions").status_code == 200
+    assert client.get(f"/users/{user.id}/predictions", headers={"Authorization": ""}).status_code == 401
+
+
+@pytest.fixture
+def archived_history(db, user, tmp_path, monkeypatch):
+    # Старые строки уходят в архив Parquet, новые остаются в таблице; у двух строк одинаковое время создания
+    monkeypatch.setattr(archive, "PREDICTIONS_DIRECTORY", str(tmp_path / "predictions"))
+    now = datetime.utcnow()
+    ages = [40, 40, 39, 38.5, 2, 1, 1, 0]
+    results = ["1", "0.25", "Ошибка", "0", "1", "0.5", "0", None]
+    for days, result in zip(ages, results):
+        db.add(Prediction(job_id=str(uuid.uuid4()), user_id=user.id, model_name="lr_model", cost=10.0, result=result,
+                          status=None if result is None else "finished", created_at=now - timedelta(days=days)))
+    db.commit()
+    rows = db.query(Prediction).all()
+    expected = [(row.id, row.result) for row in sorted(rows, key=lambda row: (row.created_at, row.id), reverse=True)]
+    assert archive.archive_older_than(db, now - timedelta(days=30)) == 4
+    assert db.query(Prediction).count() == 4
+    return expected
+
+
+def test_history_pages_merge_live_and_archived_rows(client, user, archived_history):
+    seen, params = [], {"limit": 3}
+    while True:
+        response = client.get(f"/users/{user.id}/predictions", params=params)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page) <= 3
+        seen.extend((row["id"], row["result"]) for row in page)
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["X-Next-Cursor"]
+    assert seen == archived_history
+
+    export = client.get(f"/users/{user.id}/predictions/export")
+    assert [(row["id"], row["result"]) for row in map(json.loads, export.text.splitlines())] == archived_history
+    # Курсор после последней строки таблицы продолжает выдачу из архива
+    cursor = client.get(f"/users/{user.id}/predictions", params={"limit": 4}).headers["X-Next-Cursor"]
+    page = client.get(f"/users/{user.id}/predictions", params={"limit": 10, "cursor": cursor}).json()
+    assert [(row["id"], row["result"]) for row in page] == archived_history[4:]
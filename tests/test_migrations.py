@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from core import billing
+from core.migrations import migrate
+from models.models import Base, LedgerEntry, Prediction, User
+from utils import results
+
+LEGACY_SCHEMA = (
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR NOT NULL UNIQUE, password VARCHAR NOT NULL, "
+    "balance FLOAT, last_login_at DATETIME, created_at DATETIME DEFAULT CURRENT_TIMESTAMP)",
+    "CREATE TABLE predictions (id INTEGER PRIMARY KEY, job_id VARCHAR UNIQUE, user_id INTEGER REFERENCES users(id), "
+    "result VARCHAR, cost FLOAT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP)",
+    "INSERT INTO users (id, username, password, balance) VALUES (1, 'user', '-', 80.0)",
+    "INSERT INTO predictions (job_id, user_id, result, cost) VALUES ('done', 1, '1', 10.0), ('queued', 1, NULL, 10.0)",
+)
+
+
+def test_legacy_rows_without_result_stay_pending_with_reserve(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/legacy.db")
+    with engine.begin() as connection:
+        for statement in LEGACY_SCHEMA:
+            connection.execute(text(statement))
+    Base.metadata.create_all(engine)
+    migrate(engine, Base.metadata)
+    migrate(engine, Base.metadata)
+
+    with engine.connect() as connection:
+        rows = connection.execute(text("SELECT job_id, task_id, status, result FROM predictions ORDER BY id")).all()
+        ledger = connection.execute(text("SELECT user_id, job_id, kind, amount, applied FROM ledger_entries")).all()
+    assert [tuple(row) for row in rows] == [("done", "done", "finished", "1"), ("queued", "queued", None, None)]
+    assert [tuple(row) for row in ledger] == [(1, "queued", billing.RESERVE, -10.0, 1)]
+    engine.dispose()
+
+
+class BackendResult:
+    def __init__(self, state, result=None):
+        self.state, self.result = state, result
+
+    def successful(self):
+        return self.state == "SUCCESS"
+
+    def failed(self):
+        return self.state == "FAILURE"
+
+
+@pytest.fixture
+def legacy_jobs(db, user, monkeypatch):
+    # Запросы до миграции: без модели, стоимость уже списана, после миграции записан резерв
+    now = datetime.utcnow()
+    ages = {"succeeded": 0, "crashed": 0, "queued": 0, "lost": 2 * results.app.conf.result_expires}
+    for job_id, age in ages.items():
+        db.add(Prediction(job_id=job_id, task_id=job_id, user_id=user.id, cost=10.0,
+                          created_at=now - timedelta(seconds=age)))
+        db.add(LedgerEntry(user_id=user.id, job_id=job_id, kind=billing.RESERVE, amount=-10.0, applied=True))
+    db.query(User).filter_by(id=user.id).update({User.balance: User.balance - 10.0 * len(ages)})
+    db.commit()
+    backend = {"succeeded": BackendResult("SUCCESS", 1.0), "crashed": BackendResult("FAILURE", ValueError("bad"))}
+    monkeypatch.setattr(results.app, "AsyncResult", lambda task_id: backend.get(task_id, BackendResult("PENDING")))
+    rescheduled = []
+    monkeypatch.setattr(results.resolve_legacy_predictions, "apply_async", lambda **options: rescheduled.append(options))
+    return rescheduled
+
+
+def test_legacy_jobs_are_resolved_from_backend(db, user, legacy_jobs):
+    assert results.resolve_legacy_predictions() == 3
+    db.expire_all()
+    statuses = {row.job_id: (row.status, row.result) for row in db.query(Prediction)}
+    assert statuses == {"succeeded": ("finished", "1.0"), "crashed": ("failed", "bad"),
+                        "queued": (None, None), "lost": ("failed", results.LEGACY_RESULT_LOST)}
+    # Задача, которая еще может быть в очереди, проверяется снова после истечения результатов в бэкенде
+    assert legacy_jobs == [{"countdown": results.app.conf.result_expires}]
+
+    billing.apply_pending(db)
+    db.expire_all()
+    assert db.get(User, user.id).balance == 80.0
+    assert results.resolve_legacy_predictions() == 0
@@ -0,0 +1,149 @@
+import io
+import json
+
+import numpy as np
+import pytest
+
+import main
+from core import billing
+from core.cache import prediction_cache
+from models.models import LedgerEntry, Prediction, User
+from utils.prediction import perform_async_prediction
+from utils.registry import model_registry
+from utils.results import task_item, write_task_results
+
+pytestmark = pytest.mark.skipif(prediction_cache is None, reason="кэш предсказаний выключен")
+
+
+class MemoryRedis:
+    """
+    Команды Redis, которые использует single-flight PredictionCache (claim/release и чтение результата).
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+@pytest.fixture
+def enqueued(monkeypatch):
+    calls = []
+    monkeypatch.setattr(perform_async_prediction, "apply_async",
+                        lambda args, kwargs, task_id: calls.append(task_id))
+    return calls
+
+
+@pytest.fixture
+def shared_redis(monkeypatch):
+    memory = MemoryRedis()
+    monkeypatch.setattr(prediction_cache, "redis", memory)
+    return memory
+
+
+def upload(client, vector) -> str:
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(vector, dtype=np.uint8))
+    response = client.post("/upload_file/", files={"file": ("sample.npy", buffer.getvalue())})
+    assert response.status_code == 200, response.text
+    return response.json()["file_id"]
+
+
+def sample(seed: int = 0) -> list:
+    return np.random.default_rng(seed).integers(0, 2, size=241).tolist()
+
+
+def cache_key(vector) -> str:
+    entry = model_registry.get("lr_model")
+    return prediction_cache.key(entry.name, entry.version, vector)
+
+
+def predict(client, file_id: str, endpoint: str = "/predict/"):
+    return client.post(endpoint, params={"file_id": file_id, "model_name": "lr_model"})
+
+
+def test_cache_hit_is_stored_and_returned_as_text(client, db, enqueued):
+    vector = sample()
+    file_id = upload(client, vector)
+    prediction_cache.local.put(cache_key(vector), 1.0)
+
+    response = predict(client, file_id).json()
+    assert response["status"] == "finished" and response["result"] == "1.0"
+    assert enqueued == []
+    # Ответ, запись в БД и эндпоинты статуса отдают одно и то же значение
+    assert client.get(f"/predictions/{response['job_id']}").json()["result"] == "1.0"
+    assert client.get(f"/get_prediction_status/{response['job_id']}").json() == {"status": "finished",
+                                                                               "result": "1.0"}
+    row = db.query(Prediction).filter_by(job_id=response["job_id"]).one()
+    assert (row.result, row.status, row.task_id) == ("1.0", "finished", None)
+    assert sorted(kind for kind, in db.query(LedgerEntry.kind)) == [billing.RESERVE, billing.SETTLE]
+
+
+def test_redis_cache_hit_is_text(client, db, enqueued, shared_redis):
+    vector = sample(1)
+    file_id = upload(client, vector)
+    shared_redis.set(cache_key(vector), json.dumps(0.0))
+    response = predict(client, file_id).json()
+    assert response["result"] == "0.0"
+    assert db.query(Prediction.result).filter_by(job_id=response["job_id"]).scalar() == "0.0"
+
+
+def test_inline_result_is_text(client, db, enqueued, monkeypatch):
+    async def inline(entry, features):
+        return np.float64(1.0)
+
+    monkeypatch.setattr(main.inline_predictor, "predict", inline)
+    response = predict(client, upload(client, sample(2)), "/predict_sync/").json()
+    assert response["result"] == "1.0"
+    assert db.query(Prediction.result).filter_by(job_id=response["job_id"]).scalar() == "1.0"
+    assert enqueued == []
+
+
+def test_identical_requests_share_one_task(client, db, enqueued, shared_redis):
+    file_id = upload(client, sample(3))
+    first = predict(client, file_id).json()
+    second = predict(client, file_id).json()
+    assert enqueued == [first["job_id"]]
+    assert {row.task_id for row in db.query(Prediction)} == {first["job_id"]}
+
+    write_task_results(db, [task_item(first["job_id"], np.float64(0.0))])
+    db.commit()
+    for job_id in (first["job_id"], second["job_id"]):
+        assert client.get(f"/get_prediction_status/{job_id}").json() == {"status": "finished", "result": "0.0"}
+    assert sorted(kind for kind, in db.query(LedgerEntry.kind)) == [billing.RESERVE] * 2 + [billing.SETTLE] * 2
+
+
+def test_failed_enqueue_finishes_joined_requests(client, db, user, shared_redis, monkeypatch):
+    file_id = upload(client, sample(4))
+
+    def unavailable(args, kwargs, task_id):
+        # Пока владелец ставил задачу, к ней присоединился другой запрос
+        db.add(Prediction(job_id="joined", task_id=task_id, user_id=user.id, model_name="lr_model", cost=10.0))
+        db.add(LedgerEntry(user_id=user.id, job_id="joined", kind=billing.RESERVE, amount=-10.0, applied=True))
+        db.query(User).filter_by(id=user.id).update({User.balance: User.balance - 10.0})
+        db.commit()
+        raise ConnectionError("broker is down")
+
+    monkeypatch.setattr(perform_async_prediction, "apply_async", unavailable)
+    response = predict(client, file_id)
+    assert response.status_code == 503
+
+    db.expire_all()
+    rows = db.query(Prediction).all()
+    assert len(rows) == 2
+    assert {(row.status, row.result) for row in rows} == {("failed", "Очередь задач недоступна.")}
+    assert shared_redis.data == {}
+    billing.apply_ledger()
+    db.expire_all()
+    assert db.get(User, user.id).balance == 100.0
@@ -0,0 +1,32 @@
+import time
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from core import profiling
+from core.config import PROFILING_HEADER
+
+
+def test_streaming_response_is_profiled_until_body_is_sent(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_DIRECTORY", str(tmp_path))
+    app = FastAPI()
+    app.middleware("http")(profiling.profile_request)
+
+    @app.get("/export")
+    async def export():
+        async def lines():
+            for line in range(3):
+                time.sleep(0.05)
+                yield f"{line}\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    with TestClient(app) as client:
+        response = client.get("/export", headers={PROFILING_HEADER: "1"})
+    assert response.text == "0\n1\n2\n"
+    [profile] = profiling.list_profiles()
+    assert profile["route"] == "/export" and profile["status"] == 200
+    # Время и снимки стека включают формирование тела, а не только заголовков
+    assert profile["duration_ms"] >= 150 and profile["samples"] > 0
+    with open(profiling.profile_path(profile["id"])) as folded:
+        assert "lines (" in folded.read()
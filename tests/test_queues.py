@@ -0,0 +1,124 @@
+import threading
+import time
+
+import pytest
+
+from core import metrics
+from core.config import METRICS_WORKER_PORT
+from core.queues import QueueAutoscaler, ScalableThreadPool, WORKER_QUEUES
+
+
+class Probe:
+    """
+    Задачи, которые ждут разрешения завершиться; считает, сколько их выполняется одновременно.
+    """
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+        self.running = 0
+
+    def task(self):
+        with self.lock:
+            self.running += 1
+        try:
+            self.release.wait(5)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+def wait_until(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.fixture
+def scaled_pool(monkeypatch):
+    # Как celery worker --autoscale 6,2: пул создается с минимумом, потом автомасштабирование
+    pool = ScalableThreadPool(2)
+    scaler = QueueAutoscaler(pool, 6, 2, keepalive=0.05)
+    depth = {"qty": 0}
+    monkeypatch.setattr(QueueAutoscaler, "qty", property(lambda self: depth["qty"]))
+    pool.start()
+    yield pool, scaler, depth
+    pool.stop()
+
+
+def test_autoscaler_grows_and_shrinks_thread_pool(scaled_pool):
+    pool, scaler, depth = scaled_pool
+    probe = Probe()
+    for _ in range(6):
+        pool.apply_async(probe.task)
+    assert wait_until(lambda: probe.running == 2)
+    time.sleep(0.1)
+    assert probe.running == 2 and scaler.processes == 2
+
+    depth["qty"] = 10
+    scaler.maybe_scale()
+    assert scaler.processes == 6
+    assert wait_until(lambda: probe.running == 6)
+
+    probe.release.set()
+    assert wait_until(lambda: probe.running == 0)
+    depth["qty"] = 0
+    time.sleep(0.1)
+    scaler.maybe_scale()
+    assert scaler.processes == 2
+
+    probe.release.clear()
+    for _ in range(6):
+        pool.apply_async(probe.task)
+    assert wait_until(lambda: probe.running == 2)
+    time.sleep(0.1)
+    assert probe.running == 2
+    probe.release.set()
+
+
+def test_shrink_waits_for_running_tasks(scaled_pool):
+    pool, scaler, depth = scaled_pool
+    depth["qty"] = 6
+    scaler.maybe_scale()
+    probe = Probe()
+    for _ in range(6):
+        pool.apply_async(probe.task)
+    assert wait_until(lambda: probe.running == 6)
+
+    depth["qty"] = 0
+    time.sleep(0.1)
+    scaler.maybe_scale()
+    # Выполняющиеся задачи не прерываются, новые ждут, пока активных станет меньше limit
+    assert scaler.processes == 2 and probe.running == 6
+    pool.apply_async(probe.task)
+    probe.release.set()
+    assert wait_until(lambda: probe.running == 0 and pool.active == 0)
+    assert pool.info["limit"] == 2 and pool.info["max-concurrency"] == 6
+
+
+def test_autoscaler_waits_for_prefork_pool_to_start():
+    # У prefork-пула grow появляется только при запуске; до этого масштабирование ничего не делает
+    class NotStartedPool:
+        num_processes = 1
+
+    scaler = QueueAutoscaler(NotStartedPool(), 4, 1, keepalive=0.05)
+    assert not scaler._maybe_scale()
+
+
+def test_queue_workers_serve_metrics_on_own_ports(monkeypatch):
+    bound = set()
+
+    def start_http_server(port, registry=None):
+        if port in bound:
+            raise OSError(98, "Address already in use")
+        bound.add(port)
+
+    monkeypatch.setattr(metrics, "start_http_server", start_http_server)
+    ports = [metrics.serve_worker_metrics([queue]) for queue in WORKER_QUEUES]
+    assert ports == [METRICS_WORKER_PORT + offset for offset in range(len(WORKER_QUEUES))]
+    # Второй worker той же очереди на этом хосте занимает следующий порт очереди
+    fast = next(iter(WORKER_QUEUES))
+    assert metrics.serve_worker_metrics([fast]) == METRICS_WORKER_PORT + len(WORKER_QUEUES)
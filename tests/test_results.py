@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+from core import billing
+from models.models import LedgerEntry, Prediction
+from utils.results import FAILED, FINISHED, ResultWriter, finish_joined_predictions
+
+
+def add_request(db, user, job_id: str, task_id: str, cost: float = 10.0):
+    # Как submit_prediction: строка запроса и резерв его стоимости
+    db.add(Prediction(job_id=job_id, task_id=task_id, user_id=user.id, model_name="lr_model", cost=cost))
+    db.add(LedgerEntry(user_id=user.id, job_id=job_id, kind=billing.RESERVE, amount=-cost, applied=True))
+    user.balance -= cost
+    db.commit()
+
+
+def task_result(task_id: str, status: str, result: str) -> dict:
+    return {"kind": "task", "task_id": task_id, "status": status, "result": result, "refund": 0.0}
+
+
+def entries(db, job_id: str) -> list:
+    return sorted(kind for kind, in db.query(LedgerEntry.kind).filter(LedgerEntry.job_id == job_id))
+
+
+def test_request_joined_after_result_is_finished_by_sweep(db, user):
+    writer = ResultWriter()
+    add_request(db, user, "owner", "owner")
+    writer._flush([task_result("owner", FINISHED, "1")])
+    # Запрос присоединился к задаче (claim), но записал строку уже после ее результата
+    add_request(db, user, "late", "owner")
+    db.expire_all()
+    assert db.get(Prediction, 2).status is None
+
+    assert finish_joined_predictions() == 1
+    db.expire_all()
+    late = db.query(Prediction).filter_by(job_id="late").one()
+    assert (late.status, late.result) == (FINISHED, "1")
+    assert entries(db, "late") == [billing.RESERVE, billing.SETTLE]
+
+    # Повторный проход и повторная запись того же результата ничего не меняют
+    assert finish_joined_predictions() == 0
+    writer._flush([task_result("owner", FINISHED, "1")])
+    assert entries(db, "owner") == [billing.RESERVE, billing.SETTLE]
+    assert entries(db, "late") == [billing.RESERVE, billing.SETTLE]
+
+
+def test_request_joined_after_failure_is_refunded_once(db, user):
+    writer = ResultWriter()
+    add_request(db, user, "owner", "owner")
+    writer._flush([task_result("owner", FAILED, "boom")])
+    add_request(db, user, "late", "owner")
+
+    assert finish_joined_predictions() == 1
+    assert finish_joined_predictions() == 0
+    db.expire_all()
+    assert db.query(Prediction.status).filter_by(job_id="late").scalar() == FAILED
+    assert entries(db, "late") == [billing.REFUND, billing.RESERVE]
+    billing.apply_ledger()
+    db.expire_all()
+    assert db.get(type(user), user.id).balance == 100.0
+
+
+def test_sweep_ignores_requests_outside_window(db, user):
+    writer = ResultWriter()
+    add_request(db, user, "owner", "owner")
+    writer._flush([task_result("owner", FINISHED, "0")])
+    db.add(Prediction(job_id="old", task_id="owner", user_id=user.id, cost=10.0,
+                      created_at=datetime.utcnow() - timedelta(days=2)))
+    db.commit()
+    assert finish_joined_predictions() == 0
@@ -0,0 +1,100 @@
+import io
+import json
+import os
+import uuid
+
+import numpy as np
+import pytest
+
+from core.config import MAX_UPLOAD_SIZE, UPLOAD_DIRECTORY
+from utils.features import get_feature_schema
+from utils.uploads import load_features
+
+
+def npy_upload(vector) -> dict:
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(vector, dtype=np.uint8))
+    return {"file": ("sample.npy", buffer.getvalue())}
+
+
+def test_upload_within_limit_is_stored(client):
+    vector = np.ones(len(get_feature_schema()), dtype=np.uint8)
+    response = client.post("/upload_file/", files=npy_upload(vector))
+    assert response.status_code == 200
+    assert np.array_equal(load_features(response.json()["file_id"]), vector)
+
+
+def test_upload_over_limit_is_rejected_by_content_length(client):
+    response = client.post("/upload_file/", files={"file": ("sample.json", b" " * (MAX_UPLOAD_SIZE + 64 * 1024))})
+    assert response.status_code == 413
+
+
+def test_chunked_upload_over_limit_is_rejected_early(client):
+    # Без Content-Length ответ 413 уходит, как только получено больше предела, а не после всего тела
+    import asyncio
+    import main
+    boundary = "limit"
+    chunks = [(f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"sample.json\"\r\n"
+               f"Content-Type: application/json\r\n\r\n").encode()]
+    chunks += [b" " * (64 * 1024)] * 64 + [f"\r\n--{boundary}--\r\n".encode()]
+    read, responded_after = [], []
+
+    async def receive():
+        # Как сервер: тело приходит порциями по сети, после ответа приложению приходит только http.disconnect
+        await asyncio.sleep(0.001)
+        if responded_after or len(read) == len(chunks):
+            return {"type": "http.disconnect"}
+        read.append(chunks[len(read)])
+        return {"type": "http.request", "body": read[-1], "more_body": len(read) < len(chunks)}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            assert message["status"] == 413
+            responded_after.append(sum(map(len, read)))
+
+    scope = {"type": "http", "method": "POST", "path": "/upload_file/", "raw_path": b"/upload_file/",
+             "query_string": b"", "root_path": "", "scheme": "http", "http_version": "1.1",
+             "server": ("test", 80), "client": ("test", 1),
+             "headers": [(b"content-type", f"multipart/form-data; boundary={boundary}".encode())]}
+    client.portal.call(main.app, scope, receive, send)
+    assert responded_after and responded_after[0] <= MAX_UPLOAD_SIZE + 128 * 1024
+
+
+def test_file_over_limit_is_rejected_after_read(client, monkeypatch):
+    # Запас на служебные части формы не позволяет загрузить файл больше MAX_UPLOAD_SIZE
+    response = client.post("/upload_file/", files={"file": ("sample.json", b" " * (MAX_UPLOAD_SIZE + 1))})
+    assert response.status_code == 413
+
+
+@pytest.fixture
+def legacy_upload():
+    # Файл, загруженный до перехода на хранилище образцов: исходный JSON под именем <uuid>
+    os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
+    file_id = str(uuid.uuid4())
+    path = os.path.join(UPLOAD_DIRECTORY, file_id)
+    names = get_feature_schema().names
+    with open(path, "w") as raw_file:
+        json.dump({"features": {name: position % 2 for position, name in enumerate(names)}}, raw_file)
+    yield file_id, path
+    for leftover in (path, f"{path}.npy"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+
+
+def test_legacy_raw_upload_is_converted(legacy_upload):
+    file_id, path = legacy_upload
+    expected = np.arange(len(get_feature_schema())) % 2
+    assert np.array_equal(load_features(file_id), expected)
+    assert os.path.exists(f"{path}.npy")
+    os.remove(path)
+    assert np.array_equal(load_features(file_id), expected)
+
+
+def test_missing_and_broken_legacy_uploads(legacy_upload):
+    file_id, path = legacy_upload
+    with pytest.raises(FileNotFoundError):
+        load_features(str(uuid.uuid4()))
+    with open(path, "w") as raw_file:
+        raw_file.write("not json")
+    with pytest.raises(ValueError):
+        load_features(file_id)
@@ -0,0 +1,160 @@
+"""
+Оценка каскадной модели на отложенной выборке: сравнение с каждой из ее ступеней по качеству,
+времени и стоимости.
+
+Тестовая выборка выбирается так же, как в training_model.pipeline (тот же seed и --test-fraction),
+поэтому модели, обученные конвейером, оцениваются на строках, которых они не видели при обучении.
+
+Для каскада выводятся доля образцов, переданных второй модели, метрики классификации, совпадение
+ответов со второй моделью, время предсказания и средняя списываемая стоимость образца. С --bands
+отчет повторяется для других полос неопределенности; --save записывает результат в <name>.json
+каскада (ключ "evaluation").
+
+Запуск из корня проекта:
+    python -m training_model.cascade_report TUANDROMD.csv --cascade cascade --bands 0.05-0.95,0.2-0.8
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score, roc_auc_score
+
+from core.config import MODEL_DIRECTORY
+from training_model.pipeline import CLASSES, Reservoir, iter_chunks, write_json
+from utils.cascade import CascadeModel
+from utils.features import get_feature_schema
+from utils.registry import ModelRegistry
+
+
+def held_out(args, features: list) -> tuple:
+    """
+    Тестовая часть CSV, как ее выделяет training_model.pipeline.
+    """
+    split_rng = np.random.default_rng(args.seed)
+    test = Reservoir(args.max_eval_rows, len(features), np.random.default_rng(args.seed + 1))
+    for X, y in iter_chunks(args.csv, features, args.target, args.chunk_rows, args.positive_label):
+        is_test = split_rng.random(len(y)) < args.test_fraction
+        test.add(X[is_test], y[is_test])
+    return test.data()
+
+
+def timed(function, *args) -> tuple:
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def classification(y: np.ndarray, predicted: np.ndarray, score: np.ndarray) -> dict:
+    predicted = np.asarray(predicted, dtype=np.float64)
+    return {
+        "accuracy": float(accuracy_score(y, predicted)),
+        "precision": float(precision_score(y, predicted, zero_division=0)),
+        "recall": float(recall_score(y, predicted, zero_division=0)),
+        "f1": float(f1_score(y, predicted, zero_division=0)),
+        "roc_auc": float(roc_auc_score(y, score)) if len(np.unique(y)) == 2 else None,
+    }
+
+
+def stage_report(model, X: np.ndarray, y: np.ndarray, cost: float) -> dict:
+    """
+    Метрики одной модели, вызываемой на всех образцах.
+    """
+    proba, seconds = timed(model.predict_proba, X)
+    predicted = CLASSES[np.argmax(proba, axis=1)]
+    return {**classification(y, predicted, proba[:, 1]), "seconds": seconds, "mean_cost": cost,
+            "predicted": predicted, "score": proba[:, 1]}
+
+
+def cascade_report(entry, low: float, high: float, X: np.ndarray, y: np.ndarray, second: dict) -> dict:
+    """
+    Метрики каскада с полосой [low, high].
+    :param entry:   Запись каскада из реестра
+    :param second:  Отчет stage_report второй модели (для сравнения ответов и времени)
+    """
+    model = CascadeModel(entry.first.predictor, entry.second.predictor, low, high)
+    (predicted, escalated), seconds = timed(model.run, X)
+    # Оценка для ROC AUC: вероятность той ступени, которая дала ответ
+    score = model.first.predict_proba(X)[:, 1]
+    score[escalated] = second["score"][escalated]
+    rate = float(escalated.mean()) if len(escalated) else 0.0
+    return {
+        "band": [low, high],
+        "escalation_rate": rate,
+        **classification(y, predicted, score),
+        "agreement_with_second": float(np.mean(np.asarray(predicted, dtype=np.float64) == second["predicted"])),
+        "seconds": seconds,
+        "second_calls_avoided": int(len(escalated) - escalated.sum()),
+        "time_saved": 1.0 - seconds / second["seconds"] if second["seconds"] else None,
+        "mean_cost": entry.first.cost + rate * entry.second.cost,
+    }
+
+
+def parse_bands(value: str) -> list:
+    bands = []
+    for item in filter(None, value.split(",")):
+        low, _, high = item.partition("-")
+        bands.append((float(low), float(high)))
+    return bands
+
+
+def print_row(label: str, report: dict):
+    roc_auc = f"{report['roc_auc']:.4f}" if report["roc_auc"] is not None else "-"
+    print(f"{label:<24} accuracy={report['accuracy']:.4f} recall={report['recall']:.4f} f1={report['f1']:.4f} "
+          f"roc_auc={roc_auc} time={report['seconds'] * 1000:.1f} ms cost={report['mean_cost']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv", help="CSV с заголовком: признаки и колонка метки")
+    parser.add_argument("--cascade", default="cascade", help="Название каскада в реестре")
+    parser.add_argument("--models", default=MODEL_DIRECTORY, help="Каталог моделей")
+    parser.add_argument("--bands", default="", help="Дополнительные полосы, например 0.05-0.95,0.2-0.8")
+    parser.add_argument("--target", default="Label")
+    parser.add_argument("--positive-label", default="malware", help="Метка положительного класса, если метки не числа")
+    parser.add_argument("--chunk-rows", type=int, default=50000)
+    parser.add_argument("--test-fraction", type=float, default=0.2)
+    parser.add_argument("--max-eval-rows", type=int, default=200000, help="Предел тестовой выборки")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save", action="store_true", help="Записать оценку текущей полосы в <cascade>.json")
+    args = parser.parse_args()
+
+    entry = ModelRegistry(args.models).get(args.cascade)
+    if entry is None or entry.fixed_cost:
+        parser.error(f"каскад {args.cascade} не найден в {args.models}")
+    X, y = held_out(args, get_feature_schema().names)
+    if not len(y):
+        parser.error("тестовая выборка пуста")
+    print(f"{args.cascade}: {entry.first.name} -> {entry.second.name}, {len(y)} test rows")
+
+    first = stage_report(entry.first.predictor, X, y, entry.first.cost)
+    second = stage_report(entry.second.predictor, X, y, entry.second.cost)
+    print_row(entry.first.name, first)
+    print_row(entry.second.name, second)
+    reports = [cascade_report(entry, low, high, X, y, second)
+               for low, high in [(entry.low, entry.high), *parse_bands(args.bands)]]
+    for report in reports:
+        print_row(f"cascade {report['band'][0]:g}-{report['band'][1]:g}", report)
+        print(f"{'':<24} escalated={report['escalation_rate']:.2%} "
+              f"agreement={report['agreement_with_second']:.2%} time saved={report['time_saved'] or 0:.1%}")
+
+    if args.save:
+        path = os.path.join(args.models, f"{args.cascade}.json")
+        with open(path, encoding="utf-8") as metadata_file:
+            metadata = json.load(metadata_file)
+        metadata["evaluation"] = {
+            **reports[0],
+            "rows": int(len(y)),
+            "evaluated_at": datetime.utcnow().isoformat(),
+            "first": {key: value for key, value in first.items() if key not in ("predicted", "score")},
+            "second": {key: value for key, value in second.items() if key not in ("predicted", "score")},
+            "versions": {entry.first.name: entry.first.version, entry.second.name: entry.second.version},
+        }
+        write_json(path, metadata)
+        print(f"saved: {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+"""
+Обучение моделей из командной строки: потоковое чтение CSV, параллельный подбор гиперпараметров
+и запись версионированных артефактов с метаданными в каталог моделей.
+
+CSV читается порциями по --chunk-rows строк с фиксированным типом признаков (uint8-флаги); строки
+с пропусками отбрасываются. Каждая строка случайно (с фиксированным seed) попадает в обучающую,
+валидационную или тестовую часть; валидационная и тестовая выборки ограничены --max-eval-rows
+(равномерная выборка из потока), поэтому память не зависит от размера файла.
+
+Модели:
+    lr  - логистическая регрессия (SGDClassifier, log_loss), обучается инкрементально (partial_fit)
+    nb  - BernoulliNB, обучается инкрементально
+    gb  - GradientBoostingClassifier, обучается на равномерной выборке из потока до --max-train-rows строк
+
+Кандидаты из сетки гиперпараметров обучаются параллельно: инкрементальные - на одних и тех же порциях
+в пуле потоков, gb - в отдельных процессах. Лучший кандидат выбирается по ROC AUC на валидационной
+выборке, итоговые метрики считаются на тестовой.
+
+Артефакт записывается как <name>.<version>.joblib, рядом - <name>.<version>.json с версией,
+гиперпараметрами, метриками и хэшем схемы признаков; реестр подхватывает новую версию без перезапуска.
+
+Запуск из корня проекта:
+    python -m training_model.pipeline TUANDROMD.csv --models lr,gb --jobs 4
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import time
+from datetime import datetime
+from typing import Iterator
+
+import joblib
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.ensemble import GradientBoostingClassifier
+from sklearn.linear_model import SGDClassifier
+from sklearn.metrics import (accuracy_score, confusion_matrix, f1_score, log_loss, precision_score, recall_score,
+                             roc_auc_score)
+from sklearn.naive_bayes import BernoulliNB
+
+from core.config import MODEL_DIRECTORY, FEATURE_SCHEMA_PATH
+
+CLASSES = np.array([0.0, 1.0])  # Метки классов, как у моделей, которые уже обслуживаются
+
+# Модели: оценщик, сетка гиперпараметров по умолчанию и способ обучения
+ESTIMATORS = {
+    "lr": (SGDClassifier(loss="log_loss", random_state=42), {"alpha": [1e-5, 1e-4, 1e-3]}, "incremental"),
+    "nb": (BernoulliNB(), {"alpha": [0.1, 0.5, 1.0]}, "incremental"),
+    "gb": (GradientBoostingClassifier(random_state=42), {"n_estimators": [100, 200], "max_depth": [3, 4]}, "sample"),
+}
+
+
+class Reservoir:
+    """
+    Равномерная выборка фиксированного размера из потока строк (алгоритм R, по порции за раз).
+    """
+
+    def __init__(self, capacity: int, n_features: int, rng: np.random.Generator):
+        self.X = np.empty((capacity, n_features), dtype=np.uint8)
+        self.y = np.empty(capacity, dtype=np.float64)
+        self.capacity = capacity
+        self.seen = 0
+        self.rng = rng
+
+    def add(self, X: np.ndarray, y: np.ndarray):
+        free = min(max(self.capacity - self.seen, 0), len(y))
+        self.X[self.seen:self.seen + free] = X[:free]
+        self.y[self.seen:self.seen + free] = y[:free]
+        if free < len(y):
+            # Строка с номером t заменяет случайную строку выборки с вероятностью capacity / (t + 1)
+            positions = np.arange(self.seen + free, self.seen + len(y))
+            slots = self.rng.integers(0, positions + 1)
+            replace = slots < self.capacity
+            self.X[slots[replace]] = X[free:][replace]
+            self.y[slots[replace]] = y[free:][replace]
+        self.seen += len(y)
+
+    def data(self) -> tuple:
+        size = min(self.seen, self.capacity)
+        return self.X[:size], self.y[:size]
+
+
+def read_header(path: str) -> list:
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def iter_chunks(path: str, features: list, target: str, chunk_rows: int, positive_label: str) -> Iterator[tuple]:
+    """
+    Порции CSV: признаки uint8 в порядке features и метки 0/1.
+    :param path:    Путь к CSV
+    :param features:    Названия признаков в порядке обучения
+    :param target:  Колонка с меткой
+    :param chunk_rows:  Строк в порции
+    :param positive_label:  Значение метки положительного класса, если метки не числовые
+    :return:    Итератор по парам (X (n, n_features) uint8, y (n,) float64)
+    """
+    dtype = {name: "UInt8" for name in features}
+    dtype[target] = str
+    reader = pd.read_csv(path, usecols=[*features, target], dtype=dtype, chunksize=chunk_rows)
+    for chunk in reader:
+        chunk = chunk.dropna()
+        if chunk.empty:
+            continue
+        labels = chunk[target]
+        numeric = pd.to_numeric(labels, errors="coerce")
+        y = (numeric if numeric.notna().all() else (labels == positive_label)).to_numpy(np.float64)
+        yield chunk[features].to_numpy(np.uint8), y
+
+
+def candidates(kind: str, grid: dict) -> list:
+    """
+    Оценщики для всех сочетаний значений сетки.
+    """
+    estimator, default_grid, _ = ESTIMATORS[kind]
+    grid = grid or default_grid
+    keys = sorted(grid)
+    return [clone(estimator).set_params(**dict(zip(keys, values)))
+            for values in itertools.product(*(grid[key] for key in keys))]
+
+
+def _fit_sample(estimator, X, y):
+    return estimator.fit(X, y)
+
+
+def evaluate(model, X: np.ndarray, y: np.ndarray) -> dict:
+    """
+    Метрики бинарной классификации на выборке.
+    """
+    proba = model.predict_proba(X)[:, 1]
+    predicted = CLASSES[(proba >= 0.5).astype(np.intp)]
+    both_classes = len(np.unique(y)) == 2
+    return {
+        "rows": int(len(y)),
+        "accuracy": float(accuracy_score(y, predicted)),
+        "precision": float(precision_score(y, predicted, zero_division=0)),
+        "recall": float(recall_score(y, predicted, zero_division=0)),
+        "f1": float(f1_score(y, predicted, zero_division=0)),
+        "roc_auc": float(roc_auc_score(y, proba)) if both_classes else None,
+        "log_loss": float(log_loss(y, proba, labels=CLASSES)),
+        "confusion_matrix": confusion_matrix(y, predicted, labels=CLASSES).tolist(),
+    }
+
+
+def schema_hash(features: list) -> str:
+    return hashlib.sha256(json.dumps(features).encode()).hexdigest()[:12]
+
+
+def write_json(path: str, data: dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+
+def write_schema(path: str, features: list, target: str, dataset: str, replace: bool):
+    """
+    Сохраняет схему признаков. Схема общая для всех обслуживаемых моделей, поэтому другая схема
+    записывается только с --replace-schema.
+    """
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as schema_file:
+            current = json.load(schema_file)["features"]
+        if current == features:
+            return
+        if not replace:
+            raise SystemExit(f"Признаки CSV не совпадают со схемой {path}; используйте --replace-schema, "
+                             f"если обслуживаемые модели будут переобучены на новой схеме.")
+    write_json(path, {"dataset": dataset, "target": target, "features": features})
+
+
+def write_artifact(directory: str, name: str, version: str, model, metadata: dict) -> str:
+    """
+    Записывает модель и ее метаданные. Метаданные появляются раньше модели, а модель - под временным
+    именем с переименованием, поэтому реестр не увидит недописанный артефакт.
+    :return:    Путь к артефакту
+    """
+    stem = os.path.join(directory, f"{name}.{version}")
+    write_json(f"{stem}.json", metadata)
+    tmp_path = f"{stem}.joblib.tmp"
+    joblib.dump(model, tmp_path)
+    os.replace(tmp_path, f"{stem}.joblib")
+    return f"{stem}.joblib"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv", help="CSV с заголовком: признаки и колонка метки")
+    parser.add_argument("--models", default="lr,gb", help="Модели через запятую: " + ", ".join(ESTIMATORS))
+    parser.add_argument("--target", default="Label")
+    parser.add_argument("--positive-label", default="malware", help="Метка положительного класса, если метки не числа")
+    parser.add_argument("--dataset", default="TUANDROMD")
+    parser.add_argument("--output", default=MODEL_DIRECTORY, help="Каталог артефактов")
+    parser.add_argument("--schema", default=FEATURE_SCHEMA_PATH, help="Файл схемы признаков")
+    parser.add_argument("--replace-schema", action="store_true")
+    parser.add_argument("--chunk-rows", type=int, default=50000)
+    parser.add_argument("--epochs", type=int, default=1, help="Проходов по файлу для инкрементальных моделей")
+    parser.add_argument("--test-fraction", type=float, default=0.2)
+    parser.add_argument("--validation-fraction", type=float, default=0.1)
+    parser.add_argument("--max-eval-rows", type=int, default=200000, help="Предел валидационной и тестовой выборок")
+    parser.add_argument("--max-train-rows", type=int, default=500000, help="Предел обучающей выборки для gb")
+    parser.add_argument("--grid", action="append", default=[], metavar="MODEL=JSON",
+                        help='Сетка гиперпараметров, например lr=\'{"alpha": [1e-4, 1e-3]}\'')
+    parser.add_argument("--jobs", type=int, default=-1, help="Параллельных кандидатов (-1 - все ядра)")
+    parser.add_argument("--cost", type=float, default=10, help="Стоимость новой модели, если у нее еще нет <name>.json")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    kinds = [kind for kind in args.models.split(",") if kind]
+    unknown = set(kinds) - set(ESTIMATORS)
+    if unknown:
+        parser.error(f"неизвестные модели: {', '.join(sorted(unknown))}")
+    grids = {}
+    for item in args.grid:
+        kind, _, grid = item.partition("=")
+        grids[kind] = json.loads(grid)
+
+    features = [name for name in read_header(args.csv) if name != args.target]
+    write_schema(args.schema, features, args.target, args.dataset, args.replace_schema)
+
+    incremental = {kind: candidates(kind, grids.get(kind)) for kind in kinds if ESTIMATORS[kind][2] == "incremental"}
+    sampled = [kind for kind in kinds if ESTIMATORS[kind][2] == "sample"]
+    started = time.perf_counter()
+    rows = 0
+    train_sample = None
+    with Parallel(n_jobs=args.jobs, prefer="threads") as parallel:
+        for epoch in range(args.epochs if incremental else 1):
+            # Разбиение на части повторяется в каждой эпохе: тот же seed, тот же порядок строк
+            split_rng = np.random.default_rng(args.seed)
+            sample_rng = np.random.default_rng(args.seed + 1)
+            shuffle_rng = np.random.default_rng(args.seed + 2 + epoch)
+            first_pass = epoch == 0
+            if first_pass:
+                validation = Reservoir(args.max_eval_rows, len(features), sample_rng)
+                test = Reservoir(args.max_eval_rows, len(features), sample_rng)
+                if sampled:
+                    train_sample = Reservoir(args.max_train_rows, len(features), sample_rng)
+            for X, y in iter_chunks(args.csv, features, args.target, args.chunk_rows, args.positive_label):
+                part = split_rng.random(len(y))
+                is_test = part < args.test_fraction
+                is_validation = ~is_test & (part < args.test_fraction + args.validation_fraction)
+                is_train = ~(is_test | is_validation)
+                if first_pass:
+                    rows += len(y)
+                    test.add(X[is_test], y[is_test])
+                    validation.add(X[is_validation], y[is_validation])
+                    if train_sample is not None:
+                        train_sample.add(X[is_train], y[is_train])
+                if incremental:
+                    order = shuffle_rng.permutation(np.flatnonzero(is_train))
+                    X_train, y_train = X[order], y[order]
+                    parallel(delayed(estimator.partial_fit)(X_train, y_train, classes=CLASSES)
+                             for estimators in incremental.values() for estimator in estimators)
+            print(f"epoch {epoch + 1}: {rows} rows, {time.perf_counter() - started:.1f} s")
+
+    results = {}
+    X_validation, y_validation = validation.data()
+    for kind, estimators in incremental.items():
+        results[kind] = estimators
+    if sampled:
+        X_sample, y_sample = train_sample.data()
+        for kind in sampled:
+            # Кандидаты обучаются в отдельных процессах; выборка передается им через общий memmap
+            results[kind] = Parallel(n_jobs=args.jobs)(
+                delayed(_fit_sample)(estimator, X_sample, y_sample) for estimator in candidates(kind, grids.get(kind)))
+
+    X_test, y_test = test.data()
+    version = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    for kind, estimators in results.items():
+        search = [{"params": {key: estimator.get_params()[key] for key in (grids.get(kind) or ESTIMATORS[kind][1])},
+                   "validation": evaluate(estimator, X_validation, y_validation)} for estimator in estimators]
+        best = max(range(len(estimators)), key=lambda i: search[i]["validation"]["roc_auc"] or 0.0)
+        model = estimators[best]
+        name = f"{kind}_model"
+        common_metadata = os.path.join(args.output, f"{name}.json")
+        if not os.path.exists(common_metadata):
+            write_json(common_metadata, {"cost": args.cost})
+        metadata = {
+            "version": version,
+            "estimator": type(model).__name__,
+            "params": search[best]["params"],
+            "trained_at": datetime.utcnow().isoformat(),
+            "dataset": {"path": os.path.basename(args.csv), "rows": rows,
+                        "train_rows": int(len(train_sample.data()[1])) if kind in sampled else None},
+            "feature_schema": schema_hash(features),
+            "metrics": evaluate(model, X_test, y_test),
+            "search": search,
+        }
+        path = write_artifact(args.output, name, version, model, metadata)
+        print(f"{name}: {path}  test roc_auc={metadata['metrics']['roc_auc']}  accuracy={metadata['metrics']['accuracy']:.4f}")
+
+
+if __name__ == '__main__':
+    main()
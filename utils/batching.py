@@ -0,0 +1,168 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+from celery.worker.control import inspect_command
+
+from core import metrics
+from core.config import PREDICTION_BATCH_MAX_SIZE, PREDICTION_BATCH_MAX_WAIT_MS
+
+# Сколько последних батчей учитывается при расчете перцентилей
+STATS_WINDOW = 1024
+
+
+class BatchStats:
+    """
+    Статистика по батчам одной модели: размеры батчей и время ожидания задач в очереди батчера.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.max_size = 0
+        self._sizes = deque(maxlen=STATS_WINDOW)
+        self._waits_ms = deque(maxlen=STATS_WINDOW)
+
+    def record(self, size: int, waits_ms: list):
+        with self._lock:
+            self.batches += 1
+            self.items += size
+            self.max_size = max(self.max_size, size)
+            self._sizes.append(size)
+            self._waits_ms.extend(waits_ms)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            sizes = np.asarray(self._sizes, dtype=float)
+            waits = np.asarray(self._waits_ms, dtype=float)
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_size,
+                "p50_batch_size": float(np.percentile(sizes, 50)) if sizes.size else 0.0,
+                "avg_wait_ms": float(waits.mean()) if waits.size else 0.0,
+                "p95_wait_ms": float(np.percentile(waits, 95)) if waits.size else 0.0,
+                "max_wait_ms": float(waits.max()) if waits.size else 0.0,
+            }
+
+
+class MicroBatcher:
+    """
+    Собирает одиночные запросы на предсказание для одной модели в батчи и выполняет
+    их одним векторизованным вызовом.
+
+    Батч отправляется, когда набрано max_batch_size строк или с момента прихода первой
+    строки прошло max_wait_ms миллисекунд.
+    """
+
+    def __init__(self, predict_batch, max_batch_size: int = PREDICTION_BATCH_MAX_SIZE,
+                 max_wait_ms: float = PREDICTION_BATCH_MAX_WAIT_MS):
+        """
+        :param predict_batch:   Функция (model_name, X) -> массив результатов, X - двумерный массив признаков
+        :param max_batch_size:  Максимальный размер батча
+        :param max_wait_ms:     Максимальное время ожидания заполнения батча, мс
+        """
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queues = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def submit(self, model_name: str, features) -> Future:
+        """
+        Ставит строку признаков в очередь модели.
+        :param model_name:  Название модели
+        :param features:    Признаки одного образца
+        :return:    Future с результатом предсказания для этой строки
+        """
+        future = Future()
+        self._queue_for(model_name).put((features, time.perf_counter(), future))
+        return future
+
+    def stats(self) -> dict:
+        """
+        Статистика по всем моделям, для которых запускался батчер.
+        """
+        return {model_name: stats.snapshot() for model_name, stats in list(self._stats.items())}
+
+    def _queue_for(self, model_name: str) -> queue.Queue:
+        model_queue = self._queues.get(model_name)
+        if model_queue is not None:
+            return model_queue
+        with self._lock:
+            if model_name not in self._queues:
+                self._stats[model_name] = BatchStats()
+                self._queues[model_name] = queue.Queue()
+                thread = threading.Thread(target=self._run, args=(model_name,),
+                                          name=f"batcher-{model_name}", daemon=True)
+                thread.start()
+            return self._queues[model_name]
+
+    def _collect(self, model_queue: queue.Queue) -> list:
+        # Блокируемся до первой строки, затем добираем батч до лимита или дедлайна
+        batch = [model_queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(model_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, model_name: str):
+        model_queue = self._queues[model_name]
+        stats = self._stats[model_name]
+        while True:
+            batch = self._collect(model_queue)
+            started = time.perf_counter()
+            futures = [future for _, _, future in batch]
+            try:
+                X = np.asarray([features for features, _, _ in batch])
+                results = self.predict_batch(model_name, X)
+            except Exception as exc:
+                for future in futures:
+                    future.set_exception(exc)
+                continue
+            finally:
+                waits_ms = [(started - enqueued) * 1000.0 for _, enqueued, _ in batch]
+                stats.record(len(batch), waits_ms)
+                metrics.observe_batch(model_name, "batcher", len(batch))
+                for wait_ms in waits_ms:
+                    metrics.observe_stage("batch_wait", model_name, wait_ms / 1000.0)
+            # Раздаем результаты обратно задачам в исходном порядке
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher(predict_batch) -> MicroBatcher:
+    """
+    Возвращает батчер текущего процесса worker'а, создавая его при первом обращении.
+    :param predict_batch:   Функция векторизованного предсказания
+    """
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = MicroBatcher(predict_batch)
+    return _batcher
+
+
+@inspect_command()
+def batching_stats(state):
+    """
+    Статистика батчера: celery -A core.worker inspect batching_stats
+    """
+    return _batcher.stats() if _batcher is not None else {}
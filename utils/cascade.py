@@ -0,0 +1,98 @@
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+# Результат каскада для одного образца: предсказание и то, понадобилась ли вторая модель
+CascadeResult = namedtuple("CascadeResult", ["prediction", "escalated"])
+
+
+class CascadeModel:
+    """
+    Каскад из двух моделей: первая (дешевая) отвечает сама, если ее вероятность положительного класса
+    вне полосы неопределенности [low, high]; образцы внутри полосы передаются второй модели.
+    """
+
+    def __init__(self, first, second, low: float, high: float):
+        """
+        :param first:   Первая модель, нужен predict_proba
+        :param second:  Вторая модель
+        :param low: Нижняя граница полосы неопределенности
+        :param high:    Верхняя граница полосы неопределенности
+        """
+        self.first = first
+        self.second = second
+        self.low = low
+        self.high = high
+
+    def run(self, X) -> tuple:
+        """
+        :param X:   Двумерный массив признаков (n_samples, n_features)
+        :return:    Пара (предсказания, маска образцов, переданных второй модели)
+        """
+        X = np.asarray(X)
+        proba = self.first.predict_proba(X)
+        predictions = self.first.classes_.take(np.argmax(proba, axis=1), axis=0)
+        positive = proba[:, 1]
+        escalated = (positive >= self.low) & (positive <= self.high)
+        if escalated.any():
+            # Вторая модель видит только неуверенные образцы одним батчем
+            predictions[escalated] = self.second.predict(X[escalated])
+        return predictions, escalated
+
+    def predict(self, X) -> np.ndarray:
+        return self.run(X)[0]
+
+
+class CascadeEntry:
+    """
+    Каскад в реестре моделей. Описывается файлом <name>.json в каталоге моделей:
+        {"cascade": {"first": "lr_model", "second": "gb_model", "band": [0.2, 0.8]}, "queue": "..."}
+
+    Стоимость задачи заранее неизвестна: резервируется сумма стоимостей обеих моделей (cost),
+    а если вторая модель не понадобилась, ее стоимость возвращается (refund).
+    """
+
+    # Стоимость зависит от того, что выполнялось: результат нельзя выдать из кэша или без очереди
+    fixed_cost = False
+
+    def __init__(self, name: str, metadata: dict, first, second):
+        """
+        :param name:    Название каскада
+        :param metadata:    Метаданные из <name>.json
+        :param first:   Запись первой модели из реестра
+        :param second:  Запись второй модели из реестра
+        """
+        low, high = metadata["cascade"]["band"]
+        self.name = name
+        self.metadata = metadata
+        self.first = first
+        self.second = second
+        self.low = float(low)
+        self.high = float(high)
+        # Результат зависит от версий обеих моделей и от полосы (версия входит в ключ кэша)
+        self.version = f"{first.version}+{second.version}@{self.low:g}-{self.high:g}"
+        self.cost = first.cost + second.cost
+        self.path = None
+        self._predictor = None
+        self._lock = threading.Lock()
+
+    @property
+    def predictor(self) -> CascadeModel:
+        if self._predictor is None:
+            first, second = self.first.predictor, self.second.predictor
+            with self._lock:
+                if self._predictor is None:
+                    self._predictor = CascadeModel(first, second, self.low, self.high)
+        return self._predictor
+
+    def refund(self, escalated) -> float:
+        """
+        Сумма к возврату из зарезервированной стоимости.
+        :param escalated:   Маска (или список флагов) образцов, переданных второй модели
+        """
+        return float(np.size(escalated) - np.count_nonzero(escalated)) * self.second.cost
+
+    def describe(self) -> dict:
+        return {"name": self.name, "version": self.version, "cost": self.cost, "min_cost": self.first.cost,
+                "cascade": {"first": self.first.name, "second": self.second.name, "band": [self.low, self.high]}}
@@ -0,0 +1,290 @@
+import logging
+import threading
+import weakref
+
+import numpy as np
+from scipy import sparse
+from scipy.special import expit
+from sklearn.ensemble import GradientBoostingClassifier
+
+logger = logging.getLogger(__name__)
+
+# Количество случайных образцов для проверки совпадения с sklearn при компиляции
+PROBE_SAMPLES = 256
+# Наибольшее число признаков в одном дереве, для которого строится таблица листьев:
+# таблица занимает 2 ** k строк на дерево, поэтому для более глубоких деревьев используется обход
+MAX_TREE_FEATURES = 12
+
+
+class CompiledGradientBoosting:
+    """
+    Ансамбль GradientBoostingClassifier, развернутый в непрерывные массивы NumPy.
+
+    Все деревья хранятся в общих массивах узлов (признак, порог, потомки, значения),
+    индексы потомков глобальные. Листья замкнуты сами на себя, поэтому батч проходит все
+    деревья одновременно за max_depth векторизованных шагов.
+
+    Для бинарных входов (признаки TUANDROMD - флаги 0/1) дополнительно строится таблица листьев:
+    каждое дерево зависит от нескольких признаков, их биты складываются в код листа одним
+    матричным умножением, а лист берется из таблицы без обхода. Если какое-то дерево зависит больше чем
+    от MAX_TREE_FEATURES признаков, таблица не строится и листья всегда находятся обходом.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, node_value, roots, max_depth,
+                 learning_rate, init_raw, classes, n_features, used_features, code_weights, leaf_table,
+                 node_weight=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value  # Значения узлов, уже умноженные на learning_rate
+        self.node_value = node_value  # Исходные значения всех узлов (для атрибуции по путям)
+        self.roots = roots
+        self.max_depth = max_depth
+        self.learning_rate = learning_rate
+        self.init_raw = init_raw
+        self.classes_ = classes
+        self.n_features = n_features
+        self.used_features = used_features  # Признаки, которые встречаются хотя бы в одном дереве
+        self.code_weights = code_weights  # (len(used_features), n_trees): вес бита признака в коде листа или None
+        self.leaf_table = leaf_table  # (n_trees, 2 ** max_features_per_tree): глобальный индекс листа по коду или None
+        self.node_weight = node_weight  # Взвешенное количество обучающих образцов в узлах
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    def apply(self, X) -> np.ndarray:
+        """
+        Индексы листьев для каждого образца в каждом дереве.
+        :param X:   Двумерный массив признаков (n_samples, n_features)
+        :return:    Массив глобальных индексов узлов (n_trees, n_samples)
+        """
+        X = np.asarray(X)
+        if self.leaf_table is None:
+            return self._walk(X)
+        used = X[:, self.used_features]
+        if ((used == 0) | (used == 1)).all():
+            codes = (self.code_weights.T @ used.T.astype(np.float32)).astype(np.intp)
+            codes += (np.arange(self.n_trees, dtype=np.intp) * self.leaf_table.shape[1])[:, None]
+            return self.leaf_table.ravel()[codes]
+        return self._walk(X)
+
+    def _walk(self, X) -> np.ndarray:
+        # sklearn сравнивает признаки, приведенные к float32, с порогами float64
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_samples = X.shape[0]
+        flat = X.ravel()
+        row_offsets = (np.arange(n_samples, dtype=np.intp) * X.shape[1])[None, :]
+        nodes = np.repeat(self.roots[:, None], n_samples, axis=1)
+        for _ in range(self.max_depth):
+            go_left = flat[row_offsets + self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return nodes
+
+    def decision_function(self, X) -> np.ndarray:
+        """
+        Сырые предсказания ансамбля (логиты).
+        """
+        leaf_values = self.value[self.apply(X)]
+        # Складываем по деревьям последовательно, в том же порядке, что и sklearn,
+        # чтобы результат совпадал побитово
+        if leaf_values.shape[1] < self.n_trees:
+            return _sequential_sum(self.init_raw, leaf_values)
+        raw = np.full(leaf_values.shape[1], self.init_raw, dtype=np.float64)
+        for tree_values in leaf_values:
+            raw += tree_values
+        return raw
+
+    def predict_proba(self, X) -> np.ndarray:
+        raw = self.decision_function(X)
+        proba = np.empty((raw.shape[0], 2), dtype=np.float64)
+        proba[:, 1] = expit(raw)
+        proba[:, 0] = 1 - proba[:, 1]
+        return proba
+
+    def predict(self, X) -> np.ndarray:
+        proba = self.predict_proba(X)
+        return self.classes_.take(np.argmax(proba, axis=1), axis=0)
+
+    def path_contributions(self, X) -> tuple:
+        """
+        Вклады признаков в логит по путям образцов в деревьях (атрибуция Саабаса).
+
+        На каждом шаге пути ожидаемое значение поддерева меняется на разность значений потомка и родителя;
+        эта разность приписывается признаку, по которому разделяется родитель. Вклады пути зависят только
+        от листа, поэтому они считаются один раз для всех листьев, а атрибуция батча - это сумма строк
+        таблицы листьев: разреженное умножение матрицы попаданий в листья на эту таблицу.
+        :param X:   Двумерный массив признаков (n_samples, n_features)
+        :return:    Пара (вклады (n_samples, n_features), базовое значение логита);
+                    сумма вкладов образца и базового значения равна decision_function
+        """
+        leaf_contributions, base_value = _path_table(self)
+        leaves = self.apply(X)
+        n_samples = leaves.shape[1]
+        hits = sparse.csr_matrix(
+            (np.ones(leaves.size), (np.tile(np.arange(n_samples), self.n_trees), leaves.ravel())),
+            shape=(n_samples, leaf_contributions.shape[0]))
+        return (hits @ leaf_contributions).toarray(), base_value
+
+
+# Таблицы вкладов листьев строятся один раз на загруженную модель и освобождаются вместе с ней
+_path_tables = weakref.WeakKeyDictionary()
+_path_lock = threading.Lock()
+
+
+def _path_table(model: CompiledGradientBoosting) -> tuple:
+    table = _path_tables.get(model)
+    if table is None:
+        with _path_lock:
+            table = _path_tables.get(model)
+            if table is None:
+                table = _path_tables[model] = _build_path_table(model)
+    return table
+
+
+def _build_path_table(model: CompiledGradientBoosting) -> tuple:
+    n_nodes = len(model.feature)
+    own = np.arange(n_nodes, dtype=np.intp)
+    internal = np.flatnonzero(model.left != own)
+    parent = np.full(n_nodes, -1, dtype=np.intp)
+    parent[model.left[internal]] = internal
+    parent[model.right[internal]] = internal
+
+    # Ожидаемое значение внутреннего узла - среднее листьев поддерева, взвешенное по обучающим образцам.
+    # Потомки в деревьях sklearn нумеруются после родителя, поэтому узлы обходятся от конца к началу.
+    expected = np.array(model.node_value, dtype=np.float64)
+    weight = getattr(model, "node_weight", None)
+    if weight is not None:
+        for node in internal[::-1]:
+            left, right = model.left[node], model.right[node]
+            expected[node] = ((weight[left] * expected[left] + weight[right] * expected[right])
+                              / (weight[left] + weight[right]))
+
+    rows, columns, deltas = [], [], []
+    for leaf in np.flatnonzero(model.left == own):
+        node = leaf
+        while parent[node] != -1:
+            rows.append(leaf)
+            columns.append(model.feature[parent[node]])
+            deltas.append(model.learning_rate * (expected[node] - expected[parent[node]]))
+            node = parent[node]
+    leaf_contributions = sparse.csr_matrix((deltas, (rows, columns)), shape=(n_nodes, model.n_features))
+    base_value = model.init_raw + model.learning_rate * float(expected[model.roots].sum())
+    return leaf_contributions, base_value
+
+
+def _sequential_sum(init: float, leaf_values: np.ndarray) -> np.ndarray:
+    # cumsum накапливает строго последовательно; для маленьких батчей это быстрее цикла по деревьям
+    stacked = np.empty((leaf_values.shape[0] + 1, leaf_values.shape[1]), dtype=np.float64)
+    stacked[0] = init
+    stacked[1:] = leaf_values
+    return np.cumsum(stacked, axis=0)[-1]
+
+
+def _leaf_table(tree, offset: int, used_index: dict, code_weights: np.ndarray, tree_index: int, table_size: int):
+    # Перебираем все комбинации битов признаков дерева и запоминаем, в какой лист попадает каждая
+    features = sorted(set(tree.feature[tree.children_left != -1].tolist()))
+    for bit, feature in enumerate(features):
+        code_weights[used_index[feature], tree_index] = 1 << bit
+    table = np.zeros(table_size, dtype=np.intp)
+    for code in range(1 << len(features)):
+        bits = {feature: (code >> bit) & 1 for bit, feature in enumerate(features)}
+        node = 0
+        while tree.children_left[node] != -1:
+            if np.float32(bits[tree.feature[node]]) <= tree.threshold[node]:
+                node = tree.children_left[node]
+            else:
+                node = tree.children_right[node]
+        table[code] = offset + node
+    return table
+
+
+def compile_gradient_boosting(model: GradientBoostingClassifier) -> CompiledGradientBoosting:
+    """
+    Компилирует бинарный GradientBoostingClassifier в массивы.
+    :param model:   Обученная модель sklearn
+    :return:    Скомпилированная модель с интерфейсом predict/predict_proba
+    """
+    if model.estimators_.shape[1] != 1:
+        raise ValueError("Поддерживается только бинарная классификация.")
+
+    trees = [estimator.tree_ for estimator in model.estimators_[:, 0]]
+    sizes = np.array([tree.node_count for tree in trees])
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    n_nodes = int(sizes.sum())
+    own = np.arange(n_nodes, dtype=np.intp)
+
+    feature = np.concatenate([tree.feature for tree in trees]).astype(np.intp)
+    threshold = np.concatenate([tree.threshold for tree in trees]).astype(np.float64)
+    left = np.concatenate([tree.children_left + offset for tree, offset in zip(trees, offsets)]).astype(np.intp)
+    right = np.concatenate([tree.children_right + offset for tree, offset in zip(trees, offsets)]).astype(np.intp)
+    node_value = np.concatenate([tree.value[:, 0, 0] for tree in trees]).astype(np.float64)
+    node_weight = np.concatenate([tree.weighted_n_node_samples for tree in trees]).astype(np.float64)
+
+    is_leaf = np.concatenate([tree.children_left == -1 for tree in trees])
+    feature[is_leaf] = 0
+    threshold[is_leaf] = np.inf
+    left[is_leaf] = own[is_leaf]
+    right[is_leaf] = own[is_leaf]
+
+    used_features = np.unique(feature[~is_leaf])
+    used_index = {int(f): i for i, f in enumerate(used_features)}
+    max_tree_features = max(len(set(tree.feature[tree.children_left != -1].tolist())) for tree in trees)
+    code_weights, leaf_table = None, None
+    if max_tree_features <= MAX_TREE_FEATURES:
+        code_weights = np.zeros((len(used_features), len(trees)), dtype=np.float32)
+        leaf_table = np.stack([
+            _leaf_table(tree, offset, used_index, code_weights, i, 1 << max_tree_features)
+            for i, (tree, offset) in enumerate(zip(trees, offsets))
+        ])
+
+    n_features = model.n_features_in_
+    init_raw = float(model._raw_predict_init(np.zeros((1, n_features), dtype=np.float32))[0, 0])
+    return CompiledGradientBoosting(
+        feature=feature,
+        threshold=threshold,
+        left=left,
+        right=right,
+        value=model.learning_rate * node_value,
+        node_value=node_value,
+        roots=offsets.astype(np.intp),
+        max_depth=max(tree.max_depth for tree in trees),
+        learning_rate=model.learning_rate,
+        init_raw=init_raw,
+        classes=model.classes_,
+        n_features=n_features,
+        used_features=used_features,
+        code_weights=code_weights,
+        leaf_table=leaf_table,
+        node_weight=node_weight,
+    )
+
+
+def verify_equivalence(model, compiled, X) -> bool:
+    """
+    Проверяет, что скомпилированная модель дает те же результаты, что и sklearn.
+    """
+    return (np.array_equal(model.predict(X), compiled.predict(X))
+            and np.array_equal(model.predict_proba(X), compiled.predict_proba(X)))
+
+
+def compile_model(model):
+    """
+    Компилирует модель, если это поддерживается, и проверяет совпадение с исходной на
+    случайных бинарных образцах.
+    :param model:   Модель sklearn
+    :return:    Скомпилированная модель или None, если модель не поддерживается
+    """
+    if not isinstance(model, GradientBoostingClassifier):
+        return None
+    try:
+        compiled = compile_gradient_boosting(model)
+    except (ValueError, MemoryError) as exc:
+        logger.info("Model compilation skipped: %r", exc)
+        return None
+    probe = np.random.default_rng(0).integers(0, 2, size=(PROBE_SAMPLES, compiled.n_features))
+    if not verify_equivalence(model, compiled, probe):
+        logger.warning("Model compilation skipped: compiled predictions differ from sklearn")
+        return None
+    return compiled
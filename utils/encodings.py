@@ -0,0 +1,187 @@
+import io
+import struct
+from typing import IO, Iterator
+
+import numpy as np
+
+from utils.features import SchemaMismatch
+
+# Компактные форматы входа рядом с JSON. Все декодеры возвращают представления NumPy поверх
+# полученного буфера (np.frombuffer), без разбора текста и без промежуточных объектов Python.
+#
+# bits   - один образец: признаки в порядке схемы, упакованные по 8 в байт (np.packbits,
+#          первый признак - старший бит первого байта), ceil(n_features / 8) байт.
+# npy    - массив NumPy в формате .npy: (n_features,) для одного образца, (n_samples, n_features) для пакета.
+# frames - пакет образцов, каждый в виде <uint32 little-endian длина><данные>; данные - либо упакованные
+#          биты (ceil(n_features / 8) байт), либо по байту на признак (n_features байт). Длина всех
+#          записей одинакова, поэтому весь пакет читается одним структурным представлением.
+FRAME_PREFIX = struct.Struct("<I")
+NPY_HEADER_LIMIT = 64 * 1024  # Максимальный размер заголовка .npy, байты
+NUMERIC_KINDS = "biuf"
+
+
+def bitset_size(n_features: int) -> int:
+    return (n_features + 7) // 8
+
+
+def encode_bitset(row) -> bytes:
+    """
+    Упаковывает вектор бинарных признаков в формат bits.
+    """
+    return np.packbits(np.asarray(row, dtype=bool)).tobytes()
+
+
+def encode_frames(X, packed: bool = True) -> bytes:
+    """
+    Кодирует пакет бинарных образцов в формат frames.
+    :param X:   Массив (n_samples, n_features) из нулей и единиц
+    :param packed:  Упаковывать признаки по 8 в байт
+    """
+    X = np.asarray(X)
+    payload = np.packbits(X.astype(bool), axis=1) if packed else X.astype(np.uint8)
+    frames = np.empty(len(payload), dtype=_frame_dtype(payload.shape[1]))
+    frames["length"] = payload.shape[1]
+    frames["payload"] = payload
+    return frames.tobytes()
+
+
+def decode_bitset(buffer, n_features: int) -> np.ndarray:
+    """
+    :param buffer:  Объект с буферным протоколом (bytes, bytearray, memoryview)
+    :return:    Вектор uint8 длины n_features
+    """
+    packed = np.frombuffer(buffer, dtype=np.uint8)
+    if packed.size != bitset_size(n_features):
+        raise SchemaMismatch(f"Ожидается {bitset_size(n_features)} байт упакованных признаков, получено {packed.size}.")
+    return np.unpackbits(packed, count=n_features)
+
+
+def decode_npy(buffer, n_features: int) -> np.ndarray:
+    """
+    Массив .npy как представление поверх буфера.
+    :return:    Массив (n_features,) или (n_samples, n_features)
+    """
+    view = memoryview(buffer)
+    header = io.BytesIO(view[:NPY_HEADER_LIMIT])
+    shape, fortran_order, dtype = read_npy_header(header, n_features)
+    count = int(np.prod(shape))
+    try:
+        array = np.frombuffer(view, dtype=dtype, count=count, offset=header.tell())
+    except ValueError:
+        raise SchemaMismatch("Файл .npy обрезан.")
+    array = array.reshape(shape, order="F" if fortran_order else "C")
+    _check_finite(array)
+    return array
+
+
+def read_npy_header(file: IO[bytes], n_features: int) -> tuple:
+    """
+    Читает и проверяет заголовок .npy, оставляя позицию файла в начале данных.
+    :return:    Тройка (shape, fortran_order, dtype)
+    """
+    try:
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+    except ValueError as exc:
+        raise SchemaMismatch(f"Некорректный файл .npy: {exc}")
+    if dtype.hasobject or dtype.kind not in NUMERIC_KINDS:
+        raise SchemaMismatch(f"Неподдерживаемый тип данных .npy: {dtype}")
+    if len(shape) not in (1, 2) or shape[-1] != n_features:
+        raise SchemaMismatch(f"Ожидается массив (n_samples, {n_features}), получен {shape}.")
+    return shape, fortran_order, dtype
+
+
+def decode_frames(buffer, n_features: int) -> np.ndarray:
+    """
+    Пакет в формате frames.
+    :return:    Массив uint8 (n_samples, n_features)
+    """
+    view = memoryview(buffer)
+    if not view.nbytes:
+        return np.empty((0, n_features), dtype=np.uint8)
+    (length,) = FRAME_PREFIX.unpack_from(view)
+    if length not in (n_features, bitset_size(n_features)):
+        raise SchemaMismatch(f"Длина записи должна быть {bitset_size(n_features)} или {n_features} байт, "
+                             f"получено {length}.")
+    stride = FRAME_PREFIX.size + length
+    if view.nbytes % stride:
+        raise SchemaMismatch("Пакет обрезан: размер не кратен длине записи.")
+    frames = np.frombuffer(view, dtype=_frame_dtype(length))
+    if (frames["length"] != length).any():
+        raise SchemaMismatch("Записи пакета должны быть одинаковой длины.")
+    payload = frames["payload"]
+    if length == n_features:
+        return payload
+    return np.unpackbits(payload, axis=1, count=n_features)
+
+
+def count_frames(file: IO[bytes], n_features: int) -> int:
+    """
+    Количество записей в файле формата frames по его размеру.
+    """
+    file.seek(0)
+    prefix = file.read(FRAME_PREFIX.size)
+    size = file.seek(0, io.SEEK_END)
+    file.seek(0)
+    if not prefix:
+        return 0
+    stride = _frame_stride(prefix, n_features)
+    if size % stride:
+        raise SchemaMismatch("Пакет обрезан: размер не кратен длине записи.")
+    return size // stride
+
+
+def iter_frame_chunks(file: IO[bytes], n_features: int, chunk_size: int) -> Iterator[np.ndarray]:
+    file.seek(0)
+    prefix = file.read(FRAME_PREFIX.size)
+    file.seek(0)
+    if not prefix:
+        return
+    stride = _frame_stride(prefix, n_features)
+    while chunk := file.read(chunk_size * stride):
+        yield decode_frames(chunk, n_features)
+
+
+def count_npy(file: IO[bytes], n_features: int) -> int:
+    file.seek(0)
+    shape, _, _ = read_npy_header(file, n_features)
+    file.seek(0)
+    return shape[0] if len(shape) == 2 else 1
+
+
+def iter_npy_chunks(file: IO[bytes], n_features: int, chunk_size: int) -> Iterator[np.ndarray]:
+    file.seek(0)
+    shape, fortran_order, dtype = read_npy_header(file, n_features)
+    if fortran_order and len(shape) == 2 and shape[0] > 1:
+        raise SchemaMismatch("Пакет .npy должен храниться построчно (C order).")
+    row_size = n_features * dtype.itemsize
+    remaining = shape[0] if len(shape) == 2 else 1
+    while remaining:
+        rows = min(chunk_size, remaining)
+        chunk = file.read(rows * row_size)
+        if len(chunk) != rows * row_size:
+            raise SchemaMismatch("Файл .npy обрезан.")
+        array = np.frombuffer(chunk, dtype=dtype).reshape(rows, n_features)
+        _check_finite(array)
+        yield array
+        remaining -= rows
+
+
+def _frame_dtype(length: int) -> np.dtype:
+    return np.dtype([("length", "<u4"), ("payload", np.uint8, (length,))])
+
+
+def _frame_stride(prefix: bytes, n_features: int) -> int:
+    (length,) = FRAME_PREFIX.unpack(prefix.ljust(FRAME_PREFIX.size, b"\0"))
+    if length not in (n_features, bitset_size(n_features)):
+        raise SchemaMismatch(f"Длина записи должна быть {bitset_size(n_features)} или {n_features} байт, "
+                             f"получено {length}.")
+    return FRAME_PREFIX.size + length
+
+
+def _check_finite(array: np.ndarray):
+    if array.dtype.kind == "f" and not np.isfinite(array).all():
+        raise SchemaMismatch("Признаки должны быть конечными числами.")
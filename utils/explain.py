@@ -0,0 +1,63 @@
+import numpy as np
+
+from utils.compiled_trees import CompiledGradientBoosting
+from utils.features import get_feature_schema
+
+
+class ExplanationNotSupported(ValueError):
+    pass
+
+
+def contributions(entry, X) -> tuple:
+    """
+    Вклады признаков в логит положительного класса.
+    Линейная модель: коэффициент x значение признака. Скомпилированный градиентный бустинг: атрибуция
+    по путям в деревьях (CompiledGradientBoosting.path_contributions).
+    :param entry:   Запись модели из реестра
+    :param X:   Двумерный массив признаков (n_samples, n_features)
+    :return:    Пара (вклады (n_samples, n_features), базовое значение логита)
+    :raises ExplanationNotSupported: если для модели нет способа объяснения
+    """
+    X = np.asarray(X)
+    predictor = entry.predictor
+    if isinstance(predictor, CompiledGradientBoosting):
+        return predictor.path_contributions(X)
+    coef = getattr(predictor, "coef_", None)
+    if coef is not None and coef.shape[0] == 1:
+        return X * coef[0], float(predictor.intercept_[0])
+    raise ExplanationNotSupported(f"Объяснение для модели {entry.name} не поддерживается.")
+
+
+def top_features(values: np.ndarray, X, k: int) -> list:
+    """
+    k признаков с наибольшим по модулю вкладом для каждого образца, по убыванию модуля.
+    :param values:  Вклады (n_samples, n_features)
+    :param X:   Значения признаков (n_samples, n_features)
+    :param k:   Количество признаков
+    :return:    Для каждого образца список {"feature", "value", "contribution"}
+    """
+    names = get_feature_schema().names
+    k = min(k, values.shape[1])
+    magnitude = np.abs(values)
+    top = np.argpartition(-magnitude, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(magnitude, top, axis=1), axis=1, kind="stable")
+    top = np.take_along_axis(top, order, axis=1)
+    top_values = np.take_along_axis(np.asarray(X), top, axis=1).tolist()
+    top_contributions = np.take_along_axis(values, top, axis=1).tolist()
+    return [[{"feature": names[index], "value": value, "contribution": contribution}
+             for index, value, contribution in zip(indices, row_values, row_contributions)]
+            for indices, row_values, row_contributions in zip(top.tolist(), top_values, top_contributions)]
+
+
+def explain(entry, X, k: int) -> list:
+    """
+    Объяснения для батча образцов.
+    :param entry:   Запись модели из реестра
+    :param X:   Двумерный массив признаков (n_samples, n_features)
+    :param k:   Количество признаков с наибольшим вкладом в ответе
+    :return:    Для каждого образца: базовое значение и итоговый логит, top-k признаков
+    """
+    values, base_value = contributions(entry, X)
+    raw = values.sum(axis=1) + base_value
+    return [{"base_value": base_value, "raw_score": score, "top_features": features}
+            for score, features in zip(raw.tolist(), top_features(values, X, k))]
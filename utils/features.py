@@ -0,0 +1,126 @@
+import json
+import threading
+from operator import itemgetter
+from typing import Iterable, Mapping
+
+import numpy as np
+
+from core.config import FEATURE_SCHEMA_PATH
+
+
+class SchemaMismatch(ValueError):
+    """
+    Набор признаков документа не совпадает со схемой.
+    """
+
+
+class FeatureSchema:
+    """
+    Названия признаков в том порядке, в котором модели видели их при обучении.
+
+    Документ раскладывается по названиям сразу в заранее выделенную строку массива,
+    поэтому вход модели не зависит от порядка ключей в загруженном JSON.
+    """
+
+    def __init__(self, names: list):
+        if len(set(names)) != len(names):
+            raise ValueError("Названия признаков в схеме повторяются.")
+        self.names = list(names)
+        self.index = {name: position for position, name in enumerate(self.names)}
+        # Все значения документа в порядке схемы достаются одним вызовом на C
+        self._getter = itemgetter(*self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def load(cls, path: str = FEATURE_SCHEMA_PATH) -> "FeatureSchema":
+        with open(path, encoding="utf-8") as schema_file:
+            return cls(json.load(schema_file)["features"])
+
+    def parse(self, features: Mapping, out: np.ndarray = None) -> np.ndarray:
+        """
+        Раскладывает словарь признаков по позициям схемы.
+        :param features:    Словарь название -> значение
+        :param out: Строка, в которую записываются значения; если не задана, выделяется новая
+        :return:    Одномерный массив float64 длины len(schema)
+        :raises SchemaMismatch: если есть лишние или недостающие признаки либо нечисловые значения
+        """
+        if out is None:
+            out = np.empty(len(self.names))
+        # Ключи словаря уникальны: при совпадении длины отсутствие KeyError означает точное совпадение набора
+        if len(features) != len(self.names):
+            raise self._mismatch(features)
+        try:
+            values = self._getter(features)
+        except KeyError:
+            raise self._mismatch(features)
+        try:
+            # Бинарные флаги (целые 0..255) упаковываются в bytes на C и копируются в строку векторно;
+            # поэлементное преобразование объектов Python в numpy в несколько раз медленнее
+            out[:] = np.frombuffer(bytes(values), dtype=np.uint8)
+        except (TypeError, ValueError):
+            try:
+                out[:] = values
+            except (TypeError, ValueError) as exc:
+                raise SchemaMismatch(f"Некорректное значение признака: {exc}")
+        return out
+
+    def parse_many(self, documents: Iterable[Mapping], count: int = None) -> np.ndarray:
+        """
+        Раскладывает несколько словарей признаков в двумерный массив.
+        :param documents:   Словари признаков
+        :param count:   Количество документов, если documents - итератор без длины
+        :return:    Массив (n_documents, len(schema))
+        """
+        if count is None:
+            documents = list(documents)
+            count = len(documents)
+        X = np.empty((count, len(self.names)))
+        rows = 0
+        for row, features in zip(X, documents):
+            self.parse(features, out=row)
+            rows += 1
+        return X[:rows]
+
+    def column_positions(self, header: list, skip: tuple = ()) -> tuple:
+        """
+        Сопоставление колонок таблицы позициям схемы.
+        :param header:  Названия колонок
+        :param skip:    Служебные колонки, которые не являются признаками
+        :return:    Пара (номера колонок-признаков, их позиции в схеме)
+        """
+        columns = [i for i, name in enumerate(header) if name not in skip]
+        names = {header[i]: i for i in columns}
+        if len(names) != len(columns) or len(names) != len(self.names) or not names.keys() <= self.index.keys():
+            raise self._mismatch(names)
+        return columns, [self.index[header[i]] for i in columns]
+
+    def _mismatch(self, features: Mapping) -> SchemaMismatch:
+        unknown = [name for name in features if name not in self.index]
+        missing = [name for name in self.names if name not in features]
+        details = []
+        if unknown:
+            details.append(f"неизвестные признаки: {', '.join(map(str, unknown[:5]))}")
+        if missing:
+            details.append(f"отсутствуют признаки: {', '.join(missing[:5])}")
+        if not details:
+            details.append("признаки повторяются")
+        return SchemaMismatch(f"Некорректный формат данных: ожидается {len(self.names)} признак(ов); "
+                              + "; ".join(details))
+
+
+_schema = None
+_schema_lock = threading.Lock()
+
+
+def get_feature_schema() -> FeatureSchema:
+    """
+    Схема признаков из FEATURE_SCHEMA_PATH, загружается при первом обращении.
+    """
+    global _schema
+    if _schema is None:
+        with _schema_lock:
+            if _schema is None:
+                _schema = FeatureSchema.load()
+    return _schema
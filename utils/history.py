@@ -0,0 +1,102 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select, and_, or_
+
+from models.models import Prediction
+
+# Поля, которые отдаются в истории; ORM-объекты целиком не загружаются
+HISTORY_COLUMNS = (
+    Prediction.id,
+    Prediction.job_id,
+    Prediction.user_id,
+    Prediction.model_name,
+    Prediction.model_version,
+    Prediction.result,
+    Prediction.status,
+    Prediction.cost,
+    Prediction.samples,
+    Prediction.created_at,
+    Prediction.finished_at,
+)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at: datetime, prediction_id: int) -> str:
+    """
+    Курсор следующей страницы: ключ последней выданной строки.
+    """
+    raw = json.dumps([created_at.isoformat() if created_at else None, prediction_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    :return:    Пара (created_at, id) последней строки предыдущей страницы
+    :raises InvalidCursor: если курсор поврежден
+    """
+    try:
+        created_at, prediction_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (datetime.fromisoformat(created_at) if created_at else None), int(prediction_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+
+
+def history_query(user_id: Optional[int], cursor: Optional[str] = None, created_from: Optional[datetime] = None,
+                  created_to: Optional[datetime] = None, result: Optional[str] = None,
+                  status: Optional[str] = None, model_name: Optional[str] = None):
+    """
+    Запрос истории пользователя от новых к старым по индексу (user_id, created_at).
+    Вместо OFFSET используется ключ последней строки, поэтому стоимость страницы не зависит от ее номера.
+    :param user_id: Идентификатор пользователя; None - все пользователи (по индексу created_at)
+    :param cursor:  Курсор из предыдущей страницы
+    :param created_from:    Начало периода (включительно)
+    :param created_to:  Конец периода (не включительно)
+    :param result:  Только предсказания с таким результатом
+    :param status:  Только задачи с таким статусом (finished, failed); pending - еще не завершенные
+    :param model_name:  Только предсказания этой модели
+    """
+    query = select(*HISTORY_COLUMNS)
+    if user_id is not None:
+        query = query.where(Prediction.user_id == user_id)
+    if model_name is not None:
+        query = query.where(Prediction.model_name == model_name)
+    if created_from is not None:
+        query = query.where(Prediction.created_at >= created_from)
+    if created_to is not None:
+        query = query.where(Prediction.created_at < created_to)
+    if result is not None:
+        query = query.where(Prediction.result == result)
+    if status == "pending":
+        query = query.where(Prediction.status.is_(None))
+    elif status is not None:
+        query = query.where(Prediction.status == status)
+    if cursor is not None:
+        created_at, prediction_id = decode_cursor(cursor)
+        # id различает строки, созданные в одну и ту же секунду
+        query = query.where(or_(Prediction.created_at < created_at,
+                                and_(Prediction.created_at == created_at, Prediction.id < prediction_id)))
+    return query.order_by(Prediction.created_at.desc(), Prediction.id.desc())
+
+
+def cursor_key(cursor: Optional[str]) -> Optional[tuple]:
+    """
+    Ключ (created_at, id), после которого продолжается выдача, или None для первой страницы.
+    """
+    if cursor is None:
+        return None
+    created_at, prediction_id = decode_cursor(cursor)
+    return (created_at, prediction_id) if created_at is not None else None
+
+
+def row_to_dict(row) -> dict:
+    item = dict(row._mapping)
+    for field in ("created_at", "finished_at"):
+        if item[field] is not None:
+            item[field] = item[field].isoformat()
+    return item
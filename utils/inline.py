@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from core.config import (INLINE_PREDICTION_ENABLED, INLINE_PREDICTION_WORKERS, INLINE_PREDICTION_MAX_PENDING,
+                         INLINE_LATENCY_BUDGET_MS, INLINE_LATENCY_WINDOW, INLINE_RECHECK_SECONDS)
+from utils.features import get_feature_schema
+
+logger = logging.getLogger(__name__)
+
+# Количество пробных предсказаний при первом замере модели
+CALIBRATION_RUNS = 20
+
+
+class InlinePredictor:
+    """
+    Синхронные предсказания в процессе API на ограниченном пуле потоков.
+
+    Модель допускается, если p95 времени ее предсказания укладывается в бюджет: inline_budget_ms
+    из метаданных модели или INLINE_LATENCY_BUDGET_MS. Время измеряется пробными предсказаниями
+    при первом обращении к версии модели и затем по реальным вызовам. Модель, вышедшая из бюджета,
+    перемеряется не чаще раза в INLINE_RECHECK_SECONDS. Если модель не допущена или пул занят,
+    predict возвращает None и предсказание идет обычным путем через очередь Celery.
+    """
+
+    def __init__(self, workers: int = INLINE_PREDICTION_WORKERS, max_pending: int = INLINE_PREDICTION_MAX_PENDING,
+                 default_budget_ms: float = INLINE_LATENCY_BUDGET_MS, window: int = INLINE_LATENCY_WINDOW,
+                 recheck_seconds: float = INLINE_RECHECK_SECONDS):
+        """
+        :param workers: Количество потоков пула
+        :param max_pending: Максимум предсказаний в пуле и в ожидании пула
+        :param default_budget_ms:   Бюджет моделей, для которых он не задан в метаданных, мс
+        :param window:  Количество последних замеров, по которым считается p95
+        :param recheck_seconds: Интервал повторного замера модели, не уложившейся в бюджет
+        """
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inline-predict")
+        self.max_pending = max_pending
+        self.default_budget_ms = default_budget_ms
+        self.window = window
+        self.recheck_seconds = recheck_seconds
+        self._pending = 0
+        self._latencies = {}
+        self._checked_at = {}
+        self._calibrating = set()
+        self._lock = threading.Lock()
+
+    def budget_ms(self, entry) -> float:
+        return float(entry.metadata.get("inline_budget_ms", self.default_budget_ms))
+
+    async def predict(self, entry, features):
+        """
+        Предсказание для одного образца в пуле потоков API.
+        :param entry:   Запись модели из реестра
+        :param features:    Вектор признаков
+        :return:    Результат (скаляр Python) или None, если предсказание нужно отправить в очередь
+        """
+        if not await self.admits(entry):
+            return None
+        with self._lock:
+            if self._pending >= self.max_pending:
+                return None
+            self._pending += 1
+        try:
+            result, seconds = await asyncio.get_running_loop().run_in_executor(self.executor, _predict_one,
+                                                                               entry, features)
+        except Exception as exc:
+            # Ошибка будет записана и оплата возвращена обычным путем через очередь
+            logger.warning("Inline prediction failed: %s", exc)
+            return None
+        finally:
+            with self._lock:
+                self._pending -= 1
+        self._record(entry, [seconds])
+        return result
+
+    async def admits(self, entry) -> bool:
+        """
+        Укладывается ли модель в свой бюджет задержки.
+        """
+        budget = self.budget_ms(entry)
+        if budget <= 0:
+            return False
+        key = (entry.name, entry.version)
+        latencies = self._latencies.get(key)
+        stale = time.monotonic() - self._checked_at.get(key, 0.0) >= self.recheck_seconds
+        if latencies is None or (stale and self._p95_ms(latencies) > budget):
+            with self._lock:
+                if key in self._calibrating:
+                    return False
+                self._calibrating.add(key)
+            try:
+                seconds = await asyncio.get_running_loop().run_in_executor(self.executor, _calibrate, entry)
+            except Exception as exc:
+                logger.warning("Inline calibration failed for %s: %s", entry.name, exc)
+                seconds = [float("inf")]
+            finally:
+                with self._lock:
+                    self._calibrating.discard(key)
+            self._latencies[key] = deque(maxlen=self.window)
+            self._record(entry, seconds)
+            self._checked_at[key] = time.monotonic()
+            latencies = self._latencies[key]
+        return self._p95_ms(latencies) <= budget
+
+    def stats(self) -> dict:
+        """
+        p95 задержки по версиям моделей и загрузка пула.
+        """
+        return {
+            "pending": self._pending,
+            "models": {f"{name}:{version}": {"p95_ms": self._p95_ms(latencies), "samples": len(latencies)}
+                       for (name, version), latencies in list(self._latencies.items())},
+        }
+
+    def _record(self, entry, seconds: list):
+        latencies = self._latencies.get((entry.name, entry.version))
+        if latencies is not None:
+            latencies.extend(seconds)
+
+    @staticmethod
+    def _p95_ms(latencies) -> float:
+        return float(np.percentile(latencies, 95)) * 1000.0 if latencies else float("inf")
+
+
+def _predict_one(entry, features) -> tuple:
+    X = np.asarray(features).reshape(1, -1)
+    started = time.perf_counter()
+    result = entry.predictor.predict(X)[0]
+    return (result.item() if hasattr(result, "item") else result), time.perf_counter() - started
+
+
+def _calibrate(entry) -> list:
+    # Первое предсказание загружает и прогревает модель, в замер не входит
+    X = np.zeros(len(get_feature_schema()))
+    _predict_one(entry, X)
+    return [_predict_one(entry, X)[1] for _ in range(CALIBRATION_RUNS)]
+
+
+inline_predictor = InlinePredictor() if INLINE_PREDICTION_ENABLED else None
@@ -1,46 +1,110 @@
-import joblib
+import logging
+
+import numpy as np
 from models.models import Prediction
-from core.database import get_db
+from core.database import get_db, SessionLocal
 from core.worker import app
+from core import metrics
 from rq import Queue
-from core.config import MODEL_COSTS
+from core.config import PREDICTION_BATCHING
+from core.cache import prediction_cache
+from utils.batching import get_batcher
+from utils.cascade import CascadeModel, CascadeResult
+from utils.registry import model_registry
+from utils.results import get_result_writer
+
+logger = logging.getLogger(__name__)
+
 
-# Загрузка обученных моделей
-MODELS = {
-    "lr_model": joblib.load("ml_models/lr_model.joblib"),
-    "gb_model": joblib.load("ml_models/gb_model.joblib"),
-}
+def get_predictor(model_name: str):
+    """
+    Возвращает объект с интерфейсом predict для текущей версии модели из реестра.
+    Модель загружается при первом обращении.
+    :param model_name:  Название модели
+    """
+    entry = model_registry.get(model_name)
+    return entry.predictor if entry is not None else None
 
 
 def perform_prediction(model_name: str, features: list, user_id: int):
-    model = MODELS.get(model_name)
-    if not model:
+    model = get_predictor(model_name)
+    if model is None:
         raise ValueError("Model not found.")
 
     try:
         # Оберните вызов функции предсказания в блок try/except
-        prediction_result = model.predict([features])  # Модель ожидает список списков признаков
-        print("prediction_result: ", prediction_result)
+        prediction_result = predict_batch(model_name, np.asarray([features]))  # Модель ожидает список списков признаков
+        logger.debug("prediction_result: %s", prediction_result)
         return prediction_result[0]
 
     except Exception as exc:
         # Залогируем исключение, и позволим Celery отметить задачу как неудачную
-        print(f"Prediction failed: {exc}")
+        logger.warning("Prediction failed: %s", exc)
         # self.update_state(state="FAILURE", meta={'exc': str(exc)})
         raise exc
 
 
+def predict_batch(model_name: str, X: np.ndarray) -> np.ndarray:
+    """
+    Векторизованное предсказание для батча образцов одним вызовом модели.
+    :param model_name:  Название модели
+    :param X:   Двумерный массив признаков (n_samples, 241)
+    :return:    Массив предсказаний той же длины, что и X; для каскада - список CascadeResult
+    """
+    model = get_predictor(model_name)
+    if model is None:
+        raise ValueError("Model not found.")
+    with metrics.stage("model_predict", model_name):
+        if isinstance(model, CascadeModel):
+            predictions, escalated = model.run(X)
+            metrics.observe_cascade(model_name, len(escalated), int(escalated.sum()))
+            return [CascadeResult(*item) for item in zip(predictions.tolist(), escalated.tolist())]
+        return model.predict(X)
+
+
+def cascade_refund(model_name: str, results: list) -> tuple:
+    """
+    Разделяет результаты каскада на предсказания и сумму, которую нужно вернуть пользователю
+    за образцы, не дошедшие до второй модели. Для обычных моделей возврата нет.
+    :return:    Пара (предсказания, сумма возврата)
+    """
+    if not results or not isinstance(results[0], CascadeResult):
+        return results, 0.0
+    entry = model_registry.get(model_name)
+    refund = entry.refund([result.escalated for result in results]) if entry is not None else 0.0
+    return [result.prediction for result in results], refund
+
+
 @app.task(bind=True)
-def perform_async_prediction(self, model_name: str, file_content: list, user_id: int):
+def perform_async_prediction(self, model_name: str, file_content: list, user_id: int, cache_key: str = None):
     """
     Функция ставит задачу на асинхронное выполнение предсказания с использованием Celery.
-    .Описание.
+    :param cache_key:   Ключ кэша результатов, под который API занял выполнение этой задачи
     """
     # Добавление задачи в очередь Celery и возврат ID задачи:
     # task = perform_prediction.apply_async((model_name, file_content, user_id))
     # task =
     # print("task: ", task)
-    return perform_prediction(model_name, file_content, user_id)
+    try:
+        if PREDICTION_BATCHING:
+            # Строка уходит в общий батч модели, задача ждет только свой результат
+            result = get_batcher(predict_batch).submit(model_name, file_content).result()
+        else:
+            result = perform_prediction(model_name, file_content, user_id)
+        (result,), refund = cascade_refund(model_name, [result])
+        if cache_key and prediction_cache is not None:
+            prediction_cache.put(cache_key, result)
+    except Exception as exc:
+        # Ошибка записывается в БД вместе с возвратом оплаты
+        get_result_writer().task_result(self.request.id, error=str(exc)).result()
+        raise
+    else:
+        # Задача завершается только после того, как результат записан в БД
+        get_result_writer().task_result(self.request.id, result, refund=refund).result()
+        return result
+    finally:
+        if cache_key and prediction_cache is not None:
+            prediction_cache.release(cache_key)
 # def perform_async_prediction(model_name: str, file_content: list, user_id: int):
 #     """
 #     Функция ставит задачу на асинхронное выполнение предсказания в RQ очередь.
@@ -53,3 +117,31 @@ def perform_async_prediction(self, model_name: str, file_content: list, user_id:
 #     # features = parse_file_content(file_content)
 #     job = queue.enqueue(perform_prediction, model_name, file_content, user_id)
 #     return job.get_id()
+
+
+@app.task(bind=True)
+def perform_bulk_prediction(self, model_name: str, rows: list, user_id: int, job_id: str = None,
+                            chunk_cost: float = None, chunks: int = None, first_row: int = 0):
+    """
+    Предсказание для порции образцов из пакетной загрузки одним векторизованным вызовом модели.
+    :param model_name:  Название модели
+    :param rows:    Список образцов, каждый - список из 241 признака
+    :param user_id: Идентификатор пользователя
+    :param job_id:  Идентификатор пакетной задачи, под который зарезервирована оплата
+    :param chunk_cost:  Стоимость порции, возвращается пользователю при ошибке
+    :param chunks:  Общее количество порций пакетной задачи
+    :param first_row:   Номер первой строки порции в исходном файле
+    :return:    Список предсказаний в порядке строк порции
+    """
+    metrics.observe_batch(model_name, "bulk", len(rows))
+    try:
+        results, refund = cascade_refund(model_name, list(predict_batch(model_name, np.asarray(rows))))
+        results = np.asarray(results).tolist()
+    except Exception as exc:
+        if job_id:
+            get_result_writer().bulk_chunk(job_id, user_id, first_row, chunks, error=str(exc),
+                                           chunk_cost=chunk_cost).result()
+        raise
+    if job_id:
+        get_result_writer().bulk_chunk(job_id, user_id, first_row, chunks, results=results, refund=refund).result()
+    return results
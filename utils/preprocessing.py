@@ -1,5 +1,20 @@
+import csv
+import io
 import json
-from typing import Any, Dict
+from typing import Any, Callable, Dict, IO, Iterator
+
+import numpy as np
+
+from utils.encodings import (decode_bitset, decode_npy, count_frames, count_npy, iter_frame_chunks,
+                             iter_npy_chunks)
+from utils.features import SchemaMismatch, get_feature_schema
+
+# Служебные колонки, которые могут присутствовать в выгрузках TUANDROMD и не являются признаками
+NON_FEATURE_COLUMNS = ("Label",)
+
+# Форматы файла с одним образцом и файла с пакетом образцов (по расширению имени файла)
+SAMPLE_FORMATS = ("json", "bits", "npy")
+BULK_FORMATS = ("jsonl", "csv", "npy", "frames")
 
 
 def read_user_data(file_content):
@@ -9,20 +24,150 @@ def read_user_data(file_content):
     return user_data
 
 
-def preprocess_user_input(user_data: Dict[str, Any]) -> Any:
+def preprocess_user_input(user_data: Dict[str, Any], out: np.ndarray = None) -> np.ndarray:
     """
-    Предобработка данных пользователя для соответствия формату обучения модели.
+    Предобработка данных пользователя для соответствия формату обучения модели:
+    признаки раскладываются по названиям в порядке схемы обучения.
 
     Параметры:
     user_data (Dict[str, Any]): Словарь с данными пользователя.
+    out (np.ndarray): Строка, в которую записываются признаки; если не задана, выделяется новая.
 
     Возвращает:
-    Any: Отмасштабированные данные пользователя, подготовленные для модели.
+    np.ndarray: Вектор из 241 признака в порядке обучения.
     """
     # Предполагается, что все необходимые признаки находятся в ключе "features"
-    features = user_data.get("features")
-    if not features or len(features) != 241:
-        raise ValueError("Некорректный формат данных: ожидается 241 признак.")
+    features = user_data.get("features") if isinstance(user_data, dict) else None
+    if not isinstance(features, dict):
+        raise SchemaMismatch("Некорректный формат данных: ожидается объект \"features\".")
+    return get_feature_schema().parse(features, out=out)
+
+
+def decode_sample(payload: bytes, file_format: str) -> np.ndarray:
+    """
+    Вектор признаков одного образца из содержимого загруженного файла.
+    :param payload: Содержимое файла
+    :param file_format: Формат: "json", "bits" (упакованные биты) или "npy"
+    :return:    Вектор из 241 признака в порядке обучения
+    """
+    n_features = len(get_feature_schema())
+    if file_format == "bits":
+        return decode_bitset(payload, n_features)
+    if file_format == "npy":
+        vector = decode_npy(payload, n_features)
+        if vector.ndim == 2:
+            if vector.shape[0] != 1:
+                raise SchemaMismatch("Файл .npy должен содержать один образец.")
+            vector = vector[0]
+        return vector
+    return preprocess_user_input(read_user_data(payload))
+
+
+def file_format(filename: str, formats: tuple, default: str = None) -> str:
+    """
+    Формат файла по расширению имени.
+    :param filename:    Имя загруженного файла
+    :param formats: Допустимые форматы
+    :param default: Формат для файлов с другим расширением; если не задан, возвращается None
+    """
+    extension = (filename or "").rsplit(".", 1)[-1].lower()
+    return extension if extension in formats else default
+
+
+def count_samples(file: IO[bytes], file_format: str) -> int:
+    """
+    Быстрый подсчет количества образцов в файле без разбора содержимого.
+    :param file:    Бинарный файловый объект, позиция чтения возвращается в начало
+    :param file_format: Формат файла: один из BULK_FORMATS
+    :return:    Количество образцов
+    """
+    if file_format == "npy":
+        return count_npy(file, len(get_feature_schema()))
+    if file_format == "frames":
+        return count_frames(file, len(get_feature_schema()))
+    file.seek(0)
+    count = sum(1 for line in file if line.strip())
+    file.seek(0)
+    if file_format == "csv" and count:
+        count -= 1  # Заголовок
+    return count
+
+
+def iter_sample_chunks(file: IO[bytes], file_format: str, chunk_size: int) -> Iterator[np.ndarray]:
+    """
+    Потоковый разбор файла с множеством образцов (по одному на строку) порциями.
+    Образцы записываются сразу в заранее выделенный массив порции.
+    :param file:    Бинарный файловый объект
+    :param file_format: Формат файла: "jsonl" (по JSON-документу на строку), "csv" (заголовок с названиями признаков),
+                        "npy" или "frames" (двоичные форматы, см. utils.encodings)
+    :param chunk_size:  Количество образцов в порции
+    :return:    Итератор по порциям, каждая порция - массив (n_samples, 241)
+    """
+    # Двоичные форматы читаются порциями байтов и декодируются без разбора текста
+    if file_format == "npy":
+        yield from iter_npy_chunks(file, len(get_feature_schema()), chunk_size)
+        return
+    if file_format == "frames":
+        yield from iter_frame_chunks(file, len(get_feature_schema()), chunk_size)
+        return
+    file.seek(0)
+    text = io.TextIOWrapper(file, encoding="utf-8", newline="")
+    try:
+        if file_format == "jsonl":
+            fill = _jsonl_rows(text)
+        elif file_format == "csv":
+            fill = _csv_rows(text)
+        else:
+            raise ValueError(f"Неподдерживаемый формат файла: {file_format}")
+
+        width = len(get_feature_schema())
+        while True:
+            chunk = np.empty((chunk_size, width))
+            rows = fill(chunk)
+            if rows:
+                yield chunk[:rows]
+            if rows < chunk_size:
+                break
+    finally:
+        # Не даем обертке закрыть исходный файл
+        text.detach()
+
+
+def _jsonl_rows(text: IO[str]) -> Callable[[np.ndarray], int]:
+    lines = (line for line in text if line.strip())
+
+    def fill(chunk: np.ndarray) -> int:
+        rows = 0
+        for row, line in zip(chunk, lines):
+            document = json.loads(line)
+            # Строка может содержать как документ вида {"features": {...}}, так и сам словарь признаков
+            if isinstance(document, dict) and "features" not in document:
+                document = {"features": document}
+            preprocess_user_input(document, out=row)
+            rows += 1
+        return rows
+
+    return fill
+
+
+def _csv_rows(text: IO[str]) -> Callable[[np.ndarray], int]:
+    reader = csv.reader(text)
+    header = next(reader, None)
+    if header is not None:
+        columns, positions = get_feature_schema().column_positions(header, NON_FEATURE_COLUMNS)
+    values = (values for values in reader if values)
+
+    def fill(chunk: np.ndarray) -> int:
+        if header is None:
+            return 0
+        rows = 0
+        for row, line in zip(chunk, values):
+            # Колонки файла переставляются в порядок схемы
+            try:
+                row[positions] = [line[i] for i in columns]
+            except IndexError:
+                raise SchemaMismatch(f"Строка {rows + 1} порции содержит {len(line)} колонок вместо {len(header)}.")
+            rows += 1
+        return rows
 
-    processed_features = list(features.values())
-    return processed_features
+    return fill
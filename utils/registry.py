@@ -0,0 +1,193 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import joblib
+
+from core.config import MODEL_DIRECTORY, MODEL_REGISTRY_POLL_SECONDS
+from utils.cascade import CascadeEntry
+from utils.compiled_trees import compile_model
+
+logger = logging.getLogger(__name__)
+
+# Каталог внутри MODEL_DIRECTORY для кэша скомпилированных моделей
+COMPILED_SUBDIRECTORY = "compiled"
+
+
+class ModelEntry:
+    """
+    Одна версия модели из каталога артефактов.
+
+    Метаданные (версия, стоимость) читаются сразу, сама модель загружается при первом обращении.
+    Массивы моделей открываются через mmap, поэтому процессы на одном хосте (API, worker'ы разных
+    очередей, дочерние процессы prefork-пула при PREDICTION_BATCHING=0) разделяют одни и те же страницы памяти.
+    """
+
+    # Стоимость известна до выполнения (в отличие от каскада, utils.cascade.CascadeEntry)
+    fixed_cost = True
+
+    def __init__(self, name: str, version: str, path: str, cost: float, metadata: dict):
+        self.name = name
+        self.version = version
+        self.path = path
+        self.cost = cost
+        self.metadata = metadata
+        self._model = None
+        self._predictor = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        """
+        Исходная модель sklearn.
+        """
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = joblib.load(self.path, mmap_mode="r")
+        return self._model
+
+    @property
+    def predictor(self):
+        """
+        Объект с интерфейсом predict/predict_proba: скомпилированный вариант модели, если он поддерживается.
+        """
+        if self._predictor is None:
+            model = self.model
+            with self._lock:
+                if self._predictor is None:
+                    compiled = self._load_compiled(model)
+                    self._predictor = compiled if compiled is not None else model
+        return self._predictor
+
+    def describe(self) -> dict:
+        return {"name": self.name, "version": self.version, "cost": self.cost}
+
+    def _load_compiled(self, model):
+        compiled_path = os.path.join(os.path.dirname(self.path), COMPILED_SUBDIRECTORY,
+                                     f"{self.name}-{self.version}.joblib")
+        if os.path.exists(compiled_path):
+            return joblib.load(compiled_path, mmap_mode="r")
+        compiled = compile_model(model)
+        if compiled is None:
+            return None
+        try:
+            # Сохраняем массивы на диск и открываем через mmap, чтобы их тоже разделяли процессы
+            os.makedirs(os.path.dirname(compiled_path), exist_ok=True)
+            tmp_path = f"{compiled_path}.{os.getpid()}.tmp"
+            joblib.dump(compiled, tmp_path)
+            os.replace(tmp_path, compiled_path)
+            return joblib.load(compiled_path, mmap_mode="r")
+        except OSError as exc:
+            logger.warning("Compiled model cache is not available: %s", exc)
+            return compiled
+
+
+class ModelRegistry:
+    """
+    Реестр моделей из каталога артефактов ml_models/.
+
+    Модель - файл <name>.joblib или <name>.<version>.joblib, рядом может лежать файл метаданных
+    с тем же именем и расширением .json (стоимость, версия); общие для всех версий метаданные
+    берутся из <name>.json. Если версия не указана, ей становится хэш содержимого артефакта.
+    Из нескольких артефактов одной модели используется самый новый по времени изменения.
+    Новые артефакты нужно записывать под временным именем и переименовывать в *.joblib.
+    Файл <name>.json с ключом "cascade" без артефакта описывает каскад из двух моделей реестра.
+
+    Каталог периодически пересканируется; новый набор моделей собирается целиком и
+    подменяется одной операцией присваивания, поэтому выполняющиеся запросы не видят
+    промежуточного состояния и worker'ы не нужно перезапускать.
+    """
+
+    def __init__(self, directory: str = MODEL_DIRECTORY, poll_interval: float = MODEL_REGISTRY_POLL_SECONDS):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self._entries = {}
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, name: str):
+        """
+        Текущая версия модели или None, если такой модели нет.
+        :param name:    Название модели
+        """
+        return self.entries().get(name)
+
+    def entries(self) -> dict:
+        """
+        Все доступные модели: название -> ModelEntry.
+        """
+        if time.monotonic() - self._checked_at >= self.poll_interval:
+            self.refresh()
+        return self._entries
+
+    def refresh(self):
+        """
+        Пересканирует каталог и подменяет набор моделей, если артефакты изменились.
+        """
+        with self._lock:
+            self._checked_at = time.monotonic()
+            paths = sorted(glob.glob(os.path.join(self.directory, "*.joblib")))
+            descriptions = sorted(glob.glob(os.path.join(self.directory, "*.json")))
+            signature = tuple((path, os.stat(path).st_mtime_ns, os.stat(path).st_size) for path in paths + descriptions)
+            if signature == self._signature:
+                return
+            entries = {}
+            for path, mtime, _ in sorted(signature[:len(paths)], key=lambda item: item[1]):
+                entry = self._entry(path)
+                current = self._entries.get(entry.name)
+                # Уже загруженную версию переиспользуем, чтобы не загружать модель повторно
+                if current is not None and current.path == path and current.version == entry.version:
+                    entry = current
+                entries[entry.name] = entry
+            entries.update(self._cascades(descriptions, entries))
+            self._entries = entries
+            self._signature = signature
+
+    @staticmethod
+    def _cascades(paths: list, entries: dict) -> dict:
+        cascades = {}
+        for path in paths:
+            name = os.path.basename(path)[:-len(".json")]
+            if "." in name or name in entries:
+                continue
+            with open(path) as metadata_file:
+                metadata = json.load(metadata_file)
+            spec = metadata.get("cascade") if isinstance(metadata, dict) else None
+            if not spec:
+                continue
+            first, second = entries.get(spec["first"]), entries.get(spec["second"])
+            if first is None or second is None:
+                logger.warning("Cascade %s skipped: model %s or %s is not available",
+                               name, spec["first"], spec["second"])
+                continue
+            cascades[name] = CascadeEntry(name, metadata, first, second)
+        return cascades
+
+    @staticmethod
+    def _entry(path: str) -> ModelEntry:
+        stem = os.path.basename(path)[:-len(".joblib")]
+        name, _, version = stem.partition(".")
+        # Метаданные версии дополняют общие метаданные модели <name>.json
+        metadata = {}
+        for metadata_stem in dict.fromkeys((name, stem)):
+            metadata_path = os.path.join(os.path.dirname(path), f"{metadata_stem}.json")
+            if os.path.exists(metadata_path):
+                with open(metadata_path) as metadata_file:
+                    metadata.update(json.load(metadata_file))
+        if not version:
+            version = metadata.get("version") or _file_hash(path)
+        return ModelEntry(name, str(version), path, float(metadata.get("cost", 0)), metadata)
+
+
+def _file_hash(path: str) -> str:
+    with open(path, "rb") as artifact:
+        return hashlib.sha256(artifact.read()).hexdigest()[:12]
+
+
+model_registry = ModelRegistry()
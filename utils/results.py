@@ -0,0 +1,322 @@
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+from celery.signals import worker_ready
+from sqlalchemy import select, update, func, case
+from sqlalchemy.orm import aliased
+
+from core import billing, events, metrics
+from core.config import RESULT_WRITER_BATCH_SIZE, RESULT_WRITER_MAX_WAIT_MS, RESULT_SWEEP_WINDOW, QUEUE_DEFAULT
+from core.database import SessionLocal
+from core.worker import app
+from models.models import Prediction, BulkResult
+
+logger = logging.getLogger(__name__)
+
+FINISHED = "finished"
+FAILED = "failed"
+LEGACY_RESULT_LOST = "Результат не сохранен"
+
+
+def result_text(result) -> str:
+    """
+    Результат предсказания в том виде, в котором он хранится в Prediction.result.
+    """
+    return str(events.to_python(result))
+
+
+def task_item(task_id: str, result=None, error: str = None, refund: float = 0.0) -> dict:
+    """
+    Результат одиночной задачи в формате write_task_results.
+    """
+    return {"kind": "task", "task_id": task_id, "status": FAILED if error else FINISHED,
+            "result": error if error else result_text(result), "refund": refund}
+
+
+def write_task_results(db, tasks: list, now: datetime = None) -> list:
+    """
+    Записывает результаты одиночных задач во все еще не завершенные запросы, которые они обслуживают,
+    подтверждает или возвращает оплату этих запросов. Транзакцию фиксирует вызывающий.
+    :param db:  БД
+    :param tasks:   Результаты задач (task_item)
+    :param now: Время завершения
+    :return:    События для публикации: пары (идентификатор пользователя, событие)
+    """
+    now = now or datetime.utcnow()
+    by_task = {item["task_id"]: item for item in tasks}
+    # Результат получают только еще не завершенные запросы, и одним оператором: повторная запись
+    # того же результата (finish_joined_predictions) не подтверждает и не возвращает оплату дважды
+    jobs = db.execute(
+        update(Prediction)
+        .where(Prediction.task_id.in_(by_task), Prediction.status.is_(None))
+        .values(result=case({task_id: item["result"] for task_id, item in by_task.items()},
+                            value=Prediction.task_id),
+                status=case({task_id: item["status"] for task_id, item in by_task.items()},
+                            value=Prediction.task_id),
+                finished_at=now)
+        .returning(Prediction.task_id, Prediction.job_id, Prediction.user_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    billing.settle(db, [job_id for task_id, job_id, _ in jobs if by_task[task_id]["status"] == FINISHED])
+    published = []
+    for task_id, job_id, user_id in jobs:
+        item = by_task[task_id]
+        if item["status"] == FAILED:
+            billing.refund(db, job_id)
+        elif item["refund"]:
+            billing.refund(db, job_id, item["refund"])
+            ResultWriter._charge_less(db, Prediction.job_id == job_id, item["refund"])
+        published.append((user_id, events.job_event(job_id, item["status"], item["result"])))
+    return published
+
+
+class ResultWriter:
+    """
+    Записывает результаты задач в БД пакетами: результаты всех задач, завершившихся за max_wait_ms,
+    вместе с подтверждением или возвратом оплаты попадают в одну транзакцию.
+    После commit публикуются события о завершении, поэтому подписчик, получивший событие,
+    уже может прочитать результат из БД.
+    """
+
+    def __init__(self, max_batch_size: int = RESULT_WRITER_BATCH_SIZE, max_wait_ms: float = RESULT_WRITER_MAX_WAIT_MS):
+        """
+        :param max_batch_size:  Максимальное количество результатов в одной транзакции
+        :param max_wait_ms:     Максимальное время ожидания заполнения пакета, мс
+        """
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def task_result(self, task_id: str, result=None, error: str = None, refund: float = 0.0) -> Future:
+        """
+        Результат одиночной задачи для всех запросов, которые она обслуживала.
+        :param task_id: Идентификатор задачи Celery
+        :param result:  Результат предсказания
+        :param error:   Текст ошибки, если задача завершилась неудачно
+        :param refund:  Часть резерва каждого запроса, которая возвращается после успешного выполнения
+                        (каскад, не дошедший до второй модели)
+        :return:    Future, который завершается после commit
+        """
+        return self._submit(task_item(task_id, result, error, refund))
+
+    def bulk_chunk(self, job_id: str, user_id: int, first_row: int, chunks: int, results: list = None,
+                   error: str = None, chunk_cost: float = None, refund: float = 0.0) -> Future:
+        """
+        Результаты одной порции пакетной задачи.
+        :param job_id:  Идентификатор пакетной задачи
+        :param user_id: Идентификатор пользователя
+        :param first_row:   Номер первой строки порции
+        :param chunks:  Общее количество порций
+        :param results: Предсказания для строк порции
+        :param error:   Текст ошибки, если порция не выполнена
+        :param chunk_cost:  Стоимость порции, возвращается при ошибке
+        :param refund:  Часть стоимости порции, которая возвращается после успешного выполнения
+        :return:    Future, который завершается после commit
+        """
+        return self._submit({"kind": "bulk", "job_id": job_id, "user_id": user_id, "first_row": first_row,
+                             "chunks": chunks, "status": FAILED if error else FINISHED,
+                             "results": error if error else json.dumps(results), "chunk_cost": chunk_cost,
+                             "refund": refund})
+
+    def _submit(self, item: dict) -> Future:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    # Поток создается при первом обращении, уже в дочернем процессе worker'а
+                    self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+                    self._thread.start()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            futures = [future for _, future in batch]
+            try:
+                with metrics.stage("result_flush"):
+                    published = self._flush([item for item, _ in batch])
+                metrics.observe_result_flush(len(batch))
+            except Exception as exc:
+                logger.exception("Results are not saved: %s", exc)
+                for future in futures:
+                    future.set_exception(exc)
+                continue
+            events.publish(published)
+            for future in futures:
+                future.set_result(None)
+
+    def _flush(self, items: list) -> list:
+        """
+        Записывает пакет результатов одной транзакцией.
+        :return:    События для публикации: пары (идентификатор пользователя, событие)
+        """
+        now = datetime.utcnow()
+        tasks = [item for item in items if item["kind"] == "task"]
+        chunks = [item for item in items if item["kind"] == "bulk"]
+        published = []
+        with SessionLocal() as db:
+            if tasks:
+                published.extend(write_task_results(db, tasks, now))
+
+            if chunks:
+                db.add_all([BulkResult(job_id=item["job_id"], first_row=item["first_row"], chunks=item["chunks"],
+                                       status=item["status"], results=item["results"]) for item in chunks])
+                billing.settle(db, list({item["job_id"] for item in chunks if item["status"] == FINISHED}))
+                for item in chunks:
+                    if item["status"] == FAILED:
+                        billing.refund(db, item["job_id"], item["chunk_cost"])
+                    elif item["refund"]:
+                        billing.refund(db, item["job_id"], item["refund"])
+                        self._charge_less(db, Prediction.job_id == item["job_id"], item["refund"])
+                db.flush()
+                published.extend(self._finish_bulk_jobs(db, chunks, now))
+            db.commit()
+        return published
+
+    @staticmethod
+    def _charge_less(db, condition, amount: float):
+        # Prediction.cost - фактическая стоимость: частичный возврат уменьшает ее
+        db.execute(update(Prediction).where(condition).values(cost=Prediction.cost - amount)
+                   .execution_options(synchronize_session=False))
+
+    @staticmethod
+    def _finish_bulk_jobs(db, chunks: list, now: datetime) -> list:
+        # Пакетная задача завершена, когда записаны все ее порции
+        users = {item["job_id"]: item["user_id"] for item in chunks}
+        progress = db.execute(
+            select(BulkResult.job_id, func.count(), func.sum(case((BulkResult.status == FAILED, 1), else_=0)),
+                   func.max(BulkResult.chunks))
+            .where(BulkResult.job_id.in_(users)).group_by(BulkResult.job_id)
+        ).all()
+        published = []
+        for job_id, done, failed, total in progress:
+            if done < total:
+                published.append((users[job_id], events.job_event(job_id, "progress", chunks_done=done, chunks=total)))
+                continue
+            status = FAILED if failed else FINISHED
+            db.execute(update(Prediction).where(Prediction.job_id == job_id)
+                       .values(status=status, finished_at=now).execution_options(synchronize_session=False))
+            published.append((users[job_id], events.job_event(job_id, status, chunks_done=done, chunks=total)))
+        return published
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_result_writer() -> ResultWriter:
+    """
+    Возвращает писатель результатов текущего процесса worker'а, создавая его при первом обращении.
+    """
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = ResultWriter()
+    return _writer
+
+
+def joined_results(db, since: datetime) -> list:
+    """
+    Результаты для запросов, которые присоединились к задаче (PredictionCache.claim) и записали свою строку
+    уже после того, как результат задачи был записан: другая строка той же задачи завершена, а эта - нет.
+    :param db:  БД
+    :param since:   Проверяются только запросы, созданные после этого момента
+    :return:    Результаты задач в формате ResultWriter.task_result
+    """
+    done = aliased(Prediction)
+    rows = db.execute(
+        select(Prediction.task_id, done.status, done.result).distinct()
+        .join(done, (done.task_id == Prediction.task_id) & done.status.is_not(None))
+        .where(Prediction.status.is_(None), Prediction.task_id.is_not(None), Prediction.created_at >= since)
+    ).all()
+    return [{"kind": "task", "task_id": task_id, "status": status, "result": result, "refund": 0.0}
+            for task_id, status, result in rows]
+
+
+@app.task
+def finish_joined_predictions() -> int:
+    """
+    Периодическая задача: записывает результат и подтверждает оплату запросов, опоздавших к записи результата
+    своей задачи.
+    :return:    Количество задач, результаты которых записаны повторно
+    """
+    with SessionLocal() as db:
+        items = joined_results(db, datetime.utcnow() - timedelta(seconds=RESULT_SWEEP_WINDOW))
+    if items:
+        events.publish(get_result_writer()._flush(items))
+    return len(items)
+
+
+def legacy_results(db, now: datetime = None) -> tuple:
+    """
+    Результаты задач, поставленных до того, как результаты стали записываться в БД (у таких запросов нет
+    model_name): читаются из бэкенда Celery. Задача без результата в бэкенде, поставленная раньше, чем
+    живут результаты (result_expires), потеряна и завершается с ошибкой и возвратом оплаты;
+    более новая, возможно, еще в очереди, и ее результат запишет worker.
+    :param db:  БД
+    :param now: Текущее время
+    :return:    Результаты задач в формате write_task_results и количество задач, оставшихся ожидающими
+    """
+    expired = (now or datetime.utcnow()) - timedelta(seconds=app.conf.result_expires)
+    rows = db.execute(
+        select(Prediction.task_id, func.min(Prediction.created_at))
+        .where(Prediction.status.is_(None), Prediction.model_name.is_(None), Prediction.task_id.is_not(None))
+        .group_by(Prediction.task_id)
+    ).all()
+    items = []
+    for task_id, created_at in rows:
+        task = app.AsyncResult(task_id)
+        if task.successful():
+            items.append(task_item(task_id, task.result))
+        elif task.failed():
+            items.append(task_item(task_id, error=str(task.result)))
+        elif created_at < expired:
+            items.append(task_item(task_id, error=LEGACY_RESULT_LOST))
+    return items, len(rows) - len(items)
+
+
+@app.task
+def resolve_legacy_predictions() -> int:
+    """
+    Записывает результаты задач, поставленных до миграции колонки status (legacy_results).
+    Если часть задач еще может быть в очереди, повторяется, когда их результаты в бэкенде истекут.
+    :return:    Количество задач, результаты которых записаны
+    """
+    with SessionLocal() as db:
+        items, pending = legacy_results(db)
+        published = write_task_results(db, items) if items else []
+        db.commit()
+    events.publish(published)
+    if pending:
+        resolve_legacy_predictions.apply_async(countdown=app.conf.result_expires)
+    return len(items)
+
+
+@worker_ready.connect
+def _resolve_legacy_on_start(sender=None, **kwargs):
+    # При запуске worker'а служебных задач; когда старые задачи разрешены, запрос ничего не находит
+    queues = sender.app.amqp.queues
+    if QUEUE_DEFAULT in (queues.consume_from or queues):
+        resolve_legacy_predictions.delay()
@@ -0,0 +1,155 @@
+import io
+import os
+import tempfile
+import uuid
+
+import numpy as np
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+from core import blobstore, metrics
+from core.config import UPLOAD_DIRECTORY, MAX_UPLOAD_SIZE, UPLOAD_CHUNK_SIZE, UPLOAD_FORM_OVERHEAD
+from core.database import SessionLocal
+from utils.preprocessing import SAMPLE_FORMATS, decode_sample, file_format
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def too_large_message() -> str:
+    return f"Файл больше {MAX_UPLOAD_SIZE} байт."
+
+
+class UploadSizeLimit:
+    """
+    ASGI middleware: ограничение размера тела запросов загрузки образца.
+
+    Starlette разбирает multipart-форму (и записывает файл во временный файл) до вызова обработчика,
+    поэтому проверка в ingest_upload срабатывает только после того, как получено все тело.
+    Middleware отклоняет запрос по заголовку Content-Length, не читая тела, а если заголовка нет
+    (chunked) - прерывает чтение, как только получено больше max_body_size байт.
+    """
+
+    def __init__(self, app, paths: tuple, max_body_size: int = MAX_UPLOAD_SIZE + UPLOAD_FORM_OVERHEAD):
+        """
+        :param paths:   Пути обработчиков, принимающих файл с одним образцом
+        :param max_body_size:   Максимальный размер тела: файл и служебные части формы
+        """
+        self.app = app
+        self.paths = frozenset(paths)
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_body_size:
+            response = JSONResponse({"detail": too_large_message()}, status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    # Разбор формы прерывается, FastAPI отвечает 413
+                    raise HTTPException(status_code=413, detail=too_large_message())
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def features_to_vector(features: list) -> np.ndarray:
+    """
+    Компактное представление вектора признаков: uint8 для бинарных флагов, иначе float64.
+    """
+    if isinstance(features, np.ndarray) and features.dtype == np.uint8:
+        return features
+    vector = np.asarray(features, dtype=np.float64)
+    if np.isin(vector, (0, 1)).all():
+        return vector.astype(np.uint8)
+    return vector
+
+
+def _store_vector(vector: np.ndarray) -> str:
+    buffer = io.BytesIO()
+    np.save(buffer, vector)
+    with SessionLocal() as db:
+        return blobstore.store(db, buffer.getvalue())
+
+
+async def ingest_upload(file: UploadFile) -> tuple:
+    """
+    Потоково читает загруженный файл (JSON, bits или npy) порциями с ограничением размера, один раз разбирает
+    и проверяет его и сохраняет готовый к предсказанию вектор признаков в хранилище образцов.
+    Одинаковые образцы (в любом формате загрузки) получают один и тот же идентификатор и хранятся один раз.
+    :param file:    Загруженный файл
+    :return:    Пара (идентификатор файла, вектор признаков)
+    """
+    size = 0
+    with tempfile.SpooledTemporaryFile(max_size=UPLOAD_CHUNK_SIZE) as buffer:
+        with metrics.stage("upload_read"):
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_UPLOAD_SIZE:
+                    raise UploadTooLarge(too_large_message())
+                buffer.write(chunk)
+        buffer.seek(0)
+        payload = buffer.read()
+    # Разбор JSON до мегабайта не должен блокировать цикл событий
+    with metrics.stage("parse"):
+        vector = await run_in_threadpool(decode_sample, payload, file_format(file.filename, SAMPLE_FORMATS,
+                                                                             default="json"))
+    with metrics.stage("preprocess"):
+        vector = features_to_vector(vector)
+
+    with metrics.stage("save_features"):
+        file_id = await run_in_threadpool(_store_vector, vector)
+    return file_id, vector
+
+
+def load_features(file_id: str) -> np.ndarray:
+    """
+    Вектор признаков, сохраненный при загрузке файла.
+    :param file_id: Идентификатор файла: хэш образца или UUID файла, загруженного до перехода на хранилище образцов
+    :raises FileNotFoundError: если образца нет
+    """
+    with metrics.stage("load_features"):
+        if blobstore.is_digest(file_id):
+            return np.load(io.BytesIO(blobstore.load(file_id)))
+        try:
+            legacy_id = str(uuid.UUID(file_id))
+        except ValueError:
+            raise FileNotFoundError(file_id)
+        # Старые файлы лежат в корне UPLOAD_DIRECTORY, пока их не удалит core.blobstore.collect_blobs
+        path = os.path.join(UPLOAD_DIRECTORY, legacy_id)
+        try:
+            return np.load(f"{path}.npy")
+        except FileNotFoundError:
+            return _convert_legacy_upload(path)
+
+
+def _convert_legacy_upload(path: str) -> np.ndarray:
+    """
+    Исходный JSON-файл, загруженный до того, как образцы стали разбираться при загрузке:
+    разбирается один раз и сохраняется рядом как <uuid>.npy.
+    :raises FileNotFoundError: если файла нет
+    :raises ValueError: если файл не разбирается
+    """
+    with open(path, "rb") as raw_file:
+        vector = features_to_vector(decode_sample(raw_file.read(), "json"))
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as npy_file:
+            np.save(npy_file, vector)
+        os.replace(tmp_path, f"{path}.npy")
+    except OSError:
+        # Без записи на диск образец все равно можно использовать; разберем снова в следующий раз
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return vector
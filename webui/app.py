@@ -1,14 +1,99 @@
 import base64
+import threading
+import time
 
 import dash
 import requests
-from dash import html, dcc, Input, Output, callback, State, no_update
+from requests.adapters import HTTPAdapter
+from dash import html, dcc, dash_table, Input, Output, callback, State, no_update
 import dash_bootstrap_components as dbc
 from dash.exceptions import PreventUpdate
 
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], suppress_callback_exceptions=True)
 
 backend_url = "http://localhost:8080"
+HTTP_TIMEOUT = 30  # Таймаут запросов к бэкенду, секунды
+PROFILE_CACHE_TTL = 10  # Время жизни профиля в кэше, секунды; после предсказания профиль перечитывается
+MODEL_CACHE_TTL = 60  # Время жизни списка моделей со стоимостью, секунды
+RESULTS_PAGE_SIZE = 50  # Размер страницы таблицы результатов
+
+# Общая сессия с пулом соединений: callback'и не открывают новое TCP-соединение на каждый запрос
+http = requests.Session()
+http.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
+
+class TTLCache:
+    """
+    Кэш ответов бэкенда на стороне сервера UI с ограниченным временем жизни записей.
+    """
+
+    def __init__(self, ttl: float, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            if len(self._items) >= self.max_size:
+                # Сначала выбрасываем просроченные записи, при необходимости - самые старые
+                now = time.monotonic()
+                self._items = {k: item for k, item in self._items.items() if item[0] >= now}
+                while len(self._items) >= self.max_size:
+                    self._items.pop(next(iter(self._items)))
+            self._items[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+
+profile_cache = TTLCache(PROFILE_CACHE_TTL)
+model_cache = TTLCache(MODEL_CACHE_TTL)
+
+
+def auth_headers(session_data) -> dict:
+    return {"Authorization": f"Bearer {session_data.get('token', '')}"}
+
+
+def fetch_profile(token: str):
+    """
+    Профиль пользователя (с кэшированием на PROFILE_CACHE_TTL) или None при ошибке.
+    """
+    profile = profile_cache.get(token)
+    if profile is None:
+        response = http.get(f"{backend_url}/users/me/", headers={"Authorization": f"Bearer {token}"},
+                            timeout=HTTP_TIMEOUT)
+        if response.status_code != 200:
+            return None
+        profile = response.json()
+        profile_cache.put(token, profile)
+    return profile
+
+
+def fetch_model_costs() -> dict:
+    """
+    Стоимость использования моделей по названию (с кэшированием на MODEL_CACHE_TTL).
+    """
+    costs = model_cache.get("costs")
+    if costs is None:
+        response = http.get(f"{backend_url}/models/", timeout=HTTP_TIMEOUT)
+        response.raise_for_status()
+        costs = {model["name"]: model["cost"] for model in response.json()}
+        model_cache.put("costs", costs)
+    return costs
 
 app.layout = html.Div(style={'backgroundColor': '#245', 'color': 'black', 'height': '100vh'}, children=[
     html.Div(id='username-display', style={'color': 'white'}),
@@ -81,6 +166,7 @@ prediction_page = html.Div(style=block_style, children=[
         options=[
             {'label': "Логистическая регрессия", 'value': 'lr_model'},
             {'label': "Градиентный бустинг", 'value': 'gb_model'},
+            {'label': "Каскад: регрессия, сомнительные образцы - бустинг", 'value': 'cascade'},
         ],
         placeholder="Выберите модель"
     ),
@@ -106,7 +192,30 @@ prediction_page = html.Div(style=block_style, children=[
 
 prediction_results_page = html.Div(style=block_style, children=[
     html.H1("Результаты предсказаний"),
-    html.Div(id='prediction-results-div')  # Храним здесь результаты
+    # Курсоры страниц: i-й элемент - курсор, с которого начинается страница i
+    dcc.Store(id='results-cursors', data=[None]),
+    # Страницы запрашиваются у бэкенда по одной, видимые строки отрисовываются виртуально
+    dash_table.DataTable(
+        id='prediction-results-table',
+        columns=[
+            {'name': 'ID задачи', 'id': 'job_id'},
+            {'name': 'Дата', 'id': 'created_at'},
+            {'name': 'Модель', 'id': 'model_name'},
+            {'name': 'Статус', 'id': 'status'},
+            {'name': 'Результат', 'id': 'result'},
+            {'name': 'Стоимость', 'id': 'cost'},
+        ],
+        data=[],
+        page_action='custom',
+        page_current=0,
+        page_size=RESULTS_PAGE_SIZE,
+        page_count=1,
+        virtualization=True,
+        fixed_rows={'headers': True},
+        style_table={'height': '60vh', 'overflowY': 'auto'},
+        style_cell={'textAlign': 'left', 'minWidth': '120px'},
+    ),
+    html.Div(id='prediction-results-div')  # Сообщения об ошибках
 ])
 
 # Callback для отображения стоимости выбранной модели
@@ -119,8 +228,10 @@ def update_model_cost(model_name):
     if not model_name:
         return "Выберите модель, чтобы увидеть её стоимость."
 
-    model_costs = {"lr_model": 10, "gb_model": 20}  # Заменить на актуальные значения
-    cost = model_costs.get(model_name, "Модель не найдена")
+    try:
+        cost = fetch_model_costs().get(model_name, "Модель не найдена")
+    except requests.RequestException:
+        return "Не удалось получить стоимость модели."
     return f"Стоймость использования модели: {cost}"
 
 # Callback для получения модели
@@ -142,9 +253,10 @@ def login_callback(n_clicks, username, password):
     if not n_clicks:
         raise PreventUpdate
 
-    response = requests.post(
+    response = http.post(
         f"{backend_url}/token",
-        data={"username": username, "password": password}
+        data={"username": username, "password": password},
+        timeout=HTTP_TIMEOUT
     )
     if response.status_code == 200:
         session_data = response.json()
@@ -178,9 +290,10 @@ def register_callback(n_clicks, username, password):
     if not n_clicks:
         raise PreventUpdate
 
-    response = requests.post(
+    response = http.post(
         f"{backend_url}/users/register",
-        json={"username": username, "password": password}
+        json={"username": username, "password": password},
+        timeout=HTTP_TIMEOUT
     )
 
     if response.status_code == 200:
@@ -195,11 +308,8 @@ def register_callback(n_clicks, username, password):
 )
 def load_profile(session_data, pathname):
     if pathname == '/profile' and session_data and 'token' in session_data:
-        token = session_data['token']
-        headers = {"Authorization": f"Bearer {token}"}
-        response = requests.get(f"{backend_url}/users/me/", headers=headers)
-        if response.status_code == 200:
-            user_info = response.json()
+        user_info = fetch_profile(session_data['token'])
+        if user_info is not None:
             profile_info = html.Div([
                 html.P(f"Username: {user_info['username']}"),
                 html.P(f"ID: {user_info['id']}"),
@@ -227,30 +337,22 @@ def update_output(n_clicks, session_data, filename, content, selected_model):
         decoded = base64.b64decode(content_string)
         files = {'file': (filename, decoded)}
 
-        token = session_data.get('token', '')
-        headers = {"Authorization": f"Bearer {token}"}
-        response = requests.post(
-            f"{backend_url}/upload_file/",
+        # Загрузка файла и постановка задачи одним запросом
+        prediction_response = http.post(
+            f"{backend_url}/upload_and_predict/",
+            params={'model_name': selected_model},
             files=files,
-            headers=headers
+            headers=auth_headers(session_data),
+            timeout=HTTP_TIMEOUT
         )
-        if response.status_code == 200 and response.json()['file_id']:
-            file_id = response.json()['file_id']
-            print(file_id)
-            prediction_response = requests.post(
-                f"{backend_url}/predict/",
-                params={'file_id': file_id, 'model_name': selected_model},
-                headers=headers
-            )
-            if prediction_response.status_code == 200:
-                # Обработка успешного получения предсказания
-                return f"Модель: {prediction_response.json()}"
-            else:
-                # Обработка ошибки предсказания
-                return f"Ошибка в работе модели: {prediction_response.text}"
+        # Баланс изменился - профиль нужно перечитать
+        profile_cache.invalidate(session_data.get('token', ''))
+        if prediction_response.status_code == 200:
+            # Обработка успешного получения предсказания
+            return f"Модель: {prediction_response.json()}"
         else:
-            # Обработка ошибки загрузки файла
-            return f"Ошибка загрузки файла: {response.text}"
+            # Обработка ошибки загрузки файла или предсказания
+            return f"Ошибка в работе модели: {prediction_response.text}"
 
     return 'Загрузите файл и нажмите на кнопку'
 
@@ -264,7 +366,7 @@ def update_output(n_clicks, session_data, filename, content, selected_model):
 def refresh_status(n_clicks, job_id, token):
     if n_clicks:
         headers = {"Authorization": f"Bearer {token}"}
-        response = requests.get(f"{backend_url}/get_prediction_status/{job_id}", headers=headers)
+        response = http.get(f"{backend_url}/get_prediction_status/{job_id}", headers=headers, timeout=HTTP_TIMEOUT)
 
         if response.status_code == 200:
             status_data = response.json()
@@ -284,31 +386,43 @@ def refresh_status(n_clicks, job_id, token):
     return html.Div(id='prediction-status')
 
 
-# Callback, который загружает результаты предсказаний для пользователя
+# Callback, который загружает страницу результатов предсказаний для пользователя
 @app.callback(
-    Output('prediction-results-div', 'children'),
-    [Input('session', 'data')]
+    [Output('prediction-results-table', 'data'),
+     Output('prediction-results-table', 'page_count'),
+     Output('results-cursors', 'data'),
+     Output('prediction-results-div', 'children')],
+    [Input('prediction-results-table', 'page_current'),
+     Input('prediction-results-table', 'page_size'),
+     Input('session', 'data')],
+    [State('results-cursors', 'data')]
 )
-def load_prediction_results(session_data):
+def load_prediction_results(page_current, page_size, session_data, cursors):
     if not session_data or 'token' not in session_data:
         raise PreventUpdate
-    token = session_data['token']
+    page_current = page_current or 0
+    cursors = cursors or [None]
+    if dash.callback_context.triggered_id != 'prediction-results-table':
+        # Новая сессия или новый размер страницы: курсоры прежних страниц больше не действуют
+        page_current, cursors = 0, [None]
     user_id = session_data['user_id']
-    response = requests.get(f"{backend_url}/users/{user_id}/predictions", headers={"Authorization": f"Bearer {token}"})
-    print(user_id)
-    if response.status_code == 200:
-        predictions = response.json()
-        results = [
-            html.Div([
-                html.P(f"ID задачи: {prediction['job_id']}"),
-                html.P(f"Дата: {prediction['created_at']}"),
-                html.P(f"Результат: {prediction['result']}"),
-                html.Div(style={'height': '1px', 'backgroundColor': 'black'})
-            ]) for prediction in predictions
-        ]
-        return results
-    else:
-        return html.Div('Произошла ошибка при загрузке результатов предсказаний.')
+    # Бэкенд листает историю по ключу; к странице, курсор которой еще неизвестен, идем от последней известной
+    page = min(page_current, len(cursors) - 1)
+    while True:
+        response = http.get(f"{backend_url}/users/{user_id}/predictions",
+                            params={'limit': page_size, 'cursor': cursors[page]} if cursors[page] else
+                            {'limit': page_size},
+                            headers=auth_headers(session_data), timeout=HTTP_TIMEOUT)
+        if response.status_code != 200:
+            return [], 1, cursors, html.Div('Произошла ошибка при загрузке результатов предсказаний.')
+        next_cursor = response.headers.get('X-Next-Cursor')
+        cursors = cursors[:page + 1] + ([next_cursor] if next_cursor else [])
+        if page >= page_current or not next_cursor:
+            break
+        page += 1
+    # Общее число страниц неизвестно: показываем на одну больше, пока есть следующая
+    return response.json(), len(cursors), cursors, None
+
 
 # Callback для обновления страницы
 @app.callback(Output('page-content', 'children'),